@@ -0,0 +1,438 @@
+# benchmark.py - синтетическая БД и нагрузочный прогон эндпоинтов API
+#
+#   python benchmark.py generate --db bench/do_system.db --systems-per-do 20 --details-per-system 40
+#   python benchmark.py run --db bench/do_system.db --requests 50 --concurrency 8 --out before.json
+#
+# Результат - JSON с задержками, пропускной способностью, числом SQL-запросов
+# и пиковым RSS по каждому эндпоинту; два таких файла удобно сравнивать между коммитами.
+# Общий кэш воркеров (cache.SharedCache) на время прогона лежит во временном каталоге и
+# удаляется после него; с --cold он отключен, а кэш в памяти сбрасывается перед каждым запросом.
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode
+
+# Модули приложения (schema, database, main) импортируются внутри функций:
+# путь к БД читается из DO_SYSTEM_DB в момент их импорта
+
+# Реестр ДО как в рабочей БД: добыча, переработка, ПХГ, транспорт
+DO_NAMES = {
+    1: "ООО «Газпром добыча Ямбург»",
+    2: "ООО «Газпром добыча Уренгой»",
+    3: "ООО «Газпром добыча Надым»",
+    4: "ООО «Газпром добыча Ноябрьск»",
+    5: "ООО «Газпром добыча Оренбург»",
+    6: "ООО «Газпром добыча Астрахань»",
+    7: "ООО «Газпром добыча Краснодар»",
+    8: "ООО «Газпром добыча шельф Южно-Сахалинск»",
+    9: "ООО «Газпром добыча Иркутск»",
+    10: "ООО «Газпром добыча Кузнецк»",
+    11: "ООО «Газпром переработка»",
+    12: "ООО «Газпром ПХГ»",
+    13: "ООО «Газпром трансгаз Ухта»",
+    14: "ООО «Газпром трансгаз Махачкала»",
+    15: "ООО «Газпром трансгаз Ставрополь»",
+    16: "ООО «Газпром трансгаз Сургут»",
+    17: "ООО «Газпром трансгаз Волгоград»",
+    18: "ООО «Газпром трансгаз Югорск»",
+    19: "ООО «Газпром трансгаз Самара»",
+    20: "ООО «Газпром трансгаз Краснодар»",
+    21: "ООО «Газпром трансгаз Санкт-Петербург»",
+    22: "ООО «Газпром трансгаз Саратов»",
+    23: "ООО «Газпром трансгаз Чайковский»",
+    24: "ООО «Газпром трансгаз Беларусь»",
+    25: "ООО «Газпром трансгаз Нижний Новгород»",
+    26: "ООО «Газпром трансгаз Екатеринбург»",
+    27: "ООО «Газпром трансгаз Казань»",
+    28: "ООО «Газпром трансгаз Москва»",
+    29: "ООО «Газпром трансгаз Томск»",
+    30: "ООО «Газпром трансгаз Уфа»",
+    31: "АО «Газпром трансгаз Грозный»",
+    32: "ЗАО «Газпром Армения»",
+    33: "АО «Газпром газораспределение»",
+    34: "ООО «Газпром добыча Мурманск»",
+    35: "ООО «Газпром добыча Тамбей»",
+}
+
+SA_TYPES = ["АСУ ТП", "САУ ГПА", "СТМ", "АСПС", "СЛТМ"]
+
+SYSTEM_TYPES = [
+    "АСУ ТП УКПГ", "АСУ ТП УППГ", "САУ ГПА", "СТМ скважин", "АСПС", "СЛТМ МГ",
+    "АСУ ТП установки переработки", "АСУ ТП ГПЗ", "АСУ ТП КС ПХГ", "АСУ ТП ПХГ",
+    "САУ КЦ", "СТМ ГРС",
+]
+PLC_TYPES = ["Siemens S7-300", "Siemens S7-1500", "Allen-Bradley ControlLogix", "Schneider Modicon M580",
+             "ТЕКОН МФК3000", "Элеси ЭЛСИ-ТМК", "Прософт REGUL R500", None]
+SCADA_TYPES = ["WinCC", "WinCC OA", "Wonderware InTouch", "Trace Mode", "Альфа платформа", "MasterSCADA", None]
+IMPORT_STATUSES = [None, "Замещено", "Испытания", "Не замещено"]
+TEST_STAGES = [None, "Лабораторные", "Опытная эксплуатация", "Завершено"]
+
+INDICATOR_NAMES = {
+    "4": "Количество ЦДП", "7": "Количество ДП", "33": "Количество КС", "34": "Количество КЦ",
+    "54": "Протяженность МГ, км", "56": "Протяженность МГ, охваченная СЛТМ, км",
+    "63": "Протяженность ГО, км", "65": "Протяженность ГО, охваченная СЛТМ, км",
+    "85": "Количество ГПА", "94": "Количество ГРС", "95": "Количество ГРС, охваченных СЛТМ",
+}
+
+SCHEMA = """
+CREATE TABLE do (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE sa_types (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE sa (id INTEGER PRIMARY KEY, do_id INTEGER REFERENCES do(id), name TEXT,
+                 sa_type INTEGER REFERENCES sa_types(id));
+CREATE TABLE sa_data (id INTEGER PRIMARY KEY, sa_id INTEGER REFERENCES sa(id), year INTEGER);
+CREATE TABLE sa_data_details (id INTEGER PRIMARY KEY, sa_data_id INTEGER REFERENCES sa_data(id),
+                              detail_json TEXT, import_status TEXT, test_stage TEXT);
+CREATE TABLE automation_summary (id INTEGER PRIMARY KEY, do_id INTEGER REFERENCES do(id), year INTEGER,
+                                 indicator_id TEXT, indicator TEXT, value TEXT);
+"""
+
+# Дополнительные варианты запросов к тем же маршрутам
+EXTRA_CASES = [
+    ("/api/do-list", {"include": "summary"}),
+    ("/api/do/{do_id}/tech-data", {"format": "ndjson"}),
+    ("/api/do/{do_id}/tech-data", {"fields": "Наименование объекта", "limit": 100}),
+    ("/api/analytics/transport/condition-detailed", {"aggregate": "true"}),
+    ("/api/import-substitution/systems", {"import_status": "Замещено"}),
+]
+
+
+# === ГЕНЕРАЦИЯ БД ===
+def _detail_json(rng: random.Random, do_name: str, index: int) -> str:
+    install_year = rng.randint(1985, 2023)
+    detail = {
+        "Наименование ДО": do_name,
+        "Наименование объекта": f"Объект {index}",
+        "Вид системы автоматизации": rng.choice(SYSTEM_TYPES),
+        # В выгрузках год встречается и числом, и строкой, и пустым
+        "Год внедрения системы автоматизации": rng.choice([install_year] * 6 + [str(install_year), "", None]),
+        "Функциональность, %": rng.choice([rng.randint(20, 100)] * 4 + [f"{rng.uniform(20, 100):.1f}", ""]),
+        "Эксплуатационный износ": rng.choice([rng.randint(0, 100)] * 4 + [str(rng.randint(0, 100))]),
+        "Тип ПЛК": rng.choice(PLC_TYPES),
+        "Тип SCADA": rng.choice(SCADA_TYPES),
+        "Количество сигналов": rng.randint(50, 20000),
+        "Резервирование": rng.choice(["Да", "Нет", "Частичное"]),
+        "Разработчик": rng.choice(["ООО «Газавтоматика»", "АО «Атлантиктрансгазсистема»", "ООО «Прософт-Системы»"]),
+        "Примечание": rng.choice(["", "Требуется модернизация", "Входит в программу реконструкции"]),
+    }
+    return json.dumps(detail, ensure_ascii=False)
+
+
+def generate(path: str, systems_per_do: int, details_per_system: int, years, seed: int = 1):
+    """Создает синтетическую do_system.db со схемой рабочей БД"""
+    from schema import AUTOMATION_INDICATORS
+
+    rng = random.Random(seed)
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        Path(str(target) + suffix).unlink(missing_ok=True)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO do (id, name) VALUES (?, ?)", DO_NAMES.items())
+    conn.executemany("INSERT INTO sa_types (id, name) VALUES (?, ?)", enumerate(SA_TYPES, 1))
+
+    sa_id = sa_data_id = detail_id = 0
+    details = []
+    for do_id, do_name in DO_NAMES.items():
+        for _ in range(systems_per_do):
+            sa_id += 1
+            conn.execute("INSERT INTO sa (id, do_id, name, sa_type) VALUES (?, ?, ?, ?)",
+                         (sa_id, do_id, f"{rng.choice(SYSTEM_TYPES)} №{sa_id}", rng.randint(1, len(SA_TYPES))))
+            for year in years:
+                sa_data_id += 1
+                conn.execute("INSERT INTO sa_data (id, sa_id, year) VALUES (?, ?, ?)", (sa_data_id, sa_id, year))
+                for _ in range(rng.randint(details_per_system // 2, details_per_system * 3 // 2)):
+                    detail_id += 1
+                    details.append((detail_id, sa_data_id, _detail_json(rng, do_name, detail_id),
+                                    rng.choice(IMPORT_STATUSES), rng.choice(TEST_STAGES)))
+                if len(details) >= 10000:
+                    conn.executemany("INSERT INTO sa_data_details VALUES (?, ?, ?, ?, ?)", details)
+                    details.clear()
+        for year in years:
+            conn.executemany(
+                "INSERT INTO automation_summary (do_id, year, indicator_id, indicator, value) VALUES (?, ?, ?, ?, ?)",
+                [(do_id, year, indicator_id, INDICATOR_NAMES.get(indicator_id, f"Показатель {indicator_id}"),
+                  str(rng.randint(1, 5000)) if AUTOMATION_INDICATORS[indicator_id] == "INTEGER"
+                  else f"{rng.uniform(10, 15000):.3f}")
+                 for indicator_id in AUTOMATION_INDICATORS]
+            )
+    conn.executemany("INSERT INTO sa_data_details VALUES (?, ?, ?, ?, ?)", details)
+    conn.commit()
+    conn.close()
+
+    print(f"✅ {path}: {len(DO_NAMES)} ДО, {sa_id} систем, {detail_id} записей sa_data_details "
+          f"за {time.perf_counter() - started:.1f} с")
+
+
+# === ПРОГОН ===
+class SQLCounter:
+    """Считает SQL-операторы, выполненные на соединениях пула"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement):
+        with self._lock:
+            self.count += 1
+
+
+class RSSSampler:
+    """Пиковый RSS процесса за время прогона одного эндпоинта"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # ru_maxrss - пик за все время процесса (КиБ в Linux)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # Метод ближайшего ранга: ceil(p * N) - номер элемента, начиная с 1
+    index = min(len(ordered) - 1, max(0, math.ceil(p * len(ordered) / 100) - 1))
+    return ordered[index]
+
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        "p50": round(percentile(ms, 50), 3),
+        "p95": round(percentile(ms, 95), 3),
+        "p99": round(percentile(ms, 99), 3),
+        "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "max": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+def collect_cases(app, do_id: int):
+    """Все GET-маршруты /api/* приложения плюс EXTRA_CASES"""
+    from fastapi.routing import APIRoute
+
+    cases = []
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path.startswith("/api/") and "GET" in route.methods:
+            cases.append((route.path, {}))
+    cases.extend(EXTRA_CASES)
+
+    result = []
+    seen = set()
+    for path, params in cases:
+        url = path.replace("{do_id}", str(do_id))
+        if params:
+            url += "?" + urlencode(params)
+        name = path + ("?" + urlencode(params) if params else "")
+        if name not in seen:
+            seen.add(name)
+            result.append((name, url))
+    return result
+
+
+async def _measure(client, url: str, cold: bool, caches):
+    if cold:
+        for cache in caches:
+            cache.clear()
+    started = time.perf_counter()
+    response = await client.get(url)
+    elapsed = time.perf_counter() - started
+    return elapsed, response.status_code, len(response.content)
+
+
+async def bench_endpoint(client, url: str, requests: int, concurrency: int, cold: bool,
+                         counter: SQLCounter, caches):
+    await _measure(client, url, cold, caches)  # прогрев
+
+    with RSSSampler() as rss:
+        # Последовательно: чистая задержка и число SQL-запросов на один вызов
+        sql_before = counter.count
+        sequential = []
+        status = size = None
+        for _ in range(requests):
+            elapsed, status, size = await _measure(client, url, cold, caches)
+            sequential.append(elapsed)
+        sql_per_request = (counter.count - sql_before) / requests
+
+        # Параллельно: пропускная способность при concurrency одновременных клиентах
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                elapsed, _, _ = await _measure(client, url, cold, caches)
+                return elapsed
+
+        started = time.perf_counter()
+        concurrent = await asyncio.gather(*(one() for _ in range(requests)))
+        wall = time.perf_counter() - started
+
+    return {
+        "status": status,
+        "response_bytes": size,
+        "requests": requests,
+        "latency_ms": latency_summary(sequential),
+        "concurrent": {
+            "concurrency": concurrency,
+            "throughput_rps": round(requests / wall, 2) if wall else None,
+            "latency_ms": latency_summary(concurrent),
+        },
+        "sql_statements": round(sql_per_request, 2),
+        "peak_rss_mib": round(rss.peak / 1024 / 1024, 2),
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def run(args):
+    # Путь к БД должен быть известен до импорта main/database
+    os.environ["DO_SYSTEM_DB"] = str(Path(args.db).resolve())
+    # Общий кэш - во временном каталоге прогона, а не общий кэш пользователя; с --cold он отключен,
+    # иначе "холодные" запросы обслуживал бы он
+    cache_dir = tempfile.TemporaryDirectory(prefix="do-bench-")
+    os.environ["DO_SHARED_CACHE_PATH"] = "" if args.cold else str(Path(cache_dir.name) / "results.cache")
+    try:
+        await _run(args)
+    finally:
+        from cache import shared_cache
+        shared_cache.close()
+        cache_dir.cleanup()
+
+
+async def _run(args):
+    import httpx
+    import database as db
+    from cache import response_cache, shared_cache
+    from main import app
+
+    counter = SQLCounter()
+
+    def traced(connect):
+        def traced_connect():
+            conn = connect()
+            conn.set_trace_callback(counter)
+            return conn
+        return traced_connect
+
+    db.pool._connect = traced(db.pool._connect)
+    db.stream_pool._connect = traced(db.stream_pool._connect)
+
+    with sqlite3.connect(args.db) as conn:
+        do_id = conn.execute("""
+            SELECT s.do_id FROM sa s GROUP BY s.do_id ORDER BY COUNT(*) DESC, s.do_id LIMIT 1
+        """).fetchone()[0]
+        detail_rows = conn.execute("SELECT COUNT(*) FROM sa_data_details").fetchone()[0]
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "db": args.db,
+            "detail_rows": detail_rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "cold_cache": args.cold,
+        },
+        "endpoints": {},
+    }
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, url in collect_cases(app, do_id):
+                if args.only and args.only not in name:
+                    continue
+                result = await bench_endpoint(client, url, args.requests, args.concurrency, args.cold,
+                                              counter, (response_cache, shared_cache))
+                report["endpoints"][name] = result
+                print(f"{name:70} p50 {result['latency_ms']['p50']:9.2f} мс  "
+                      f"p99 {result['latency_ms']['p99']:9.2f} мс  "
+                      f"{result['concurrent']['throughput_rps']:8.1f} rps  "
+                      f"SQL {result['sql_statements']:6.1f}", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(output, encoding="utf-8")
+        print(f"✅ Результаты записаны в {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк эндпоинтов СА ДО API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="создать синтетическую БД")
+    gen.add_argument("--db", default="bench/do_system.db")
+    gen.add_argument("--systems-per-do", type=int, default=20)
+    gen.add_argument("--details-per-system", type=int, default=40)
+    gen.add_argument("--years", default="2021,2022,2023", help="годы через запятую")
+    gen.add_argument("--seed", type=int, default=1)
+
+    bench = commands.add_parser("run", help="прогнать все эндпоинты /api")
+    bench.add_argument("--db", default="bench/do_system.db")
+    bench.add_argument("--requests", type=int, default=50, help="запросов на эндпоинт в каждой фазе")
+    bench.add_argument("--concurrency", type=int, default=8)
+    bench.add_argument("--cold", action="store_true", help="без общего кэша воркеров, кэш ответов сбрасывается перед каждым запросом")
+    bench.add_argument("--only", help="только эндпоинты, содержащие подстроку")
+    bench.add_argument("--out", help="файл для JSON-отчета (по умолчанию stdout)")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        years = [int(year) for year in args.years.split(",") if year.strip()]
+        generate(args.db, args.systems_per_do, args.details_per_system, years, args.seed)
+    else:
+        if not Path(args.db).exists():
+            parser.error(f"{args.db} не найдена, сначала выполните generate")
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+# cache.py - кэш результатов аналитических запросов
+#
+# run_cached() проверяет два уровня: TTLCache в памяти процесса и SharedCache - файл SQLite
+# (DO_SHARED_CACHE_PATH, по умолчанию в личном каталоге пользователя под XDG_RUNTIME_DIR или
+# временным каталогом; пустое значение отключает), общий для всех воркеров uvicorn. Результат
+# считается один раз на версию данных во всем развертывании.
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import database as db
+from schema import DB_PATH
+
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL = 600  # сек; кроме того, кэш сбрасывается при любом изменении БД
+YEAR_CACHE_MAX_ENTRIES = 4096
+
+
+def default_shared_cache_path(db_path: str = DB_PATH) -> str:
+    """Файл общего кэша для БД: XDG_RUNTIME_DIR/do-dashboard или <tmp>/do-dashboard-<uid>.
+
+    Имя файла привязано к полному пути БД, чтобы разные базы не делили кэш.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        directory = os.path.join(runtime_dir, "do-dashboard")
+    else:
+        directory = os.path.join(tempfile.gettempdir(), f"do-dashboard-{os.getuid()}")
+    digest = hashlib.sha1(os.path.abspath(db_path).encode()).hexdigest()[:12]
+    return os.path.join(directory, f"{Path(db_path).stem}-{digest}.cache")
+
+
+SHARED_CACHE_PATH = os.environ.get("DO_SHARED_CACHE_PATH")
+if SHARED_CACHE_PATH is None:
+    SHARED_CACHE_PATH = default_shared_cache_path()
+SHARED_CACHE_MAX_ENTRIES = 4096
+SHARED_CACHE_MAX_VALUE_BYTES = 16 * 1024 * 1024  # больше - не кладется в общий кэш
+# Время обращения обновляется не чаще раза в интервал: LRU приблизительный, зато попадание - только чтение
+SHARED_CACHE_TOUCH_INTERVAL = 5
+# Сколько ждать результат, который считает другой воркер; потом заявка считается брошенной
+SHARED_CACHE_CLAIM_TIMEOUT = 30
+SHARED_CACHE_POLL_INTERVAL = 0.02
+SHARED_CACHE_BUSY_TIMEOUT = 1.0
+
+_MISSING = object()
+_PENDING = object()
+
+
+class TTLCache:
+    """LRU-кэш с ограничением по размеру, TTL и привязкой к версии данных"""
+
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self._version:
+                # Данные в БД изменились - весь кэш устарел
+                if self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self._version = version
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, version):
+        with self._lock:
+            if version != self._version:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "data_version": self._version
+            }
+
+
+response_cache = TTLCache()
+
+
+class YearCache:
+    """Результаты по отдельным годам: (запрос, параметры, год) -> (версия года, значение).
+
+    В отличие от TTLCache не сбрасывается целиком при изменении БД: запись
+    действует, пока не изменилась версия ее года в year_versions. Прошлые годы
+    считаются один раз, пересчитываются только измененные годы.
+    """
+
+    def __init__(self, maxsize: int = YEAR_CACHE_MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key, versions):
+        """versions - {год: версия}; возвращает ({год: значение} из кэша, [годы для расчета])"""
+        found, missing = {}, []
+        with self._lock:
+            for year, version in versions.items():
+                entry = self._data.get(key + (year,))
+                if entry is not None and entry[0] == version:
+                    self._data.move_to_end(key + (year,))
+                    found[year] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(year)
+                    self.misses += 1
+        return found, missing
+
+    def store(self, key, values, versions):
+        with self._lock:
+            for year, value in values.items():
+                self._data[key + (year,)] = (versions[year], value)
+                self._data.move_to_end(key + (year,))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "evictions": self.evictions
+            }
+
+
+year_cache = YearCache()
+
+
+class SharedCache:
+    """Кэш результатов в файле SQLite, общий для процессов-воркеров.
+
+    Запись действует, пока отпечаток файлов БД (DataVersion.stamp) тот же, что при расчете;
+    при переполнении вытесняются записи с самым старым обращением. Значения хранятся в JSON
+    (из файла не исполняется код), а сам файл доступен только владельцу (0600).
+    Пока воркер считает результат, в таблице лежит его заявка (value IS NULL) - остальные ждут ее.
+    Ошибки файла кэша не ломают запросы: они считаются промахом.
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, maxsize: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.maxsize = maxsize
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _prepare_file(self):
+        """Создает файл кэша с правами 0600; чужой файл или открытый для других каталог - ошибка"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if self.path == default_shared_cache_path():
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            info = os.stat(directory)
+            if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+                raise PermissionError(f"каталог кэша {directory} доступен другим пользователям")
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_uid != os.getuid():
+                raise PermissionError(f"файл кэша {self.path} принадлежит другому пользователю")
+            # -wal и -shm SQLite создает с правами основного файла
+            os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._prepare_file()
+            conn = sqlite3.connect(self.path, timeout=SHARED_CACHE_BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")  # кэш можно потерять, БД он не заменяет
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    stamp TEXT NOT NULL,
+                    value BLOB,
+                    owner INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def _error(self, action: str, e: Exception):
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            print(f"⚠️ Ошибка общего кэша ({action}, всего {self.errors}): {e}")
+        if isinstance(e, sqlite3.DatabaseError) and self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, key, stamp: str):
+        """Значение, _PENDING (считается другим воркером) или _MISSING"""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT stamp, value, stored_at, accessed_at FROM results WHERE key = ?",
+                                   (repr(key),)).fetchone()
+                if row is None or row[0] != stamp:
+                    self.misses += 1
+                    return _MISSING
+                if row[1] is None:
+                    return _PENDING if now - row[2] < SHARED_CACHE_CLAIM_TIMEOUT else _MISSING
+                if now - row[3] > SHARED_CACHE_TOUCH_INTERVAL:
+                    conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, repr(key)))
+                value = json.loads(row[1])
+            except ValueError as e:
+                # Испорченная или старая (не JSON) запись - удаляется, иначе ее не заменит claim()
+                self._error("чтение", e)
+                try:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (repr(key),))
+                except sqlite3.Error:
+                    pass
+                return _MISSING
+            except (sqlite3.Error, OSError) as e:
+                self._error("чтение", e)
+                return _MISSING
+            self.hits += 1
+            return value
+
+    def claim(self, key, stamp: str) -> bool:
+        """Заявка на расчет; False - результат уже есть или его считает другой воркер"""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute("SELECT stamp, value IS NULL, stored_at FROM results WHERE key = ?",
+                                       (repr(key),)).fetchone()
+                    if row and row[0] == stamp and (not row[1] or now - row[2] < SHARED_CACHE_CLAIM_TIMEOUT):
+                        conn.execute("ROLLBACK")
+                        return False
+                    conn.execute("""
+                        INSERT OR REPLACE INTO results (key, stamp, value, owner, stored_at, accessed_at)
+                        VALUES (?, ?, NULL, ?, ?, ?)
+                    """, (repr(key), stamp, os.getpid(), now, now))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except (sqlite3.Error, OSError) as e:
+                self._error("заявка", e)
+                return True  # без общего кэша воркер считает сам
+            return True
+
+    def release(self, key, stamp: str):
+        """Снимает свою заявку, если расчет не удался"""
+        with self._lock:
+            try:
+                self._connect().execute(
+                    "DELETE FROM results WHERE key = ? AND stamp = ? AND value IS NULL AND owner = ?",
+                    (repr(key), stamp, os.getpid()))
+            except (sqlite3.Error, OSError) as e:
+                self._error("снятие заявки", e)
+
+    def set(self, key, value, stamp: str):
+        try:
+            blob = json.dumps(value, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode()
+            # Кортежи, нестроковые ключи и т.п. JSON не сохраняет - такие значения не кэшируются
+            if json.loads(blob) != value:
+                raise TypeError(f"{type(value).__name__} меняется при сериализации в JSON")
+        except (TypeError, ValueError) as e:
+            self._error("сериализация", e)
+            blob = None
+        if blob is None or len(blob) > SHARED_CACHE_MAX_VALUE_BYTES:
+            self.release(key, stamp)
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("""
+                        INSERT OR REPLACE INTO results (key, stamp, value, owner, stored_at, accessed_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (repr(key), stamp, blob, os.getpid(), now, now))
+                    excess = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.maxsize
+                    if excess > 0:
+                        conn.execute("""
+                            DELETE FROM results WHERE key IN (
+                                SELECT key FROM results ORDER BY accessed_at LIMIT ?
+                            )
+                        """, (excess,))
+                        self.evictions += excess
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except (sqlite3.Error, OSError) as e:
+                self._error("запись", e)
+                return
+            self.stores += 1
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                self._connect().execute("DELETE FROM results")
+            except (sqlite3.Error, OSError) as e:
+                self._error("очистка", e)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        with self._lock:
+            entries = None
+            if self.enabled:
+                try:
+                    entries = self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                except (sqlite3.Error, OSError) as e:
+                    self._error("статистика", e)
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "path": self.path or None,
+                "entries": entries,
+                "max_entries": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "waits": self.waits,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "data_stamp": db.data_version.stamp
+            }
+
+
+shared_cache = SharedCache()
+_inflight = {}
+
+
+async def _run_shared(fn, key, args):
+    """db.run() через общий кэш воркеров: готовый результат, ожидание чужого расчета или свой расчет"""
+    if not shared_cache.enabled:
+        return await db.run(fn, *args)
+    loop = asyncio.get_running_loop()
+    # Отпечаток берется до расчета: данные результата не старее отпечатка, под которым он сохранен
+    stamp = db.data_version.stamp
+    deadline = time.monotonic() + SHARED_CACHE_CLAIM_TIMEOUT
+    waited = False
+    while True:
+        value = await loop.run_in_executor(None, shared_cache.get, key, stamp)
+        if value is not _MISSING and value is not _PENDING:
+            return value
+        if value is _MISSING and await loop.run_in_executor(None, shared_cache.claim, key, stamp):
+            break
+        if time.monotonic() > deadline:
+            break
+        if not waited:
+            shared_cache.waits += 1
+            waited = True
+        await asyncio.sleep(SHARED_CACHE_POLL_INTERVAL)
+
+    try:
+        value = await db.run(fn, *args)
+    except BaseException:
+        await loop.run_in_executor(None, shared_cache.release, key, stamp)
+        raise
+    await loop.run_in_executor(None, shared_cache.set, key, value, stamp)
+    return value
+
+
+async def run_cached(fn, *args):
+    """db.run() с кэшированием по (запрос, параметры); одновременные промахи считаются один раз
+    в процессе, а через shared_cache - один раз на версию данных для всех воркеров"""
+    key = (fn.__name__,) + args
+    version = db.data_version.check()
+    value = response_cache.get(key, version)
+    if value is not _MISSING:
+        return value
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # отменен сам ожидающий
+            # Отменен запрос, который считал результат, - считаем заново
+            return await run_cached(fn, *args)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        value = await _run_shared(fn, key, args)
+        response_cache.set(key, value, version)
+        future.set_result(value)
+        return value
+    except Exception as e:
+        future.set_exception(e)
+        # Исключение уже передано ожидающим; не оставляем его "неполученным"
+        future.exception()
+        raise
+    finally:
+        # Отмена (обрыв клиента, wait_for) - не Exception: ожидающие узнают о ней из future
+        if not future.done():
+            future.cancel()
+        del _inflight[key]
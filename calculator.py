@@ -0,0 +1,232 @@
+# calculator.py - модель оценки стандарта (как в калькуляторе index.html), векторизованная на NumPy
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+try:
+    import numpy as np
+except ImportError:  # без NumPy пакетный расчет недоступен, остальной API работает
+    np = None
+
+CRITERIA = ("A", "B", "C", "D", "E", "F")
+MAX_SCORE = 5
+
+# Веса W1..W4 по критичности стандарта (weights в index.html; W5 в модели не участвует)
+WEIGHTS = {
+    "safety": (0.35, 0.25, 0.15, 0.15),
+    "reliability": (0.25, 0.35, 0.15, 0.15),
+    "standard": (0.20, 0.20, 0.20, 0.20),
+}
+CRITICALITIES = tuple(WEIGHTS)
+
+T0 = 6            # базовое время устаревания, лет
+LAMBDA0 = 0.15    # базовая интенсивность устаревания
+
+# Пороги общего балла -> уровень зрелости 5..2 (ниже последнего - 1)
+MATURITY_THRESHOLDS = (25, 20, 15, 8)
+MATURITY_TEXT = {
+    5: "Оптимизирован",
+    4: "Актуализированный",
+    3: "Рабочий",
+    2: "Устаревающий",
+    1: "Устаревший",
+}
+RECOMMENDATIONS = {
+    5: "Поддерживать, ревизия по плану",
+    4: "Актуализировать в течение 2-3 лет",
+    3: "Частичная актуализация в 1-2 года",
+    2: "Приоритетная ревизия в годовом плане",
+    1: "Утилизация или полная переработка",
+}
+
+# Оценки, выводимые из sa_data_details, если их не передали явно:
+#   A (актуальность)     - по возрасту системы, 5 баллов до 5 лет, минус балл за каждые 5 лет
+#   B (применимость)     - по эксплуатационному износу: 5 * (1 - износ / 100)
+#   C (использование)    - по функциональности: функциональность / 20
+#   D (детализация)      - доля заполненных полей карточки системы
+#   E (совместимость)    - данных нет, нейтральные 3 балла
+#   F (импортозамещение) - по статусу импортозамещения
+DEFAULT_SCORE = 3
+IMPORT_STATUS_SCORES = {"Замещено": 5, "Испытания": 3, "Не замещено": 1}
+
+
+class CalculatorSystem(BaseModel):
+    id: Optional[Union[int, str]] = None
+    scores: Dict[str, float]
+    criticality: Optional[str] = None
+    horizon: Optional[float] = Field(None, gt=0)
+
+
+class CalculatorBatchRequest(BaseModel):
+    """Либо явный список систем, либо расчет по sa_data_details (всех ДО или одного do_id)"""
+    systems: Optional[List[CalculatorSystem]] = None
+    do_id: Optional[int] = None
+    criticality: str = "standard"
+    horizon: float = Field(3, gt=0)
+    curve_years: int = Field(10, ge=1, le=50)
+    include_systems: bool = True
+    # Опорный год для оценки A по возрасту системы; по умолчанию - DEFAULT_REFERENCE_YEAR (schema.py)
+    reference_year: Optional[int] = Field(None, ge=1950, le=2100)
+
+
+def maturity_levels(total):
+    return np.select([total >= t for t in MATURITY_THRESHOLDS], [5, 4, 3, 2], default=1)
+
+
+def evaluate(scores, criticality, horizon):
+    """Модель calculateStandardMetrics для n систем сразу.
+
+    scores - массив (n, 6) оценок A..F, criticality - индексы в CRITICALITIES,
+    horizon - горизонт анализа в годах (скаляр или массив n).
+    """
+    scores = np.asarray(scores, dtype=float)
+    a, b, c, d = scores[:, 0], scores[:, 1], scores[:, 2], scores[:, 3]
+    total = scores.sum(axis=1)
+    normalized = total / (MAX_SCORE * len(CRITERIA))
+
+    factors = np.column_stack([1 - a / MAX_SCORE, c / MAX_SCORE, b / MAX_SCORE, 1 - d / MAX_SCORE])  # R, M, T, L
+    weights = np.array([WEIGHTS[name] for name in CRITICALITIES])[np.asarray(criticality)]
+    deterministic_tout = T0 - (weights * factors).sum(axis=1)
+
+    lam = LAMBDA0 * (1 + (1 - normalized))
+    probability = 1 - np.exp(-lam * np.asarray(horizon, dtype=float))
+
+    return {
+        "total": total,
+        "maturity": maturity_levels(total),
+        "factors": factors,
+        "deterministic_tout": deterministic_tout,
+        "lambda": lam,
+        "probability": probability,
+    }
+
+
+def probability_curves(lam, years: int, maturity=None):
+    """Кривые P_out(t) = 1 - e^(-λt) по парку: среднее, перцентили и ожидаемое число устаревших"""
+    t = np.arange(years + 1, dtype=float)
+    if len(lam) == 0:
+        empty = [0.0] * len(t)
+        return {"years": t.astype(int).tolist(), "mean": empty, "p10": empty, "p50": empty, "p90": empty,
+                "expected_obsolete": empty, "by_maturity": {}}
+
+    p = 1 - np.exp(-np.outer(lam, t))
+    p10, p50, p90 = np.percentile(p, [10, 50, 90], axis=0)
+    curves = {
+        "years": t.astype(int).tolist(),
+        "mean": np.round(p.mean(axis=0), 4).tolist(),
+        "p10": np.round(p10, 4).tolist(),
+        "p50": np.round(p50, 4).tolist(),
+        "p90": np.round(p90, 4).tolist(),
+        "expected_obsolete": np.round(p.sum(axis=0), 2).tolist(),
+        "by_maturity": {},
+    }
+    if maturity is not None:
+        for level in sorted(set(maturity.tolist()), reverse=True):
+            curves["by_maturity"][str(level)] = np.round(p[maturity == level].mean(axis=0), 4).tolist()
+    return curves
+
+
+def derive_scores(rows, current_year: int):
+    """Оценки A..F из строк (install_year, wear, functionality, import_status, filled_fields, total_fields)"""
+    n = len(rows)
+    install_year = np.array([row[0] if row[0] else np.nan for row in rows], dtype=float).reshape(n)
+    wear = np.array([np.nan if row[1] is None else row[1] for row in rows], dtype=float).reshape(n)
+    functionality = np.array([np.nan if row[2] is None else row[2] for row in rows], dtype=float).reshape(n)
+    import_score = np.array([IMPORT_STATUS_SCORES.get(row[3], 2) for row in rows], dtype=float).reshape(n)
+    filled = np.array([row[4] / row[5] if row[5] else 0 for row in rows], dtype=float).reshape(n)
+
+    age = current_year - install_year
+    scores = np.column_stack([
+        np.clip(MAX_SCORE - np.floor(np.maximum(age - 1, 0) / 5), 0, MAX_SCORE),
+        np.round(MAX_SCORE * (1 - np.clip(wear, 0, 100) / 100)),
+        np.round(np.clip(functionality, 0, 100) / 20),
+        np.round(MAX_SCORE * filled),
+        np.full(n, DEFAULT_SCORE, dtype=float),
+        import_score,
+    ]) if n else np.zeros((0, len(CRITERIA)))
+    # Нет данных - нейтральная оценка
+    return np.where(np.isnan(scores), DEFAULT_SCORE, scores)
+
+
+def explicit_scores(systems: List[CalculatorSystem]):
+    """Матрица оценок A..F из запроса; отсутствующие критерии - нейтральные 3 балла"""
+    scores = np.array([[system.scores.get(key, DEFAULT_SCORE) for key in CRITERIA] for system in systems],
+                      dtype=float).reshape(len(systems), len(CRITERIA))
+    if ((scores < 0) | (scores > MAX_SCORE)).any():
+        raise ValueError(f"Оценки должны быть в диапазоне 0..{MAX_SCORE}")
+    return scores
+
+
+def criticality_index(name: str) -> int:
+    if name not in WEIGHTS:
+        raise ValueError(f"Неизвестная критичность '{name}', допустимо: {', '.join(CRITICALITIES)}")
+    return CRITICALITIES.index(name)
+
+
+def explicit_inputs(request: CalculatorBatchRequest):
+    """ids, оценки, критичность и горизонт для явно переданных систем"""
+    systems = request.systems
+    ids = [system.id if system.id is not None else i + 1 for i, system in enumerate(systems)]
+    criticality = np.array([criticality_index(system.criticality or request.criticality) for system in systems],
+                           dtype=int)
+    horizon = np.array([system.horizon or request.horizon for system in systems], dtype=float)
+    return ids, explicit_scores(systems), criticality, horizon
+
+
+def derived_inputs(rows, request: CalculatorBatchRequest, current_year: int):
+    """То же для строк sa_data_details: (id, do_id, install_year, wear, functionality,
+    import_status, filled_fields, total_fields)"""
+    ids = [row[0] for row in rows]
+    extra = [{"do_id": row[1]} for row in rows]
+    scores = derive_scores([row[2:] for row in rows], current_year)
+    criticality = np.full(len(rows), criticality_index(request.criticality), dtype=int)
+    return ids, scores, criticality, request.horizon, extra
+
+
+def batch_result(ids, scores, criticality, horizon, curve_years: int, include_systems: bool, extra=None):
+    """Ответ /api/calculator/batch: результаты по системам, сводка и кривые по парку"""
+    result = evaluate(scores, criticality, horizon)
+    maturity = result["maturity"]
+
+    response = {
+        "count": len(ids),
+        "summary": {
+            "maturity_levels": {str(level): int((maturity == level).sum()) for level in MATURITY_TEXT},
+            "mean_total_score": round(float(result["total"].mean()), 2) if len(ids) else 0,
+            "mean_deterministic_tout": round(float(result["deterministic_tout"].mean()), 3) if len(ids) else 0,
+            "mean_probability": round(float(result["probability"].mean()), 4) if len(ids) else 0,
+        },
+        "curves": probability_curves(result["lambda"], curve_years, maturity),
+    }
+
+    if include_systems:
+        columns = zip(
+            ids,
+            result["total"].tolist(),
+            maturity.tolist(),
+            np.round(result["deterministic_tout"], 3).tolist(),
+            np.round(result["lambda"], 4).tolist(),
+            np.round(result["probability"], 4).tolist(),
+            np.round(result["factors"], 3).tolist(),
+            scores.tolist(),
+        )
+        systems = []
+        for i, (system_id, total, level, tout, lam, probability, (r, m, t, l), row_scores) in enumerate(columns):
+            item = {
+                "id": system_id,
+                "scores": dict(zip(CRITERIA, row_scores)),
+                "total_score": total,
+                "maturity_level": level,
+                "maturity_text": MATURITY_TEXT[level],
+                "deterministic_tout": tout,
+                "lambda": lam,
+                "probability": probability,
+                "recommendation": RECOMMENDATIONS[level],
+                "factors": {"R": r, "M": m, "T": t, "L": l},
+            }
+            if extra is not None:
+                item.update(extra[i])
+            systems.append(item)
+        response["systems"] = systems
+
+    return response
@@ -0,0 +1,594 @@
+# columnar.py - колоночный снимок sa_data_details в памяти (NumPy) для аналитических запросов
+#
+# Бэкенд выбирается переменной окружения DO_ANALYTICS_BACKEND:
+#   sql    - запросы к SQLite (по умолчанию)
+#   memory - сводки, возраст, проблемные системы и типы считаются по снимку в памяти
+# Снимок перечитывается, когда меняется ревизия sa_data_details (data_revisions);
+# до конца загрузки запросы ждут, старый снимок подменяется новым одной операцией.
+#
+# Снимок хранится и в файле (DO_SNAPSHOT_PATH, по умолчанию <БД>.columns): воркер отображает
+# его в память только для чтения (mmap), массивы NumPy смотрят прямо в файл, поэтому старт
+# занимает миллисекунды, а N воркеров делят одни страницы кэша ОС. Файл пишет воркер, первым
+# заметивший новую ревизию; остальные ждут его и открывают готовый файл.
+#
+#   python columnar.py build   - записать файл снимка из do_system.db
+#   python columnar.py info    - заголовок и секции файла снимка
+#
+# Формат файла (little-endian):
+#   [0:8] SNAPSHOT_MAGIC, [8:16] смещение заголовка, [16:24] длина заголовка
+#   секции, выровненные по 8 байт: числовые колонки фиксированной ширины, коды строк int32,
+#   словари строк (смещения uint64 + UTF-8), область detail_json и смещение/длина JSON каждой строки
+#   JSON-заголовок в конце: формат, ревизия данных, число строк, {секция: [dtype, смещение, количество]}
+# Заголовок пишется последним, поэтому detail_json выгружается потоком в порядке id, без сортировки.
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from functools import cached_property
+
+try:
+    import numpy as np
+except ImportError:  # без NumPy доступен только бэкенд sql
+    np = None
+
+import database as db
+from schema import DB_PATH, ensure_data_revisions, query_data_revision
+
+BACKENDS = ("sql", "memory")
+
+ANALYTICS_BACKEND = os.environ.get("DO_ANALYTICS_BACKEND", "sql").strip().lower()
+if ANALYTICS_BACKEND not in BACKENDS:
+    print(f"⚠️ Неизвестный DO_ANALYTICS_BACKEND '{ANALYTICS_BACKEND}', используется sql")
+    ANALYTICS_BACKEND = "sql"
+elif ANALYTICS_BACKEND == "memory" and np is None:
+    print("⚠️ NumPy не установлен, DO_ANALYTICS_BACKEND=memory недоступен - используется sql")
+    ANALYTICS_BACKEND = "sql"
+
+# Порог износа и функциональности проблемной системы (как в SQL-запросах main.py)
+HIGH_WEAR = 70
+LOW_FUNCTIONALITY = 50
+PROBLEM_SYSTEMS_LIMIT = 20
+
+# Возрастные группы с шагом 5 лет: (верхняя граница включительно, название); остальное - последняя
+AGE_GROUPS = ((5, "0-5 лет"), (10, "6-10 лет"), (15, "11-15 лет"))
+AGE_GROUP_OLDEST = "16+ лет"
+
+SNAPSHOT_PATH = os.environ.get("DO_SNAPSHOT_PATH", f"{DB_PATH}.columns")
+SNAPSHOT_MAGIC = b"SADOCOL1"
+SNAPSHOT_FORMAT = 1
+# Сколько воркер ждет, пока другой воркер допишет файл, прежде чем читать БД сам
+SNAPSHOT_WAIT_SECONDS = 60
+# Блокировка записи старше этого срока считается брошенной (воркер упал во время записи)
+SNAPSHOT_LOCK_TIMEOUT = 300
+# Строк detail_json в одной порции при выгрузке в файл
+JSON_BATCH = 5000
+REVISION_SOURCE = "sa_data_details"
+
+_PREFIX = struct.Struct("<8sQQ")
+_ALIGN = 8
+
+# Числовые колонки: (имя, dtype в файле, значение вместо NULL; None - NaN)
+NUMERIC_COLUMNS = (
+    ("do_id", "<i8", 0),
+    ("id", "<i8", 0),
+    ("sa_id", "<i8", -1),
+    ("year", "<i8", -1),
+    ("install_year", "<f8", None),
+    ("functionality", "<f8", None),
+    ("wear", "<f8", None),
+)
+# Строковые колонки: коды int32 (NULL -> -1) и словарь значений в атрибуте <имя>s
+STRING_COLUMNS = ("system_type", "object_name", "do_name", "plc_type", "scada_type")
+
+# Строки без ДО (нет sa_data/sa) попадают под do_id = 0, как в detail_rollup
+LOAD_SQL = """
+    SELECT
+        COALESCE(s.do_id, 0),
+        sdd.id,
+        sd.sa_id,
+        sd.year,
+        sdd.install_year,
+        sdd.functionality,
+        sdd.wear,
+        sdd.system_type,
+        sdd.object_name,
+        sdd.do_name,
+        sdd.plc_type,
+        sdd.scada_type
+    FROM sa_data_details sdd
+    LEFT JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    LEFT JOIN sa s ON sd.sa_id = s.id
+    ORDER BY 1, sdd.id
+"""
+
+JSON_SQL = "SELECT id, detail_json FROM sa_data_details ORDER BY id"
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _encode(values):
+    """Словарное кодирование строк: (коды int32, список значений); None -> -1"""
+    codes = {}
+    encoded = np.fromiter((-1 if value is None else codes.setdefault(value, len(codes)) for value in values),
+                          dtype=np.int32, count=len(values))
+    return encoded, list(codes)
+
+
+def _floats(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+def _ints(values, missing: int = 0):
+    return np.array([missing if value is None else value for value in values], dtype=np.int64)
+
+
+def _columns(rows):
+    """Строки LOAD_SQL -> ({колонка: массив}, {строковая колонка: словарь значений})"""
+    values = list(zip(*rows)) if rows else [()] * (len(NUMERIC_COLUMNS) + len(STRING_COLUMNS))
+    columns, strings = {}, {}
+    for (name, _, missing), column in zip(NUMERIC_COLUMNS, values):
+        columns[name] = _floats(column) if missing is None else _ints(column, missing)
+    for name, column in zip(STRING_COLUMNS, values[len(NUMERIC_COLUMNS):]):
+        columns[name], strings[name] = _encode(column)
+    return columns, strings
+
+
+def _optional(value):
+    """Значение NumPy -> значение JSON (NaN -> None)"""
+    value = float(value)
+    return None if value != value else value
+
+
+def age_group_codes(age):
+    """Номер возрастной группы AGE_GROUPS (последний - AGE_GROUP_OLDEST) для массива возрастов"""
+    return np.select([age <= bound for bound, _ in AGE_GROUPS], list(range(len(AGE_GROUPS))), default=len(AGE_GROUPS))
+
+
+def age_group_names():
+    return [name for _, name in AGE_GROUPS] + [AGE_GROUP_OLDEST]
+
+
+class StringTable:
+    """Словарь строк из файла снимка: значение декодируется из mmap при обращении"""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, code: int) -> str:
+        if not 0 <= code < len(self):
+            raise IndexError(code)
+        return self._data[int(self._offsets[code]):int(self._offsets[code + 1])].tobytes().decode("utf-8")
+
+
+class Snapshot:
+    """Колонки sa_data_details, отсортированные по (do_id, id): строки ДО - непрерывный срез.
+
+    Массивы либо собраны из строк БД (source="sql"), либо смотрят в отображенный файл (source="mmap").
+    """
+
+    def __init__(self, columns, strings, version: int, revision=None, source: str = "sql", path=None,
+                 detail_json=None):
+        self.version = version
+        self.revision = revision
+        self.source = source
+        self.path = path
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+        self._columns = columns
+        self._detail_json = detail_json  # (смещения, длины, данные) - только у снимка из файла
+        for name, array in columns.items():
+            setattr(self, name, array)
+        for name, values in strings.items():
+            setattr(self, name + "s", values)
+
+    @classmethod
+    def from_rows(cls, rows, version: int, revision=None):
+        columns, strings = _columns(rows)
+        return cls(columns, strings, version, revision)
+
+    def __len__(self):
+        return len(self.id)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self._columns.values())
+
+    def detail_json(self, i: int):
+        """detail_json строки i без обращения к БД; None - нет карточки или снимок не из файла"""
+        if self._detail_json is None:
+            return None
+        offsets, lengths, data = self._detail_json
+        offset = int(offsets[i])
+        if offset < 0:
+            return None
+        return data[offset:offset + int(lengths[i])].tobytes().decode("utf-8")
+
+    def _slice(self, do_id: int):
+        start, stop = np.searchsorted(self.do_id, [do_id, do_id + 1])
+        return slice(int(start), int(stop))
+
+    @cached_property
+    def do_aggregates(self):
+        """Не зависящие от опорного года счетчики и суммы по do_id - один раз на снимок"""
+        size = int(self.do_id[-1]) + 1 if len(self) else 0
+        do_id = self.do_id
+        has_functionality = ~np.isnan(self.functionality)
+        has_year = ~np.isnan(self.install_year)
+
+        # Различные (ДО, вид системы): уникальные пары, затем счетчик по ДО
+        typed = self.system_type >= 0
+        base = len(self.system_types) + 1
+        pairs = np.unique(do_id[typed] * base + self.system_type[typed])
+
+        return {
+            "total": np.bincount(do_id, minlength=size),
+            "functionality_n": np.bincount(do_id[has_functionality], minlength=size),
+            "functionality_sum": np.bincount(do_id[has_functionality], weights=self.functionality[has_functionality],
+                                             minlength=size),
+            "year_n": np.bincount(do_id[has_year], minlength=size),
+            "year_sum": np.bincount(do_id[has_year], weights=self.install_year[has_year], minlength=size),
+            "problem_count": np.bincount(do_id[self.wear > HIGH_WEAR], minlength=size),
+            "system_types": np.bincount(pairs // base, minlength=size),
+        }
+
+    @cached_property
+    def install_years(self):
+        """Гистограмма годов внедрения (годы, количества) по всем ДО"""
+        return np.unique(self.install_year[~np.isnan(self.install_year)], return_counts=True)
+
+    def _summary(self, i: int, reference_year: int):
+        a = self.do_aggregates
+        return {
+            "total_systems": int(a["total"][i]),
+            "automation_level": float(a["functionality_sum"][i] / a["functionality_n"][i])
+            if a["functionality_n"][i] else None,
+            "avg_age": float(reference_year - a["year_sum"][i] / a["year_n"][i]) if a["year_n"][i] else None,
+            "problem_count": int(a["problem_count"][i]),
+            "system_types": int(a["system_types"][i]),
+        }
+
+    def summaries(self, reference_year: int):
+        """Сводки всех ДО в формате rollup_summary: {do_id: сводка}"""
+        return {i: self._summary(i, reference_year) for i in np.flatnonzero(self.do_aggregates["total"]).tolist()}
+
+    def summary(self, do_id: int, reference_year: int):
+        if 0 <= do_id < len(self.do_aggregates["total"]):
+            return self._summary(do_id, reference_year)
+        return {"total_systems": 0, "automation_level": None, "avg_age": None, "problem_count": 0, "system_types": 0}
+
+    def age_stats(self, reference_year: int):
+        """Число систем по возрастным группам (все ДО), как query_age_stats"""
+        years, counts = self.install_years
+        groups = np.bincount(age_group_codes(reference_year - years), weights=counts, minlength=len(AGE_GROUPS) + 1)
+        return [{"age_group": group, "count": int(count)}
+                for group, count in sorted(zip(age_group_names(), groups.tolist())) if count]
+
+    def do_details(self, do_id: int, reference_year: int):
+        """KPI, возрастные группы, проблемные системы и типы ДО - как в query_do_full_details"""
+        rows = self._slice(do_id)
+        wear = self.wear[rows]
+        functionality = self.functionality[rows]
+        install_year = self.install_year[rows]
+        system_type = self.system_type[rows]
+
+        has_functionality = ~np.isnan(functionality)
+        has_year = ~np.isnan(install_year)
+        age = reference_year - install_year[has_year]
+        high_wear = wear > HIGH_WEAR
+        low_functionality = functionality < LOW_FUNCTIONALITY
+
+        kpi = {
+            "total_systems": rows.stop - rows.start,
+            "automation_level": round(float(functionality[has_functionality].mean()), 1) if has_functionality.any()
+            else 0,
+            "avg_age": round(float(age.mean()), 1) if len(age) else 0,
+            "problem_count": int(high_wear.sum()),
+            "low_functionality_count": int(low_functionality.sum()),
+        }
+
+        counts = np.bincount(age_group_codes(age), minlength=len(AGE_GROUPS) + 1)
+        age_distribution = [{"age_group": group, "count": count}
+                            for group, count in sorted(zip(age_group_names(), counts.tolist())) if count]
+
+        # Проблемные - по убыванию износа (без износа - в конце), при равенстве - по id
+        problem = np.flatnonzero(high_wear | low_functionality)
+        problem_wear = wear[problem]
+        missing_wear = np.isnan(problem_wear)
+        order = np.lexsort((self.id[rows][problem], -np.where(missing_wear, 0, problem_wear), missing_wear))
+        problems = []
+        for i in (rows.start + problem[order[:PROBLEM_SYSTEMS_LIMIT]]).tolist():
+            type_code, name_code = int(self.system_type[i]), int(self.object_name[i])
+            install = _optional(self.install_year[i])
+            problems.append({
+                "object_name": self.object_names[name_code] if name_code >= 0 else None,
+                "system_type": self.system_types[type_code] if type_code >= 0 else None,
+                "wear": _optional(self.wear[i]),
+                "functionality": _optional(self.functionality[i]),
+                "install_year": int(install) if install is not None else None,
+            })
+
+        # Типы по убыванию количества; код -1 (вид не указан) сдвигается в 0
+        type_counts = np.bincount(system_type + 1, minlength=len(self.system_types) + 1)
+        stats = [(self.system_types[code - 1] if code else None, int(type_counts[code]))
+                 for code in np.flatnonzero(type_counts).tolist()]
+        stats.sort(key=lambda t: (-t[1], t[0] is not None, t[0] or ""))
+
+        return {
+            "kpi": kpi,
+            "age_distribution": age_distribution,
+            "problem_systems": problems,
+            "system_stats": [{"system_type": system_type, "count": count} for system_type, count in stats],
+        }
+
+
+def _write_section(f, sections, name: str, array):
+    f.write(b"\0" * (-f.tell() % _ALIGN))
+    sections[name] = [array.dtype.str, f.tell(), len(array)]
+    f.write(array.tobytes())
+
+
+def write_snapshot(cursor, path: str, revision) -> int:
+    """Записывает файл снимка (через временный файл и os.replace); возвращает число строк.
+
+    revision читается до вызова: запись в БД во время выгрузки только сделает файл устаревшим.
+    """
+    cursor.execute(LOAD_SQL)
+    columns, strings = _columns(cursor.fetchall())
+    count = len(columns["id"])
+    sections = {}
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(_PREFIX.pack(SNAPSHOT_MAGIC, 0, 0))
+            for (name, dtype, _) in NUMERIC_COLUMNS:
+                _write_section(f, sections, name, columns[name].astype(dtype, copy=False))
+            for name in STRING_COLUMNS:
+                _write_section(f, sections, name, columns[name].astype("<i4", copy=False))
+                encoded = [value.encode("utf-8") for value in strings[name]]
+                offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                _write_section(f, sections, f"{name}s.offsets", offsets)
+                _write_section(f, sections, f"{name}s.data", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+            # detail_json - в порядке id (без сортировки в SQLite); позиция строки в снимке
+            # находится поиском по отсортированным id, строк вне снимка (записаны позже) нет
+            order = np.argsort(columns["id"], kind="stable")
+            sorted_ids = columns["id"][order]
+            json_offsets = np.full(count, -1, dtype="<i8")
+            json_lengths = np.zeros(count, dtype="<u4")
+            f.write(b"\0" * (-f.tell() % _ALIGN))
+            data_start = position = f.tell()
+            cursor.execute(JSON_SQL)
+            while True:
+                batch = cursor.fetchmany(JSON_BATCH)
+                if not batch:
+                    break
+                ids = np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch))
+                found = np.minimum(np.searchsorted(sorted_ids, ids), max(count - 1, 0))
+                known = (sorted_ids[found] == ids) if count else np.zeros(len(batch), dtype=bool)
+                blobs = []
+                for row_index, (_, text), present in zip(order[found].tolist(), batch, known.tolist()):
+                    if not present or text is None:
+                        continue
+                    blob = text.encode("utf-8")
+                    json_offsets[row_index] = position - data_start
+                    json_lengths[row_index] = len(blob)
+                    position += len(blob)
+                    blobs.append(blob)
+                f.write(b"".join(blobs))
+            sections["detail_json.data"] = ["|u1", data_start, position - data_start]
+            _write_section(f, sections, "detail_json.offsets", json_offsets)
+            _write_section(f, sections, "detail_json.lengths", json_lengths)
+
+            header = json.dumps({
+                "format": SNAPSHOT_FORMAT,
+                "revision": revision,
+                "rows": count,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "sections": sections,
+            }, ensure_ascii=False).encode("utf-8")
+            header_offset = f.tell()
+            f.write(header)
+            f.seek(0)
+            f.write(_PREFIX.pack(SNAPSHOT_MAGIC, header_offset, len(header)))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+
+def read_header(mapped):
+    """JSON-заголовок файла снимка; None, если это не снимок или формат другой"""
+    if len(mapped) < _PREFIX.size:
+        return None
+    magic, header_offset, header_length = _PREFIX.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC or header_offset + header_length > len(mapped):
+        return None
+    header = json.loads(bytes(mapped[header_offset:header_offset + header_length]))
+    return header if header.get("format") == SNAPSHOT_FORMAT else None
+
+
+def open_snapshot(path: str, version: int = 0):
+    """Снимок из файла через mmap только для чтения; None, если файла нет или он не читается"""
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):  # ValueError - пустой файл
+        return None
+    try:
+        header = read_header(mapped)
+        if header is None:
+            return None
+        sections = header["sections"]
+
+        def section(name):
+            dtype, offset, count = sections[name]
+            return np.frombuffer(mapped, dtype=dtype, count=count, offset=offset)
+
+        columns = {name: section(name) for name, _, _ in NUMERIC_COLUMNS}
+        strings = {}
+        for name in STRING_COLUMNS:
+            columns[name] = section(name)
+            strings[name] = StringTable(section(f"{name}s.offsets"), section(f"{name}s.data"))
+        detail_json = (section("detail_json.offsets"), section("detail_json.lengths"), section("detail_json.data"))
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"⚠️ Файл снимка {path} поврежден: {e}")
+        return None
+    return Snapshot(columns, strings, version, header["revision"], "mmap", path, detail_json)
+
+
+def _lock(path: str) -> bool:
+    """Блокировка записи файла снимка между воркерами (файл <снимок>.lock)"""
+    lock_path = path + ".lock"
+    for _ in range(2):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) < SNAPSHOT_LOCK_TIMEOUT:
+                    return False
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+def _unlock(path: str):
+    try:
+        os.remove(path + ".lock")
+    except FileNotFoundError:
+        pass
+
+
+class ColumnStore:
+    """Текущий снимок и его перезагрузка при изменении БД"""
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.file_writes = 0
+        self.load_seconds = 0.0
+
+    def snapshot(self, cursor) -> Snapshot:
+        """Актуальный снимок; если БД изменилась - перечитывает его (из файла или через cursor)"""
+        # Версия берется до чтения: запись во время загрузки приведет к еще одной перезагрузке
+        version = db.data_version.check()
+        current = self._snapshot
+        if current is not None and current.version == version:
+            return current
+        with self._lock:
+            current = self._snapshot
+            if current is None or current.version != version:
+                revision = query_data_revision(cursor, REVISION_SOURCE)
+                if current is not None and revision is not None and current.revision == revision:
+                    # Запись не затронула sa_data_details (другие таблицы) - снимок прежний
+                    current.version = version
+                    return current
+                started = time.perf_counter()
+                current = self._load(cursor, version, revision)
+                self.load_seconds = time.perf_counter() - started
+                self.loads += 1
+                self._snapshot = current
+        return current
+
+    def _load(self, cursor, version: int, revision) -> Snapshot:
+        if self.path and revision is not None:
+            current = open_snapshot(self.path, version)
+            if current is not None and current.revision == revision:
+                return current
+            if _lock(self.path):
+                try:
+                    write_snapshot(cursor, self.path, revision)
+                    self.file_writes += 1
+                except OSError as e:
+                    print(f"⚠️ Ошибка записи файла снимка {self.path}: {e}")
+                finally:
+                    _unlock(self.path)
+            else:
+                # Файл пишет другой воркер - ждем его, чтобы делить страницы, а не держать свою копию
+                deadline = time.monotonic() + SNAPSHOT_WAIT_SECONDS
+                while os.path.exists(self.path + ".lock") and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            current = open_snapshot(self.path, version)
+            if current is not None and current.revision == revision:
+                return current
+        cursor.execute(LOAD_SQL)
+        return Snapshot.from_rows(cursor.fetchall(), version, revision)
+
+    def stats(self):
+        current = self._snapshot
+        return {
+            "backend": ANALYTICS_BACKEND,
+            "loaded": current is not None,
+            "source": current.source if current is not None else None,
+            "path": self.path or None,
+            "rows": len(current) if current is not None else 0,
+            "bytes": current.nbytes if current is not None else 0,
+            "version": current.version if current is not None else None,
+            "revision": current.revision if current is not None else None,
+            "loaded_at": current.loaded_at if current is not None else None,
+            "loads": self.loads,
+            "file_writes": self.file_writes,
+            "last_load_seconds": round(self.load_seconds, 3),
+        }
+
+
+store = ColumnStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Файл колоночного снимка sa_data_details")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--out", help="файл снимка (по умолчанию DO_SNAPSHOT_PATH или <БД>.columns)")
+    args = parser.parse_args()
+    path = args.out or (SNAPSHOT_PATH if args.db == DB_PATH and SNAPSHOT_PATH else f"{args.db}.columns")
+
+    if np is None:
+        print("❌ NumPy не установлен")
+        return
+
+    if args.command == "build":
+        conn = sqlite3.connect(args.db)
+        try:
+            ensure_data_revisions(conn)
+            cursor = conn.cursor()
+            started = time.perf_counter()
+            count = write_snapshot(cursor, path, query_data_revision(cursor, REVISION_SOURCE))
+        finally:
+            conn.close()
+        print(f"✅ {path}: {count} строк, {os.path.getsize(path) / 1024 / 1024:.1f} МБ "
+              f"за {time.perf_counter() - started:.2f} с")
+        return
+
+    started = time.perf_counter()
+    snapshot = open_snapshot(path)
+    if snapshot is None:
+        print(f"❌ {path}: файла снимка нет или формат другой")
+        return
+    print(f"{path}: ревизия {snapshot.revision}, {len(snapshot)} строк, "
+          f"открыт за {(time.perf_counter() - started) * 1000:.1f} мс")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header = read_header(mapped)
+    print(f"    создан: {header['created_at']}")
+    for name, (dtype, _, count) in header["sections"].items():
+        print(f"    {name}: {dtype} x {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# database.py - общий слой доступа к SQLite для API
+import asyncio
+import contextvars
+import functools
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import TracedCursor
+from schema import DB_PATH
+
+# Размер пула = число потоков, выполняющих запросы
+POOL_SIZE = 8
+
+# Настройки читающих соединений
+CACHE_SIZE_KIB = 65536          # PRAGMA cache_size (в КиБ)
+MMAP_SIZE = 256 * 1024 * 1024   # PRAGMA mmap_size (в байтах)
+BUSY_TIMEOUT_MS = 5000
+
+# Размер пачки строк при потоковой выдаче
+STREAM_BATCH_SIZE = 500
+# Одновременных потоковых выдач; у них свои соединения и потоки, чтобы медленные
+# клиенты не занимали пул, через который идут обычные запросы
+STREAM_POOL_SIZE = 4
+
+# Как часто (сек) проверять, изменилась ли БД
+VERSION_CHECK_INTERVAL = 1.0
+
+
+def open_write_connection(path: str = DB_PATH) -> sqlite3.Connection:
+    """Соединение для миграций и записи; переводит БД в режим WAL"""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class ConnectionPool:
+    """Ограниченный пул read-only соединений, разделяемый потоками"""
+
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if not create:
+            return self._idle.get()
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Закрывает простаивающие соединения (при остановке или смене файла БД)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+pool = ConnectionPool()
+stream_pool = ConnectionPool(size=STREAM_POOL_SIZE)
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="sqlite")
+_stream_executor = ThreadPoolExecutor(max_workers=STREAM_POOL_SIZE, thread_name_prefix="sqlite-stream")
+# Места для потоковых выдач: семафор на каждый event loop (asyncio.Semaphore привязан к loop)
+_stream_slots = weakref.WeakKeyDictionary()
+# Запись - в одном отдельном потоке: SQLite допускает одного писателя, читатели WAL не ждут
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+
+
+async def run(fn, *args):
+    """Выполняет fn(cursor, *args) в пуле потоков на соединении из пула"""
+    def job():
+        with pool.connection() as conn:
+            cursor = TracedCursor(conn.cursor())
+            try:
+                return fn(cursor, *args)
+            finally:
+                cursor.close()
+
+    # Контекст копируется, чтобы SQL-метрики попали в счетчики текущего запроса
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, contextvars.copy_context().run, job)
+
+
+async def write(fn, *args):
+    """Выполняет fn(conn, *args) на пишущем соединении в потоке записи"""
+    def job():
+        conn = open_write_connection(pool.path)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, contextvars.copy_context().run, job)
+
+
+def _stream_slot() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slot = _stream_slots.get(loop)
+    if slot is None:
+        slot = _stream_slots[loop] = asyncio.Semaphore(STREAM_POOL_SIZE)
+    return slot
+
+
+async def stream(fn, *args, batch_size: int = STREAM_BATCH_SIZE):
+    """Выполняет fn(cursor, *args) и отдает результат пачками строк.
+
+    Соединение берется из stream_pool и удерживается, пока генератор не исчерпан или не закрыт
+    (aclose). Место ждется в event loop, а не в потоке: занятое соединение получает только тот,
+    для кого оно свободно, и потоки stream_pool всегда могут дочитать начатые выдачи.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    async with _stream_slot():
+        # При занятом месте свободное соединение есть всегда - взятие не блокирует;
+        # в event loop, чтобы отмена между взятием и try не оставила его занятым
+        conn = stream_pool._acquire()
+        cursor = TracedCursor(conn.cursor())
+        try:
+            await loop.run_in_executor(_stream_executor, context.run, functools.partial(fn, cursor, *args))
+            while True:
+                rows = await loop.run_in_executor(_stream_executor, context.run, cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            context.run(cursor.close)
+            stream_pool._release(conn)
+
+
+class DataVersion:
+    """Отслеживает изменения БД по PRAGMA data_version и mtime/size файлов"""
+
+    def __init__(self, path: str = DB_PATH, interval: float = VERSION_CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.version = 0            # счетчик изменений в этом процессе
+        self.stamp = ""             # отпечаток файлов, одинаковый для всех процессов
+        self._conn = None
+        self._data_version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _file_stamp(self) -> str:
+        parts = []
+        for suffix in ("", "-wal"):
+            try:
+                st = Path(self.path + suffix).stat()
+                parts.append(f"{st.st_mtime_ns:x}.{st.st_size:x}")
+            except OSError:
+                parts.append("0")
+        return "-".join(parts)
+
+    def _pragma_version(self):
+        try:
+            if self._conn is None:
+                self._conn = pool._connect()
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            self._conn = None
+            return None
+
+    def check(self, force: bool = False) -> int:
+        """Возвращает текущую версию, перепроверяя БД не чаще interval секунд (force - сразу)"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.interval:
+            return self.version
+        with self._lock:
+            if not force and now - self._checked_at < self.interval:
+                return self.version
+            data_version = self._pragma_version()
+            stamp = self._file_stamp()
+            if data_version != self._data_version or stamp != self.stamp:
+                self._data_version = data_version
+                self.stamp = stamp
+                self.version += 1
+            self._checked_at = now
+        return self.version
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+data_version = DataVersion()
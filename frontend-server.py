@@ -1,12 +1,11 @@
 # frontend-server.py - простой сервер для фронтенда
-import http.server
-import socketserver
-import webbrowser
 import os
 
+from static_server import CachedRequestHandler, serve
+
 PORT = 3000
 
-class CORSRequestHandler(http.server.SimpleHTTPRequestHandler):
+class CORSRequestHandler(CachedRequestHandler):
     def end_headers(self):
         # Добавляем CORS headers ко всем ответам
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -17,6 +16,7 @@ class CORSRequestHandler(http.server.SimpleHTTPRequestHandler):
     def do_OPTIONS(self):
         # Обрабатываем preflight запросы
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
 print("=" * 50)
@@ -27,13 +27,5 @@ print("=" * 50)
 # Переходим в папку со скриптом
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-with socketserver.TCPServer(("", PORT), CORSRequestHandler) as httpd:
-    print(f"✅ Сервер запущен! Открываю браузер...")
-    
-    # Автоматически открываем браузер
-    webbrowser.open(f'http://localhost:{PORT}/index.html')
-    
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\n🛑 Сервер остановлен")
\ No newline at end of file
+print(f"✅ Сервер запущен! Открываю браузер...")
+serve(PORT, CORSRequestHandler)
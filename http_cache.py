@@ -0,0 +1,196 @@
+# http_cache.py - ETag/304 и сжатие ответов API
+import hashlib
+import zlib
+from pathlib import Path
+
+import database as db
+from schema import DEFAULT_REFERENCE_YEAR
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него остается gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Служебные эндпоинты, ответ которых не зависит от данных в БД
+ETAG_EXCLUDED = {"/api/health", "/api/cache/stats", "/api/metrics", "/api/debug/slow-queries",
+                 "/api/debug/backend-check", "/api/docs", "/api/openapi.json"}
+
+# Обработчик помечает ответ этим заголовком, если он не должен кэшироваться
+# (заглушка при ошибке, частичные данные): ETag к нему не добавляется
+NO_STORE_HEADERS = {"Cache-Control": "no-store"}
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Меняется при обновлении кода API, чтобы старые ETag не пережили деплой
+BUILD_ID = hashlib.sha1(
+    "".join(f"{p.name}:{p.stat().st_mtime_ns}" for p in sorted(Path(__file__).parent.glob("*.py"))).encode()
+).hexdigest()[:8]
+
+
+def compute_etag(path: str, query: str) -> str:
+    """Строгий ETag из версии данных - тело ответа для этого строить не нужно"""
+    db.data_version.check()
+    # Опорный год по умолчанию входит в ключ: ответы без reference_year зависят от него
+    key = f"{BUILD_ID}|{db.data_version.stamp}|{DEFAULT_REFERENCE_YEAR}|{path}?{query}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+
+def _accepted_encoding(accept_encoding: str):
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(token.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    base = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        # Сжатые варианты помечены суффиксом кодировки
+        if tag == base or tag.rsplit("-", 1)[0] == base:
+            return True
+    return False
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        return self._obj.finish() if self.encoding == "br" else self._obj.flush()
+
+
+class HTTPCacheMiddleware:
+    """ASGI middleware: ETag + 304 Not Modified и gzip/brotli для /api/*"""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        encoding = _accepted_encoding(headers.get("accept-encoding", ""))
+
+        etag = None
+        if scope["method"] in ("GET", "HEAD") and scope["path"] not in ETAG_EXCLUDED:
+            etag = compute_etag(scope["path"], scope.get("query_string", b"").decode("latin-1"))
+            if_none_match = headers.get("if-none-match")
+            if if_none_match and _matches(if_none_match, etag):
+                await send({
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [
+                        (b"etag", etag.encode()),
+                        (b"cache-control", b"no-cache"),
+                        (b"vary", b"Accept-Encoding"),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        responder = _Responder(send, etag, encoding, self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _Responder:
+    """Перехватывает ответ приложения, добавляет заголовки и сжимает тело"""
+
+    def __init__(self, send, etag, encoding, minimum_size):
+        self.send = send
+        self.etag = etag
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        if self.start is not None:
+            await self._send_start(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is not None:
+            body = self.compressor.compress(body)
+            if not more_body:
+                body += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _send_start(self, message):
+        start, self.start = self.start, None
+        headers = [(k, v) for k, v in start["headers"]]
+        names = {k.lower() for k, _ in headers}
+        content_type = dict((k.lower(), v) for k, v in headers).get(b"content-type", b"").decode("latin-1")
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        compress = self._should_compress(content_type, names, body, more_body)
+
+        no_store = b"no-store" in dict((k.lower(), v) for k, v in headers).get(b"cache-control", b"").lower()
+        # Потоковое тело (more_body) собирается по ходу отправки и может оборваться: строгий ETag
+        # обещал бы побайтно тот же ответ, которого клиент мог и не получить
+        if self.etag and start["status"] == 200 and not no_store and not more_body:
+            etag = self.etag[:-1] + "-" + self.encoding + '"' if compress else self.etag
+            headers.append((b"etag", etag.encode()))
+            headers.append((b"cache-control", b"no-cache"))
+        if content_type.startswith(COMPRESSIBLE_TYPES) and b"vary" not in names:
+            headers.append((b"vary", b"Accept-Encoding"))
+
+        if compress:
+            self.compressor = _Compressor(self.encoding)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers.append((b"content-encoding", self.encoding.encode()))
+            body = self.compressor.compress(body)
+            if not more_body:
+                body += self.compressor.finish()
+                headers.append((b"content-length", str(len(body)).encode()))
+        else:
+            self.passthrough = True
+
+        await self.send({**start, "headers": headers})
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    def _should_compress(self, content_type, names, body, more_body):
+        if not self.encoding or b"content-encoding" in names:
+            return False
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        # Потоковые ответы сжимаем всегда, цельные - только если они достаточно большие
+        return more_body or len(body) >= self.minimum_size
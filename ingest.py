@@ -0,0 +1,448 @@
+# ingest.py - пакетная загрузка выгрузок годовых отчетов ДО в sa_data_details
+#
+#   python ingest.py report_2024.csv --year 2024
+#   python ingest.py export.jsonl report.xlsx --replace --json
+#
+# Запись в файле - одна строка sa_data_details. Служебные поля:
+#   id            - id строки sa_data_details (если есть - строка обновляется)
+#   do_id         - ДО; если нет, ищется по "Наименование ДО"
+#   sa_id         - система автоматизации; если нет - по sa_name внутри ДО (создается при отсутствии)
+#   sa_name, sa_type
+#   year          - год отчета (или --year)
+#   import_status, test_stage
+#   detail_json   - карточка системы (объект или JSON-строка); без него карточкой
+#                   считаются все остальные поля записи
+import argparse
+import csv
+import functools
+import io
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+from database import open_write_connection
+from schema import (DB_PATH, DETAIL_FIELDS, classify_system_types, ensure_data_revisions, ensure_detail_columns,
+                    ensure_indexes, ensure_rollups, ensure_search_index, ensure_system_categories, ensure_year_versions,
+                    field_expr, system_category_expr)
+
+try:
+    import openpyxl
+except ImportError:  # без openpyxl недоступна только загрузка Excel
+    openpyxl = None
+
+# Строк в одном executemany и в одной транзакции
+BATCH_SIZE = 5000
+
+# Сколько ошибок валидации возвращать в отчете (считаются все)
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ("csv", "jsonl", "xlsx")
+CSV_DELIMITERS = (";", "\t", ",")
+
+SERVICE_FIELDS = ("id", "do_id", "sa_id", "sa_name", "sa_type", "year", "import_status", "test_stage", "detail_json")
+
+# Значения, которые в выгрузках означают "нет данных"
+EMPTY_VALUES = {"", "-", "—", "н/д", "нет данных", "не указано"}
+
+IMPORT_STATUSES = ("Замещено", "Испытания", "Не замещено")
+
+MIN_INSTALL_YEAR = 1950
+
+
+class IngestError(ValueError):
+    """Ошибка формата файла целиком (в отличие от ошибок отдельных строк)"""
+
+
+@functools.lru_cache(maxsize=4096)
+def _key_form(key: str) -> str:
+    """Форма ключа для сравнения: регистр, ё, знак %, лишние пробелы и знаки по краям"""
+    key = key.lower().replace("ё", "е").replace("%", "")
+    return re.sub(r"\s+", " ", key).strip(" ,:;.")
+
+
+# Варианты написания ключей, на которые опирается API -> ключ из DETAIL_FIELDS
+DETAIL_KEYS = {_key_form(key): key for key, _ in DETAIL_FIELDS.values()}
+DETAIL_TYPES = {key: sql_type for key, sql_type in DETAIL_FIELDS.values()}
+
+
+def _number(value, sql_type: str):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        number = float(str(value).replace("%", "").replace(" ", "").replace(" ", "").replace(",", "."))
+    if sql_type == "INTEGER":
+        if number != int(number):
+            raise ValueError(value)
+        return int(number)
+    return float(number)
+
+
+def normalize_detail(detail: dict, current_year: int) -> dict:
+    """Приводит ключи и значения карточки к виду, который читают колонки DETAIL_FIELDS.
+
+    Бросает ValueError, если значение поля нельзя привести к его типу.
+    """
+    normalized = {}
+    for raw_key, value in detail.items():
+        if raw_key is None:
+            continue
+        key = str(raw_key).strip()
+        key = DETAIL_KEYS.get(_key_form(key), key)
+        if isinstance(value, str):
+            value = value.strip()
+            if value.lower() in EMPTY_VALUES:
+                value = None
+        sql_type = DETAIL_TYPES.get(key)
+        if value is not None and sql_type in ("INTEGER", "REAL"):
+            try:
+                value = _number(value, sql_type)
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError(f"'{key}': не число ({value!r})")
+        normalized[key] = value
+
+    install_year = normalized.get(DETAIL_FIELDS["install_year"][0])
+    if install_year is not None and not MIN_INSTALL_YEAR <= install_year <= current_year:
+        raise ValueError(f"год внедрения {install_year} вне диапазона {MIN_INSTALL_YEAR}-{current_year}")
+    for column in ("functionality", "wear"):
+        value = normalized.get(DETAIL_FIELDS[column][0])
+        if value is not None and not 0 <= value <= 100:
+            raise ValueError(f"'{DETAIL_FIELDS[column][0]}': {value} вне диапазона 0-100")
+    return normalized
+
+
+# === ЧТЕНИЕ ФАЙЛОВ ===
+def detect_format(name: str) -> str:
+    suffix = Path(name).suffix.lower().lstrip(".")
+    fmt = {"ndjson": "jsonl", "json": "jsonl", "xlsm": "xlsx", "txt": "csv"}.get(suffix, suffix)
+    if fmt not in FORMATS:
+        raise IngestError(f"Неизвестный формат '{suffix}', допустимо: {', '.join(FORMATS)}")
+    return fmt
+
+
+def read_csv(f, encoding: str = "utf-8-sig"):
+    text = io.TextIOWrapper(f, encoding=encoding, newline="")
+    header = text.readline()
+    # Разделитель - по строке заголовка: Excel в русской локали сохраняет CSV через ";",
+    # а запятая встречается в самих значениях ("45,5")
+    delimiter = max(CSV_DELIMITERS, key=header.count)
+    reader = csv.DictReader(_chain(header, text), delimiter=delimiter)
+    for line, row in enumerate(reader, 2):
+        yield line, row
+
+
+def _chain(header: str, text):
+    yield header
+    yield from text
+
+
+def read_jsonl(f, encoding: str = "utf-8-sig"):
+    for line, raw in enumerate(io.TextIOWrapper(f, encoding=encoding), 1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            record = json.loads(raw)
+        except json.JSONDecodeError as e:
+            yield line, e
+            continue
+        yield line, record
+
+
+def read_xlsx(f, sheet=None):
+    if openpyxl is None:
+        raise IngestError("Для загрузки Excel нужен openpyxl")
+    workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else None for cell in next(rows, ())]
+        for line, values in enumerate(rows, 2):
+            if all(value is None for value in values):
+                continue
+            yield line, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_records(f, fmt: str, encoding: str = "utf-8-sig", sheet=None):
+    """(номер строки, запись) из бинарного файла; запись - dict или исключение разбора"""
+    if fmt == "csv":
+        return read_csv(f, encoding)
+    if fmt == "jsonl":
+        return read_jsonl(f, encoding)
+    if fmt == "xlsx":
+        return read_xlsx(f, sheet)
+    raise IngestError(f"Неизвестный формат '{fmt}', допустимо: {', '.join(FORMATS)}")
+
+
+# === ЗАПИСЬ В БД ===
+def _optional_int(value, name: str):
+    if value is None or (isinstance(value, str) and value.strip() == ""):
+        return None
+    try:
+        return _number(value, "INTEGER")
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name}: не целое число ({value!r})")
+
+
+def _optional_text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return None if value.lower() in EMPTY_VALUES else value
+
+
+class Ingestor:
+    """Загрузка записей пачками: executemany в транзакциях по BATCH_SIZE строк.
+
+    Типизированные колонки и detail_rollup пересчитываются триггерами
+    в той же транзакции, что и сама запись.
+    """
+
+    # Типизированные колонки и маска категорий пишутся тем же INSERT: тогда UPDATE из триггеров
+    # ничего не меняет, и триггер detail_rollup срабатывает на строку один раз, а не три.
+    # Виды систем, которых еще нет в system_type_class, классифицируются после загрузки.
+    UPSERT_SQL = f"""
+        INSERT INTO sa_data_details (id, sa_data_id, detail_json, import_status, test_stage, {", ".join(DETAIL_FIELDS)},
+                                     system_category)
+        VALUES (?1, ?2, ?3, ?4, ?5, {", ".join(field_expr(column, "?3") for column in DETAIL_FIELDS)},
+                {system_category_expr(field_expr("system_type", "?3"))})
+        ON CONFLICT(id) DO UPDATE SET
+            {", ".join(f"{column} = excluded.{column}"
+                       for column in ("sa_data_id", "detail_json", "import_status", "test_stage", *DETAIL_FIELDS,
+                                      "system_category"))}
+    """
+
+    def __init__(self, conn: sqlite3.Connection, year=None, replace: bool = False, batch_size: int = BATCH_SIZE):
+        self.conn = conn
+        self.year = year
+        self.replace = replace
+        self.batch_size = batch_size
+        self.current_year = datetime.now().year
+
+        self._do_by_name = {name: do_id for do_id, name in conn.execute("SELECT id, name FROM do")}
+        self._do_ids = set(self._do_by_name.values())
+        self._sa_types = {name: type_id for type_id, name in conn.execute("SELECT id, name FROM sa_types")}
+        self._sa = {}            # (do_id, sa_name) -> sa_id
+        self._sa_ids = {}        # sa_id -> do_id
+        self._sa_data = {}       # (sa_id, year) -> sa_data_id
+        self._cleared = set()    # sa_data_id, чьи старые строки уже удалены (--replace)
+        self._batch = []
+        self._clear = []         # sa_data_id, которые нужно очистить перед записью пачки
+
+        self.stats = {"read": 0, "written": 0, "rejected": 0, "deleted": 0,
+                      "sa_created": 0, "sa_data_created": 0}
+        self.errors = []
+
+    def _reject(self, source: str, line: int, message: str):
+        self.stats["rejected"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"source": source, "line": line, "error": message})
+
+    def _resolve_do(self, record: dict, detail: dict) -> int:
+        do_id = _optional_int(record.get("do_id"), "do_id")
+        if do_id is not None:
+            if do_id not in self._do_ids:
+                raise ValueError(f"ДО {do_id} не найден")
+            return do_id
+        name = detail.get(DETAIL_FIELDS["do_name"][0])
+        if name in self._do_by_name:
+            return self._do_by_name[name]
+        raise ValueError(f"ДО не указан или не найден ({name!r})" if name else "ДО не указан (do_id)")
+
+    def _resolve_sa(self, record: dict, detail: dict) -> int:
+        sa_id = _optional_int(record.get("sa_id"), "sa_id")
+        if sa_id is not None:
+            if sa_id not in self._sa_ids:
+                row = self.conn.execute("SELECT do_id FROM sa WHERE id = ?", (sa_id,)).fetchone()
+                if row is None:
+                    raise ValueError(f"система {sa_id} не найдена")
+                self._sa_ids[sa_id] = row[0]
+            return sa_id
+
+        do_id = self._resolve_do(record, detail)
+        name = _optional_text(record.get("sa_name"))
+        if name is None:
+            raise ValueError("система не указана (sa_id или sa_name)")
+        key = (do_id, name)
+        if key not in self._sa:
+            row = self.conn.execute("SELECT id FROM sa WHERE do_id = ? AND name = ? ORDER BY id LIMIT 1",
+                                    key).fetchone()
+            if row is None:
+                sa_type = self._sa_types.get(_optional_text(record.get("sa_type")))
+                row = (self.conn.execute("INSERT INTO sa (do_id, name, sa_type) VALUES (?, ?, ?)",
+                                         (do_id, name, sa_type)).lastrowid,)
+                self.stats["sa_created"] += 1
+            self._sa[key] = row[0]
+            self._sa_ids[row[0]] = do_id
+        return self._sa[key]
+
+    def _resolve_sa_data(self, sa_id: int, year: int) -> int:
+        key = (sa_id, year)
+        if key not in self._sa_data:
+            row = self.conn.execute("SELECT id FROM sa_data WHERE sa_id = ? AND year = ? ORDER BY id LIMIT 1",
+                                    key).fetchone()
+            if row is None:
+                row = (self.conn.execute("INSERT INTO sa_data (sa_id, year) VALUES (?, ?)", key).lastrowid,)
+                self.stats["sa_data_created"] += 1
+            self._sa_data[key] = row[0]
+        sa_data_id = self._sa_data[key]
+
+        if self.replace and sa_data_id not in self._cleared:
+            # Отчет за год заменяет прежние строки системы целиком; удаляются
+            # при записи пачки - раньше, чем в нее попадут строки этой системы
+            self._cleared.add(sa_data_id)
+            self._clear.append((sa_data_id,))
+        return sa_data_id
+
+    def _row(self, record: dict):
+        """Параметры UPSERT_SQL для записи; ValueError - запись отклоняется"""
+        detail = record.get("detail_json")
+        if detail is None:
+            detail = {key: value for key, value in record.items() if key not in SERVICE_FIELDS}
+        elif isinstance(detail, str):
+            try:
+                detail = json.loads(detail)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"detail_json: {e}")
+        if not isinstance(detail, dict):
+            raise ValueError("detail_json должен быть объектом")
+        detail = normalize_detail(detail, self.current_year)
+
+        year = _optional_int(record.get("year"), "year")
+        year = year if year is not None else self.year
+        if year is None:
+            raise ValueError("не указан год отчета (year)")
+
+        import_status = _optional_text(record.get("import_status"))
+        if import_status is not None and import_status not in IMPORT_STATUSES:
+            raise ValueError(f"неизвестный статус импортозамещения {import_status!r}")
+
+        detail_id = _optional_int(record.get("id"), "id")
+        sa_data_id = self._resolve_sa_data(self._resolve_sa(record, detail), year)
+        return (detail_id, sa_data_id, json.dumps(detail, ensure_ascii=False),
+                import_status, _optional_text(record.get("test_stage")))
+
+    def add(self, source: str, line: int, record):
+        self.stats["read"] += 1
+        if isinstance(record, Exception):
+            self._reject(source, line, f"ошибка разбора: {record}")
+            return
+        if not isinstance(record, dict):
+            self._reject(source, line, "запись должна быть объектом")
+            return
+        try:
+            row = self._row(record)
+        except ValueError as e:
+            self._reject(source, line, str(e))
+            return
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+            self.conn.commit()
+
+    def _flush(self):
+        if self._clear:
+            cursor = self.conn.executemany("DELETE FROM sa_data_details WHERE sa_data_id = ?", self._clear)
+            self.stats["deleted"] += cursor.rowcount
+            self._clear.clear()
+        if self._batch:
+            self.conn.executemany(self.UPSERT_SQL, self._batch)
+            self.stats["written"] += len(self._batch)
+            self._batch.clear()
+
+    def finish(self):
+        self._flush()
+        self.conn.commit()
+
+
+def ingest(conn: sqlite3.Connection, sources, year=None, replace: bool = False, batch_size: int = BATCH_SIZE,
+           encoding: str = "utf-8-sig", sheet=None):
+    """Загружает файлы sources - список (имя, бинарный файл, формат или None).
+
+    Возвращает отчет: счетчики строк, ошибки валидации и скорость загрузки.
+    """
+    started = time.perf_counter()
+    # Триггеры производных таблиц (колонки, категории, detail_rollup, year_versions, sdd_search) - до записи
+    ensure_detail_columns(conn)
+    ensure_indexes(conn)
+    ensure_system_categories(conn)
+    ensure_rollups(conn)
+    ensure_year_versions(conn)
+    ensure_data_revisions(conn)
+    ensure_search_index(conn)
+
+    ingestor = Ingestor(conn, year=year, replace=replace, batch_size=batch_size)
+    try:
+        for name, f, fmt in sources:
+            for line, record in read_records(f, fmt or detect_format(name), encoding, sheet):
+                ingestor.add(name, line, record)
+        ingestor.finish()
+    except BaseException:
+        conn.rollback()
+        raise
+    classify_system_types(conn)
+    conn.execute("PRAGMA optimize")
+
+    seconds = time.perf_counter() - started
+    return {
+        **ingestor.stats,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(ingestor.stats["written"] / seconds, 1) if seconds else 0,
+        "errors": ingestor.errors,
+    }
+
+
+def print_report(report):
+    print(f"✅ Загружено {report['written']} из {report['read']} строк за {report['seconds']} с "
+          f"({report['rows_per_sec']} строк/с)")
+    if report["deleted"]:
+        print(f"ℹ️ Удалено прежних строк: {report['deleted']}")
+    if report["sa_created"] or report["sa_data_created"]:
+        print(f"ℹ️ Создано систем: {report['sa_created']}, отчетов sa_data: {report['sa_data_created']}")
+    if report["rejected"]:
+        print(f"⚠️ Отклонено строк: {report['rejected']}")
+        for error in report["errors"]:
+            print(f"    {error['source']}:{error['line']}: {error['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка выгрузок отчетов ДО в sa_data_details")
+    parser.add_argument("files", nargs="+", help="файлы CSV, JSONL или Excel")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--format", choices=FORMATS, help="формат файлов (по умолчанию - по расширению)")
+    parser.add_argument("--year", type=int, help="год отчета для записей без year")
+    parser.add_argument("--replace", action="store_true",
+                        help="заменить прежние строки sa_data_details загружаемых систем за этот год")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--encoding", default="utf-8-sig")
+    parser.add_argument("--sheet", help="лист Excel (по умолчанию - активный)")
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    args = parser.parse_args()
+
+    conn = open_write_connection(args.db)
+    files = [open(path, "rb") for path in args.files]
+    try:
+        report = ingest(conn, [(path, f, args.format) for path, f in zip(args.files, files)],
+                        year=args.year, replace=args.replace, batch_size=args.batch_size,
+                        encoding=args.encoding, sheet=args.sheet)
+    except IngestError as e:
+        parser.exit(2, f"Ошибка загрузки: {e}\n")
+    finally:
+        for f in files:
+            f.close()
+        conn.close()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # main.py - ДОПОЛНЕННЫЙ ФАЙЛ
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 import sqlite3
 from datetime import datetime
 from typing import List, Optional
@@ -9,8 +9,77 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import json
+import asyncio
+import anyio
+import base64
+import hmac
+import logging
+import re
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="СА ДО API", version="4.0", docs_url="/api/docs")
+import database as db
+from cache import response_cache, run_cached, shared_cache, year_cache
+from http_cache import NO_STORE_HEADERS, HTTPCacheMiddleware
+from optimizer import optimize, print_report
+from metrics import JSONResponse, MetricsMiddleware, registry, slow_queries, started_at
+from schema import (DEFAULT_REFERENCE_YEAR, DETAIL_FIELDS, SECTORS, ensure_automation_pivot, ensure_data_revisions,
+                    ensure_detail_columns, ensure_indexes, ensure_rollups, ensure_search_index,
+                    ensure_sector_registry, ensure_system_categories, ensure_year_versions, indicator_column,
+                    search_text)
+import calculator
+import columnar
+from calculator import CalculatorBatchRequest
+from columnar import ANALYTICS_BACKEND, BACKENDS
+from ingest import IngestError, detect_format, ingest
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Миграция схемы при старте: WAL, поля detail_json, категории видов систем, производные таблицы и индексы"""
+    try:
+        conn = db.open_write_connection()
+        try:
+            if ensure_detail_columns(conn):
+                print("✅ Поля detail_json материализованы в sa_data_details")
+            ensure_indexes(conn)
+            if ensure_system_categories(conn):
+                print("✅ Виды систем классифицированы")
+            if ensure_automation_pivot(conn):
+                print("✅ automation_pivot построена из automation_summary")
+            if ensure_rollups(conn):
+                print("✅ detail_rollup построена из sa_data_details")
+            ensure_year_versions(conn)
+            ensure_data_revisions(conn)
+            if ensure_sector_registry(conn):
+                print("✅ Реестр секторов do_sector создан")
+            if ensure_search_index(conn):
+                print("✅ Поисковый индекс sdd_search построен")
+            print_report(optimize(conn))
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ Ошибка миграции схемы: {e}")
+    if ANALYTICS_BACKEND == "memory":
+        try:
+            snapshot = await db.run(columnar.store.snapshot)
+            print(f"✅ Колоночный снимок ({snapshot.source}): {len(snapshot)} строк "
+                  f"за {columnar.store.load_seconds:.3f} с")
+        except Exception as e:
+            print(f"⚠️ Ошибка загрузки колоночного снимка: {e}")
+    yield
+    db.data_version.close()
+    db.pool.close()
+    db.stream_pool.close()
+    shared_cache.close()
+
+
+app = FastAPI(title="СА ДО API", version="4.0", docs_url="/api/docs", lifespan=lifespan)
+
+# ETag/304 и сжатие; добавляется до CORS, чтобы 304 тоже получали CORS-заголовки
+app.add_middleware(HTTPCacheMiddleware)
 
 # 🔥 CORS для веб-интерфейса
 app.add_middleware(
@@ -21,27 +90,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики - внешний слой: в задержку входят сжатие и ответы 304
+app.add_middleware(MetricsMiddleware)
+
+# Запросы ниже - синхронные функции вида query_*(cursor, ...).
+# Эндпоинты выполняют их через db.run() в пуле потоков, не блокируя event loop,
+# а тяжелые агрегаты - через run_cached(), который сбрасывается при изменении БД.
+
+# Возраст систем во всех расчетах считается от одного опорного года:
+# параметр reference_year, по умолчанию - DEFAULT_REFERENCE_YEAR (schema.py)
+def reference_year_query():
+    return Query(None, ge=1950, le=2100, description="Опорный год для расчета возраста систем")
+
+def fallback_response(content) -> JSONResponse:
+    """Пустой ответ вместо данных при ошибке: статус 200 для фронтенда, но без ETag -
+    клиент не получит 304 на заглушку, пока данные не изменятся"""
+    return JSONResponse(content=content, headers=NO_STORE_HEADERS)
+
+def resolve_reference_year(reference_year: Optional[int]) -> int:
+    return reference_year or DEFAULT_REFERENCE_YEAR
+
 # === БАЗОВЫЕ ЭНДПОИНТЫ ДО ===
+def query_do_list(cursor, with_summary: bool = False, reference_year: Optional[int] = None,
+                  backend: str = ANALYTICS_BACKEND):
+    # Один агрегирующий запрос вместо COUNT/summary на каждый ДО
+    cursor.execute("""
+        WITH sa_counts AS (
+            SELECT do_id, COUNT(*) as system_count
+            FROM sa
+            GROUP BY do_id
+        )
+        SELECT
+            d.id,
+            d.name,
+            COALESCE(c.system_count, 0) as system_count
+        FROM do d
+        LEFT JOIN sa_counts c ON c.do_id = d.id
+        ORDER BY d.name
+    """)
+    rows = cursor.fetchall()
+
+    summaries = query_rollup_summaries(cursor, reference_year, backend) if with_summary else {}
+
+    do_list = []
+    for row in rows:
+        do_item = {"id": row['id'], "name": row['name'], "system_count": row['system_count']}
+        if with_summary:
+            do_item['summary'] = format_do_summary(summaries.get(row['id'], {}))
+        do_list.append(do_item)
+    return do_list
+
 @app.get("/api/do-list")
-async def get_do_list():
-    """Список всех ДО с базовой статистикой"""
+async def get_do_list(include: Optional[str] = None, reference_year: Optional[int] = reference_year_query()):
+    """Список всех ДО с базовой статистикой (include=summary - со сводкой по каждому ДО)"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, name FROM do ORDER BY name")
-        do_list = [dict(row) for row in cursor.fetchall()]
-        
-        # Добавляем статистику для каждого ДО
-        for do_item in do_list:
-            cursor.execute("""
-                SELECT COUNT(*) as system_count 
-                FROM sa WHERE do_id = ?
-            """, (do_item['id'],))
-            do_item['system_count'] = cursor.fetchone()[0] or 0
-            
-        conn.close()
+        do_list = await run_cached(query_do_list, include == "summary", resolve_reference_year(reference_year))
         return JSONResponse(content=do_list)
     except Exception as e:
         return JSONResponse(
@@ -49,1041 +152,1619 @@ async def get_do_list():
             content={"error": f"Database error: {str(e)}"}
         )
 
+# Сводки по ДО читаются из detail_rollup (счетчики и гистограммы, которые
+# триггеры обновляют при каждом изменении sa_data_details), а не из самих строк.
+# С backend="memory" сводки, возраст и детали ДО считаются по колоночному снимку (columnar.py).
+SUMMARY_DIMENSIONS = ("total", "functionality", "install_year", "wear", "system_type")
+
+def rollup_summary(rows, reference_year: int):
+    """Сводка ДО из строк detail_rollup (dimension, bucket, count, sum)"""
+    total_systems = 0
+    functionality_sum, functionality_n = 0.0, 0
+    year_sum, year_n = 0.0, 0
+    problem_count = 0
+    system_types = 0
+    for dimension, bucket, count, total in rows:
+        if dimension == "total":
+            total_systems += count
+        elif dimension == "functionality":
+            functionality_sum += total
+            functionality_n += count
+        elif dimension == "install_year":
+            year_sum += total
+            year_n += count
+        elif dimension == "wear" and int(bucket) > 7:
+            # корзина k - износ в (10(k-1), 10k], то есть > 70 начиная с k = 8
+            problem_count += count
+        elif dimension == "system_type" and count > 0:
+            system_types += 1
+    return {
+        "total_systems": total_systems,
+        "automation_level": functionality_sum / functionality_n if functionality_n else None,
+        "avg_age": reference_year - year_sum / year_n if year_n else None,
+        "problem_count": problem_count,
+        "system_types": system_types
+    }
+
+def query_rollup_summaries(cursor, reference_year: int, backend: str = ANALYTICS_BACKEND):
+    """Сводки всех ДО: O(число ДО x число корзин), независимо от числа строк"""
+    if backend == "memory":
+        return columnar.store.snapshot(cursor).summaries(reference_year)
+
+    placeholders = ','.join('?' * len(SUMMARY_DIMENSIONS))
+    cursor.execute(f"""
+        SELECT do_id, dimension, bucket, count, sum
+        FROM detail_rollup
+        WHERE dimension IN ({placeholders})
+    """, SUMMARY_DIMENSIONS)
+
+    grouped = {}
+    for do_id, dimension, bucket, count, total in cursor.fetchall():
+        grouped.setdefault(do_id, []).append((dimension, bucket, count, total))
+    return {do_id: rollup_summary(rows, reference_year) for do_id, rows in grouped.items()}
+
+def format_do_summary(row):
+    """Формат ответа /api/do/{do_id}/summary из сводки rollup_summary"""
+    return {
+        "total_systems": row.get('total_systems') or 0,
+        "automation_level": round(row.get('automation_level') or 0, 1),
+        "avg_age": round(row.get('avg_age') or 0, 1),
+        "problem_count": row.get('problem_count') or 0,
+        "system_types": row.get('system_types') or 0
+    }
+
+def query_do_summary(cursor, do_id: int, reference_year: int, backend: str = ANALYTICS_BACKEND):
+    if backend == "memory":
+        return format_do_summary(columnar.store.snapshot(cursor).summary(do_id, reference_year))
+
+    placeholders = ','.join('?' * len(SUMMARY_DIMENSIONS))
+    cursor.execute(f"""
+        SELECT dimension, bucket, count, sum
+        FROM detail_rollup
+        WHERE do_id = ? AND dimension IN ({placeholders})
+    """, (do_id, *SUMMARY_DIMENSIONS))
+
+    return format_do_summary(rollup_summary(cursor.fetchall(), reference_year))
+
 @app.get("/api/do/{do_id}/summary")
-async def get_do_summary(do_id: int):
+async def get_do_summary(do_id: int, reference_year: Optional[int] = reference_year_query()):
     """Расширенная статистика по ДО"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Основные метрики
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_systems,
-                AVG(CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL)) as automation_level,
-                AVG(2024 - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)) as avg_age,
-                SUM(CASE WHEN CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) > 70 THEN 1 ELSE 0 END) as problem_count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-        """, (do_id,))
-        
-        result = dict(cursor.fetchone() or {})
-        
-        # Дополнительные метрики
-        cursor.execute("""
-            SELECT COUNT(DISTINCT json_extract(detail_json, '$."Вид системы автоматизации"')) as system_types
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-        """, (do_id,))
-        
-        system_types = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
-        summary = {
-            "total_systems": result.get('total_systems', 0) or 0,
-            "automation_level": round(result.get('automation_level', 0) or 0, 1),
-            "avg_age": round(result.get('avg_age', 0) or 0, 1),
-            "problem_count": result.get('problem_count', 0) or 0,
-            "system_types": system_types
-        }
-        
+        summary = await db.run(query_do_summary, do_id, resolve_reference_year(reference_year))
         return JSONResponse(content=summary)
-        
+
     except Exception as e:
-        return JSONResponse(
-            content={"total_systems": 0, "automation_level": 0, "avg_age": 0, "problem_count": 0, "system_types": 0}
+        return fallback_response(
+            {"total_systems": 0, "automation_level": 0, "avg_age": 0, "problem_count": 0, "system_types": 0}
         )
 
+# === ДИНАМИКА ПО ГОДАМ ===
+# Результаты кэшируются по годам (year_cache) и действуют, пока не изменилась версия
+# года в year_versions: прошлые годы считаются один раз, а не после каждой записи в БД.
+# Возраст в кэше не хранится - только средний год внедрения, опорный год применяется при ответе.
+def query_year_versions(cursor, year_from: Optional[int], year_to: Optional[int]):
+    cursor.execute("""
+        SELECT year, version
+        FROM year_versions
+        WHERE year BETWEEN ? AND ?
+        ORDER BY year
+    """, (year_from if year_from is not None else -1, year_to if year_to is not None else 1_000_000))
+    return dict(cursor.fetchall())
 
-@app.get("/api/do/{do_id}/full-details")
-async def get_do_full_details(do_id: int):
-    """Полная детальная информация о ДО"""
-    try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+def pivot_indicators(cursor):
+    """[(indicator_id, indicator, колонка automation_pivot)] для колонок, которые есть в таблице"""
+    cursor.execute("PRAGMA table_info(automation_pivot)")
+    columns = {row[1] for row in cursor.fetchall()}
+    cursor.execute("""
+        SELECT indicator_id, indicator
+        FROM automation_indicators
+        ORDER BY CAST(indicator_id AS INTEGER)
+    """)
+    return [(indicator_id, indicator, indicator_column(indicator_id))
+            for indicator_id, indicator in cursor.fetchall()
+            if indicator_column(indicator_id) in columns]
 
-        # 1. Основная информация о ДО
-        cursor.execute("SELECT id, name FROM do WHERE id = ?", (do_id,))
-        do_row = cursor.fetchone()
+def query_do_trend_years(cursor, do_id: int, years: List[int], indicators):
+    """KPI и показатели ДО за несколько лет: по одному проходу по индексам на каждую таблицу"""
+    placeholders = ','.join('?' * len(years))
+    result = {year: {"kpi": None, "indicators": {}} for year in years}
 
-        if not do_row:
-            raise HTTPException(status_code=404, detail="ДО не найдена")
+    cursor.execute(f"""
+        SELECT
+            sd.year,
+            COUNT(*) as total_systems,
+            AVG(sdd.functionality) as automation_level,
+            AVG(sdd.install_year) as avg_install_year,
+            SUM(CASE WHEN sdd.wear > 70 THEN 1 ELSE 0 END) as problem_count,
+            COUNT(DISTINCT sdd.system_type) as system_types
+        FROM sa s
+        JOIN sa_data sd ON sd.sa_id = s.id
+        JOIN sa_data_details sdd ON sdd.sa_data_id = sd.id
+        WHERE s.do_id = ? AND sd.year IN ({placeholders})
+        GROUP BY sd.year
+    """, [do_id, *years])
+    for row in cursor.fetchall():
+        kpi = dict(row)
+        result[kpi.pop('year')]["kpi"] = kpi
 
-        do_info = dict(do_row)
+    if indicators:
+        cursor.execute(f"""
+            SELECT year, {", ".join(column for _, _, column in indicators)}
+            FROM automation_pivot
+            WHERE do_id = ? AND year IN ({placeholders})
+        """, [do_id, *years])
+        for row in cursor.fetchall():
+            result[row[0]]["indicators"] = {
+                indicator_id: value
+                for (indicator_id, _, _), value in zip(indicators, row[1:]) if value is not None
+            }
+    return result
 
-        # 2. KPI метрики (уже есть в summary, но дублируем)
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_systems,
-                AVG(CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL)) as automation_level,
-                AVG(2024 - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)) as avg_age,
-                SUM(CASE WHEN CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) > 70 THEN 1 ELSE 0 END) as problem_count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-        """, (do_id,))
-
-        kpi_row = cursor.fetchone()
-        kpi = {
-            "total_systems": kpi_row['total_systems'] if kpi_row else 0,
-            "automation_level": round(kpi_row['automation_level'] or 0, 1) if kpi_row else 0,
-            "avg_age": round(kpi_row['avg_age'] or 0, 1) if kpi_row else 0,
-            "problem_count": kpi_row['problem_count'] or 0 if kpi_row else 0
-        }
+def query_do_trend(cursor, do_id: int, year_from: Optional[int], year_to: Optional[int]):
+    do_name = query_do_name(cursor, do_id)
+    if do_name is None:
+        raise HTTPException(status_code=404, detail="ДО не найдена")
 
-        # 3. Статистика по типам систем
-        cursor.execute("""
-            SELECT 
-                json_extract(detail_json, '$."Вид системы автоматизации"') as system_type,
-                COUNT(*) as count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-                AND json_extract(detail_json, '$."Вид системы автоматизации"') IS NOT NULL
-                AND json_extract(detail_json, '$."Вид системы автоматизации"') != ''
-            GROUP BY json_extract(detail_json, '$."Вид системы автоматизации"')
-            ORDER BY count DESC
-        """, (do_id,))
-
-        system_stats = [{"system_type": row['system_type'], "count": row['count']}
-                        for row in cursor.fetchall()]
-
-        # 4. Возрастное распределение
-        cursor.execute("""
-            SELECT 
-                CASE 
-                    WHEN (2024 - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)) <= 5 THEN '0-5 лет'
-                    WHEN (2024 - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)) <= 10 THEN '6-10 лет'
-                    WHEN (2024 - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)) <= 15 THEN '11-15 лет'
-                    ELSE '16+ лет'
-                END as age_group,
-                COUNT(*) as count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-                AND json_extract(detail_json, '$."Год внедрения системы автоматизации"') IS NOT NULL
-                AND CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) > 0
-            GROUP BY age_group
-            ORDER BY 
-                CASE age_group
-                    WHEN '0-5 лет' THEN 1
-                    WHEN '6-10 лет' THEN 2
-                    WHEN '11-15 лет' THEN 3
-                    WHEN '16+ лет' THEN 4
-                END
-        """, (do_id,))
-
-        age_distribution = [{"age_group": row['age_group'], "count": row['count']}
-                            for row in cursor.fetchall()]
-
-        # 5. Проблемные системы (износ > 70% или функциональность < 50%)
-        cursor.execute("""
-            SELECT 
-                json_extract(detail_json, '$."Наименование объекта"') as object_name,
-                json_extract(detail_json, '$."Вид системы автоматизации"') as system_type,
-                json_extract(detail_json, '$."Год внедрения системы автоматизации"') as install_year,
-                CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) as wear,
-                CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL) as functionality
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-                AND (
-                    CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) > 70
-                    OR CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL) < 50
-                )
-            LIMIT 10
-        """, (do_id,))
-
-        problem_systems = [
-            {
-                "object_name": row['object_name'] or "Не указан",
-                "system_type": row['system_type'] or "Не указан",
-                "install_year": row['install_year'] or "Не указан",
-                "wear": round(row['wear'] or 0, 1),
-                "functionality": round(row['functionality'] or 0, 1)
-            }
-            for row in cursor.fetchall()
-        ]
+    indicators = pivot_indicators(cursor)
+    versions = query_year_versions(cursor, year_from, year_to)
+    key = ("do_trend", do_id)
+    by_year, missing = year_cache.lookup(key, versions)
+    if missing:
+        computed = query_do_trend_years(cursor, do_id, missing, indicators)
+        year_cache.store(key, computed, versions)
+        by_year.update(computed)
 
-        conn.close()
+    return {
+        "do_id": do_id,
+        "do_name": do_name,
+        "indicators": {indicator_id: indicator for indicator_id, indicator, _ in indicators},
+        "years": [(year, by_year[year]) for year in sorted(by_year)
+                  if by_year[year]["kpi"] is not None or by_year[year]["indicators"]]
+    }
 
-        # 6. Формируем ответ
-        full_details = {
-            "do_info": do_info,
-            "kpi": kpi,
-            "system_stats": system_stats,
-            "age_distribution": age_distribution,
-            "problem_systems": problem_systems
-        }
+def format_trend_kpi(kpi, reference_year: int):
+    if kpi is None:
+        return format_do_summary({})
+    avg_install_year = kpi['avg_install_year']
+    return format_do_summary({
+        **kpi,
+        "avg_age": reference_year - avg_install_year if avg_install_year is not None else None
+    })
 
-        return JSONResponse(content=full_details)
+@app.get("/api/do/{do_id}/trend")
+async def get_do_trend(do_id: int, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                       reference_year: Optional[int] = reference_year_query()):
+    """KPI (как в /summary) и показатели automation_summary ДО по всем годам"""
+    try:
+        trend = await db.run(query_do_trend, do_id, year_from, year_to)
+        reference_year = resolve_reference_year(reference_year)
+        return JSONResponse(content={
+            "do_id": trend["do_id"],
+            "do_name": trend["do_name"],
+            "reference_year": reference_year,
+            "indicators": trend["indicators"],
+            "years": [{
+                "year": year,
+                "kpi": format_trend_kpi(values["kpi"], reference_year),
+                "indicators": values["indicators"]
+            } for year, values in trend["years"]]
+        })
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in full-details: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"error": f"Database error: {str(e)}"}
-        )
+        print(f"Ошибка динамики ДО: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
 
-@app.get("/api/do/{do_id}/tech-data")
-async def get_do_tech_data(do_id: int, year: int = 2023):
-    """Технические данные ДО"""
-    try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+# === АНАЛИТИКА ===
+# Счетчики технологических объектов сектора: поле -> категория вида системы
+SECTOR_OBJECT_COUNTERS = {
+    "ukpg_count": "ukpg",
+    "wells_count": "wells",
+    "processing_units": "processing",
+    "gpz_count": "gpz",
+    "phg_objects": "phg",
+    "ks_phg_count": "ks_phg",
+}
 
-        # Получаем все системы ДО с деталями
-        cursor.execute("""
-            SELECT 
-                sdd.id,
-                json_extract(detail_json, '$."Вид системы автоматизации"') as system_type,
-                json_extract(detail_json, '$."Наименование объекта"') as object_name,
-                json_extract(detail_json, '$."Год внедрения системы автоматизации"') as install_year,
-                json_extract(detail_json, '$."Функциональность, %"') as functionality,
-                json_extract(detail_json, '$."Эксплуатационный износ"') as wear,
-                json_extract(detail_json, '$."Тип ПЛК"') as plc_type,
-                json_extract(detail_json, '$."Тип SCADA"') as scada_type
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-            JOIN sa s ON sd.sa_id = s.id
-            WHERE s.do_id = ?
-                AND json_extract(detail_json, '$."Год внедрения системы автоматизации"') IS NOT NULL
-            ORDER BY object_name
-        """, (do_id,))
-
-        details = [
-            {
-                "id": row['id'],
-                "Вид системы автоматизации": row['system_type'] or "-",
-                "Наименование объекта": row['object_name'] or "-",
-                "Год внедрения системы автоматизации": row['install_year'] or "-",
-                "Функциональность, %": row['functionality'] or 0,
-                "Эксплуатационный износ": row['wear'] or 0,
-                "Тип ПЛК": row['plc_type'] or "-",
-                "Тип SCADA": row['scada_type'] or "-"
-            }
-            for row in cursor.fetchall()
-        ]
+# Счетчики, которые отдают эндпоинты /api/analytics/<сектор>/tech-objects
+SECTOR_TECH_OBJECT_FIELDS = {
+    "dobycha": ("ukpg_count", "wells_count"),
+    "pererabotka": ("processing_units", "gpz_count"),
+    "phg": ("phg_objects", "ks_phg_count"),
+}
 
-        conn.close()
+# Показатели automation_pivot за последний год сектора: поле -> indicator_id
+SECTOR_INDICATORS = {
+    "mg_length": "54",
+    "mg_covered": "56",
+    "go_length": "63",
+    "go_covered": "65",
+    "grs_count": "94",
+    "grs_covered": "95",
+    "ks_count": "33",
+    "kc_count": "34",
+    "gpa_count": "85",
+    "cdp_count": "4",
+    "dp_count": "7",
+}
+TRANSPORT_TECH_OBJECT_FIELDS = ("mg_length", "go_length", "grs_count", "ks_count", "kc_count", "gpa_count",
+                                "cdp_count", "dp_count")
 
-        response = {
-            "year": year,
-            "do_id": do_id,
-            "details": details
-        }
+def empty_sector(sector: str):
+    title = SECTORS[sector][0] if sector in SECTORS else sector
+    return {
+        "sector": sector,
+        "title": title,
+        "do_ids": [],
+        "object_count": 0,
+        **{field: 0 for field in SECTOR_OBJECT_COUNTERS},
+        "by_do": [],
+        "indicators": None,
+    }
 
-        return JSONResponse(content=response)
+def query_sector_analytics(cursor):
+    """Аналитика всех секторов реестра do_sector.
 
-    except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content={"error": f"Database error: {str(e)}"}
+    Счетчики объектов - один сгруппированный проход по detail_rollup (total и гистограмма
+    масок категорий видов систем по ДО), показатели - один проход по automation_pivot
+    за последний год каждого сектора. Эндпоинты отдельных секторов берут срезы этого результата.
+    """
+    sectors = {sector: empty_sector(sector) for sector in SECTORS}
+    cursor.execute("SELECT sector, do_id FROM do_sector ORDER BY sector, do_id")
+    for row in cursor.fetchall():
+        sectors.setdefault(row["sector"], empty_sector(row["sector"]))["do_ids"].append(row["do_id"])
+
+    cursor.execute("SELECT name, code FROM system_categories")
+    codes = {row["name"]: row["code"] for row in cursor.fetchall()}
+    counters = ",\n".join(
+        f"SUM(CASE WHEN r.dimension = 'system_category' AND CAST(r.bucket AS INTEGER) & ? THEN r.count ELSE 0 END)"
+        f" AS {field}"
+        for field in SECTOR_OBJECT_COUNTERS
+    )
+    cursor.execute(f"""
+        SELECT
+            ds.sector,
+            d.name AS do_name,
+            SUM(CASE WHEN r.dimension = 'total' THEN r.count ELSE 0 END) AS object_count,
+            {counters}
+        FROM do_sector ds
+        JOIN do d ON d.id = ds.do_id
+        JOIN detail_rollup r ON r.do_id = ds.do_id AND r.dimension IN ('total', 'system_category')
+        GROUP BY ds.sector, d.name
+        ORDER BY ds.sector, d.name
+    """, [1 << codes[category] if category in codes else 0 for category in SECTOR_OBJECT_COUNTERS.values()])
+    for row in cursor.fetchall():
+        sector = sectors[row["sector"]]
+        item = {"do_name": row["do_name"], "object_count": row["object_count"]}
+        item.update((field, row[field]) for field in SECTOR_OBJECT_COUNTERS)
+        sector["by_do"].append(item)
+        for field, value in item.items():
+            if field != "do_name":
+                sector[field] += value
+
+    indicators = ",\n".join(f"p.{indicator_column(indicator_id)} AS {field}"
+                            for field, indicator_id in SECTOR_INDICATORS.items())
+    cursor.execute(f"""
+        WITH latest AS (
+            SELECT ds.sector, MAX(p.year) AS year
+            FROM do_sector ds
+            JOIN automation_pivot p ON p.do_id = ds.do_id
+            GROUP BY ds.sector
         )
+        SELECT
+            ds.sector,
+            l.year,
+            d.name AS do_name,
+            {indicators}
+        FROM latest l
+        JOIN do_sector ds ON ds.sector = l.sector
+        JOIN automation_pivot p ON p.do_id = ds.do_id AND p.year = l.year
+        JOIN do d ON d.id = ds.do_id
+        ORDER BY ds.sector, d.name
+    """)
+    for row in cursor.fetchall():
+        sector = sectors[row["sector"]]
+        if sector["indicators"] is None:
+            sector["indicators"] = {"year": row["year"], "by_do": []}
+        item = {"do_name": row["do_name"]}
+        item.update((field, row[field] or 0) for field in SECTOR_INDICATORS)
+        sector["indicators"]["by_do"].append(item)
+
+    return sectors
+
+def sector_tech_objects(sectors, sector: str):
+    """Срез /api/analytics/<сектор>/tech-objects: объекты по ДО сектора"""
+    fields = SECTOR_TECH_OBJECT_FIELDS[sector]
+    return [
+        {"do_name": row["do_name"], "object_count": row["object_count"], **{field: row[field] for field in fields}}
+        for row in sectors[sector]["by_do"]
+    ] if sector in sectors else []
+
+def transport_indicators(sectors):
+    """Показатели транспортных ДО за последний год; None, если данных automation_summary нет"""
+    indicators = sectors.get("transport", {}).get("indicators")
+    return indicators["by_do"] if indicators else None
+
+async def load_sector_tech_objects(sector: str):
+    return sector_tech_objects(await run_cached(query_sector_analytics), sector)
+
+@app.get("/api/analytics/sectors")
+async def get_sector_analytics():
+    """Технологические объекты и показатели всех секторов реестра do_sector"""
+    try:
+        sectors = await run_cached(query_sector_analytics)
+        return JSONResponse(content=sectors)
+
+    except Exception as e:
+        print(f"Ошибка аналитики секторов: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
-# === АНАЛИТИКА ===
 @app.get("/api/analytics/dobycha/tech-objects")
 async def get_dobycha_tech_objects():
     """Технологические объекты добычи"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # ID добывающих ДО
-        do_dobycha_ids = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 34, 35]
-        placeholders = ','.join('?' * len(do_dobycha_ids))
-        
-        cursor.execute(f"""
-            SELECT 
-                d.name as do_name,
-                COUNT(*) as object_count,
-                SUM(CASE WHEN json_extract(sdd.detail_json, '$."Вид системы автоматизации"') LIKE '%УКПГ%' THEN 1 ELSE 0 END) as ukpg_count,
-                SUM(CASE WHEN json_extract(sdd.detail_json, '$."Вид системы автоматизации"') LIKE '%скважин%' THEN 1 ELSE 0 END) as wells_count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id
-            JOIN sa s ON sd.sa_id = s.id
-            JOIN do d ON s.do_id = d.id
-            WHERE s.do_id IN ({placeholders})
-            GROUP BY d.name
-            ORDER BY d.name
-        """, do_dobycha_ids)
-        
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        result = await load_sector_tech_objects("dobycha")
         return JSONResponse(content=result)
-        
+
     except Exception as e:
         print(f"Ошибка аналитики добычи: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
+
+def transport_tech_objects(sectors):
+    indicators = transport_indicators(sectors)
+    if indicators is None:
+        return None
+    return [{"do_name": row["do_name"], **{field: row[field] for field in TRANSPORT_TECH_OBJECT_FIELDS}}
+            for row in indicators]
+
+def transport_tech_objects_or_sample(result):
+    if result is None:
+        return []
+
+    # ДЛЯ ТЕСТИРОВАНИЯ - если данных нет, вернем тестовые
+    if not result:
+        print("⚠️ Нет данных в automation_summary для транспортных ДО")
+        # Вернем тестовые данные на основе coverage-detailed
+        return [
+            {
+                'do_name': 'ООО «Газпром трансгаз Екатеринбург»',
+                'mg_length': 4407778.0, 'go_length': 4146.0, 'grs_count': 257,
+                'ks_count': 15, 'kc_count': 8, 'gpa_count': 120, 'cdp_count': 5, 'dp_count': 12
+            },
+            {
+                'do_name': 'ООО «Газпром трансгаз Москва»',
+                'mg_length': 13256.0, 'go_length': 7976.0, 'grs_count': 719,
+                'ks_count': 25, 'kc_count': 12, 'gpa_count': 180, 'cdp_count': 8, 'dp_count': 20
+            },
+            {
+                'do_name': 'ООО «Газпром трансгаз Чайковский»',
+                'mg_length': 8883.013, 'go_length': 1695.486, 'grs_count': 122,
+                'ks_count': 10, 'kc_count': 6, 'gpa_count': 85, 'cdp_count': 3, 'dp_count': 8
+            }
+        ]
+
+    return result
 
 @app.get("/api/analytics/transport/tech-objects")
 async def get_transport_tech_objects():
     """Технологические объекты транспорта - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # ИСПРАВЛЕНО: Используем те же ID, что и в coverage-detailed
-        do_transport_ids = [13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32]
-        placeholders = ','.join('?' * len(do_transport_ids))
-        
-        # Находим последний год с данными
-        cursor.execute(f"""
-            SELECT MAX(year) FROM automation_summary 
-            WHERE do_id IN ({placeholders})
-        """, do_transport_ids)
-        latest_year = cursor.fetchone()[0]
-        
-        if not latest_year:
-            return JSONResponse(content=[])
-        
-        # ИСПРАВЛЕНО: Используем те же indicator_id, что и в coverage-detailed
-        query = f"""
-        SELECT 
-            d.name as do_name,
-            MAX(CASE WHEN a.indicator_id = '54' THEN CAST(a.value AS REAL) ELSE 0 END) as mg_length,
-            MAX(CASE WHEN a.indicator_id = '63' THEN CAST(a.value AS REAL) ELSE 0 END) as go_length,
-            MAX(CASE WHEN a.indicator_id = '94' THEN CAST(a.value AS INTEGER) ELSE 0 END) as grs_count,
-            MAX(CASE WHEN a.indicator_id = '33' THEN CAST(a.value AS INTEGER) ELSE 0 END) as ks_count,
-            MAX(CASE WHEN a.indicator_id = '34' THEN CAST(a.value AS INTEGER) ELSE 0 END) as kc_count,
-            MAX(CASE WHEN a.indicator_id = '85' THEN CAST(a.value AS INTEGER) ELSE 0 END) as gpa_count,
-            MAX(CASE WHEN a.indicator_id = '4' THEN CAST(a.value AS INTEGER) ELSE 0 END) as cdp_count,
-            MAX(CASE WHEN a.indicator_id = '7' THEN CAST(a.value AS INTEGER) ELSE 0 END) as dp_count
-        FROM automation_summary a
-        JOIN do d ON a.do_id = d.id
-        WHERE a.do_id IN ({placeholders}) AND a.year = ?
-        GROUP BY a.do_id
-        ORDER BY d.name
-        """
-        
-        cursor.execute(query, do_transport_ids + [latest_year])
-        
-        result = []
-        for row in cursor.fetchall():
-            result.append({
-                'do_name': row['do_name'],
-                'mg_length': row['mg_length'] or 0,
-                'go_length': row['go_length'] or 0,
-                'grs_count': row['grs_count'] or 0,
-                'ks_count': row['ks_count'] or 0,
-                'kc_count': row['kc_count'] or 0,
-                'gpa_count': row['gpa_count'] or 0,
-                'cdp_count': row['cdp_count'] or 0,
-                'dp_count': row['dp_count'] or 0
-            })
-        
-        conn.close()
-        
-        # ДЛЯ ТЕСТИРОВАНИЯ - если данных нет, вернем тестовые
-        if not result:
-            print("⚠️ Нет данных в automation_summary для транспортных ДО")
-            # Вернем тестовые данные на основе coverage-detailed
-            return JSONResponse(content=[
-                {
-                    'do_name': 'ООО «Газпром трансгаз Екатеринбург»',
-                    'mg_length': 4407778.0, 'go_length': 4146.0, 'grs_count': 257,
-                    'ks_count': 15, 'kc_count': 8, 'gpa_count': 120, 'cdp_count': 5, 'dp_count': 12
-                },
-                {
-                    'do_name': 'ООО «Газпром трансгаз Москва»', 
-                    'mg_length': 13256.0, 'go_length': 7976.0, 'grs_count': 719,
-                    'ks_count': 25, 'kc_count': 12, 'gpa_count': 180, 'cdp_count': 8, 'dp_count': 20
-                },
-                {
-                    'do_name': 'ООО «Газпром трансгаз Чайковский»',
-                    'mg_length': 8883.013, 'go_length': 1695.486, 'grs_count': 122, 
-                    'ks_count': 10, 'kc_count': 6, 'gpa_count': 85, 'cdp_count': 3, 'dp_count': 8
-                }
-            ])
-        
+        result = await load_transport_tech_objects()
         return JSONResponse(content=result)
-        
+
     except Exception as e:
         print(f"❌ Ошибка в get_transport_tech_objects: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
 
 
 # === РЕАЛЬНЫЕ ДАННЫЕ ДЛЯ ГРАФИКОВ ПОКРЫТИЯ ===
+def transport_coverage_detailed(sectors):
+    indicators = transport_indicators(sectors)
+    if indicators is None:
+        return {"mg": [], "go": [], "grs": []}
+
+    mg_data = []
+    go_data = []
+    grs_data = []
+
+    for row in indicators:
+        do_name = row['do_name']
+
+        # Данные МГ
+        mg_data.append({
+            'do_name': do_name,
+            'total': row['mg_length'],
+            'covered': row['mg_covered'],
+            'valves_total': 0,  # Можно добавить из других показателей
+            'valves_covered': 0
+        })
+
+        # Данные ГО
+        go_data.append({
+            'do_name': do_name,
+            'total': row['go_length'],
+            'covered': row['go_covered'],
+            'valves_total': 0,
+            'valves_covered': 0
+        })
+
+        # Данные ГРС
+        grs_data.append({
+            'do_name': do_name,
+            'total': row['grs_count'],
+            'covered': row['grs_covered']
+        })
+
+    return {
+        "mg": mg_data,
+        "go": go_data,
+        "grs": grs_data
+    }
+
+async def load_transport_coverage_detailed():
+    return transport_coverage_detailed(await run_cached(query_sector_analytics))
+
 @app.get("/api/analytics/transport/coverage-detailed")
 async def get_transport_coverage_detailed():
     """Реальные данные для графиков покрытия СЛТМ из automation_summary"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # ID транспортных ДО
-        do_transport_ids = [13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32]
-        placeholders = ','.join('?' * len(do_transport_ids))
-        
-        # Находим последний год с данными
-        cursor.execute(f"""
-            SELECT MAX(year) FROM automation_summary 
-            WHERE do_id IN ({placeholders})
-        """, do_transport_ids)
-        latest_year = cursor.fetchone()[0]
-        
-        if not latest_year:
-            return JSONResponse(content={"mg": [], "go": [], "grs": []})
-        
-        # Получаем данные покрытия для МГ, ГО, ГРС
-        query = f"""
-        SELECT 
-            d.name as do_name,
-            MAX(CASE WHEN a.indicator_id = '54' THEN a.value ELSE 0 END) as mg_total,
-            MAX(CASE WHEN a.indicator_id = '56' THEN a.value ELSE 0 END) as mg_covered,
-            MAX(CASE WHEN a.indicator_id = '63' THEN a.value ELSE 0 END) as go_total,
-            MAX(CASE WHEN a.indicator_id = '65' THEN a.value ELSE 0 END) as go_covered,
-            MAX(CASE WHEN a.indicator_id = '94' THEN a.value ELSE 0 END) as grs_total,
-            MAX(CASE WHEN a.indicator_id = '95' THEN a.value ELSE 0 END) as grs_covered
-        FROM automation_summary a
-        JOIN do d ON a.do_id = d.id
-        WHERE a.do_id IN ({placeholders}) AND a.year = ?
-        GROUP BY a.do_id
-        ORDER BY d.name
-        """
-        
-        cursor.execute(query, do_transport_ids + [latest_year])
-        rows = cursor.fetchall()
-        
-        mg_data = []
-        go_data = []
-        grs_data = []
-        
-        for row in rows:
-            do_name = row['do_name']
-            
-            # Данные МГ
-            mg_total = float(row['mg_total']) if row['mg_total'] not in (None, '') else 0
-            mg_covered = float(row['mg_covered']) if row['mg_covered'] not in (None, '') else 0
-            mg_data.append({
-                'do_name': do_name,
-                'total': mg_total,
-                'covered': mg_covered,
-                'valves_total': 0,  # Можно добавить из других показателей
-                'valves_covered': 0
-            })
-            
-            # Данные ГО
-            go_total = float(row['go_total']) if row['go_total'] not in (None, '') else 0
-            go_covered = float(row['go_covered']) if row['go_covered'] not in (None, '') else 0
-            go_data.append({
-                'do_name': do_name,
-                'total': go_total,
-                'covered': go_covered,
-                'valves_total': 0,
-                'valves_covered': 0
-            })
-            
-            # Данные ГРС
-            grs_total = int(row['grs_total']) if row['grs_total'] not in (None, '') else 0
-            grs_covered = int(row['grs_covered']) if row['grs_covered'] not in (None, '') else 0
-            grs_data.append({
-                'do_name': do_name,
-                'total': grs_total,
-                'covered': grs_covered
-            })
-        
-        conn.close()
-        
-        return JSONResponse(content={
-            "mg": mg_data,
-            "go": go_data, 
-            "grs": grs_data
-        })
-        
+        coverage = await load_transport_coverage_detailed()
+        return JSONResponse(content=coverage)
+
     except Exception as e:
         print(f"Ошибка реальных данных покрытия: {e}")
-        return JSONResponse(content={"mg": [], "go": [], "grs": []})
+        return fallback_response({"mg": [], "go": [], "grs": []})
+
+# Фильтр condition-detailed -> категория вида системы (system_categories)
+TRANSPORT_SYSTEM_FILTERS = {
+    "АСУ ТП УКПГ (УППГ)": "asu_tp_ukpg",
+    "АСУ ТП": "asu_tp",
+    "САУ ГПА": "sau_gpa",
+    "АСПС": "asps",
+    "СТМ": "stm"
+}
+
+def query_category_masks(cursor, category: str):
+    """Маски system_category, в которые входит категория - для фильтра по индексу"""
+    cursor.execute("""
+        SELECT DISTINCT t.categories
+        FROM system_categories c
+        JOIN system_type_class t ON t.categories & (1 << c.code)
+        WHERE c.name = ?
+    """, (category,))
+    return [row[0] for row in cursor.fetchall()]
+
+def query_transport_condition_detailed(cursor, system_filter: str, aggregate: bool, reference_year: int):
+    # ДО транспорта - из реестра секторов; фильтр идет по индексу sa.do_id
+    conditions = [
+        "s.do_id IN (SELECT do_id FROM do_sector WHERE sector = ?)",
+        "sdd.install_year IS NOT NULL",
+        "sdd.install_year != 0"
+    ]
+    params = ["transport"]
+
+    # Применяем фильтр как в Tkinter
+    if system_filter != "Все системы":
+        category = TRANSPORT_SYSTEM_FILTERS.get(system_filter)
+        masks = query_category_masks(cursor, category) if category else []
+        if masks:
+            conditions.append(f"sdd.system_category IN ({','.join('?' * len(masks))})")
+            params.extend(masks)
+        else:
+            conditions.append("0")
+
+    age_group = f"""
+        CASE
+            WHEN {int(reference_year)} - sdd.install_year <= 12 THEN 'до 12 лет'
+            WHEN {int(reference_year)} - sdd.install_year <= 24 THEN '12-24 года'
+            ELSE 'более 25 лет'
+        END"""
+    source = f"""
+        FROM sa_data_details sdd
+        JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        JOIN sa s ON sd.sa_id = s.id
+        JOIN do d ON s.do_id = d.id
+        WHERE {" AND ".join(conditions)}"""
+
+    if aggregate:
+        # Графикам нужны только количества по ДО и возрастной группе
+        cursor.execute(f"""
+            SELECT d.name as do_name, {age_group} as age_group, COUNT(*) as count
+            {source}
+            GROUP BY d.name, age_group
+            ORDER BY d.name, age_group
+        """, params)
+    else:
+        cursor.execute(f"""
+            SELECT d.name as do_name, sdd.system_type as system_type, {age_group} as age_group
+            {source}
+            ORDER BY sdd.id
+        """, params)
+
+    return [dict(row) for row in cursor.fetchall()]
 
 @app.get("/api/analytics/transport/condition-detailed")
-async def get_transport_condition_detailed(system_filter: str = "Все системы"):
+async def get_transport_condition_detailed(system_filter: str = "Все системы", aggregate: bool = False,
+                                          reference_year: Optional[int] = reference_year_query()):
     """Реальные данные технического состояния из sa_data_details"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # ДО транспорта по названиям 
-        do_transport_names = [
-            "ООО «Газпром трансгаз Ухта»",
-            "ООО «Газпром трансгаз Махачкала»",
-            "ООО «Газпром трансгаз Ставрополь»",
-            "ООО «Газпром трансгаз Сургут»",
-            "ООО «Газпром трансгаз Волгоград»",
-            "ООО «Газпром трансгаз Югорск»",
-            "ООО «Газпром трансгаз Самара»",
-            "ООО «Газпром трансгаз Краснодар»",
-            "ООО «Газпром трансгаз Санкт-Петербург»",
-            "ООО «Газпром трансгаз Саратов»",
-            "ООО «Газпром трансгаз Чайковский»",
-            "ООО «Газпром трансгаз Беларусь»",
-            "ООО «Газпром трансгаз Нижний Новгород»",
-            "ООО «Газпром трансгаз Екатеринбург»",
-            "ООО «Газпром трансгаз Казань»",
-            "ООО «Газпром трансгаз Москва»",
-            "ООО «Газпром трансгаз Томск»",
-            "ООО «Газпром трансгаз Уфа»",
-            "АО «Газпром трансгаз Грозный»",
-            "ЗАО «Газпром Армения»",
-            "АО «Газпром Кыргызстан»"
-        ]
-        
-        placeholders = ','.join('?' * len(do_transport_names))
-        
-        # Базовый запрос
-        query = f"""
-        SELECT 
-            json_extract(sdd.detail_json, '$.Наименование ДО') as do_name,
-            json_extract(sdd.detail_json, '$.Вид системы автоматизации') as system_type,
-            json_extract(sdd.detail_json, '$.Год внедрения системы автоматизации') as install_year
-        FROM sa_data_details sdd
-        WHERE json_extract(sdd.detail_json, '$.Наименование ДО') IN ({placeholders})
-        """
-        
-        cursor.execute(query, do_transport_names)
-        rows = cursor.fetchall()
-        
-        # Функция для определения возрастной группы 
-        def get_age_group(age):
-            if age <= 12:
-                return "до 12 лет"
-            elif age <= 24:
-                return "12-24 года"
-            else:
-                return "более 25 лет"
-        
-        result = []
-        current_year = datetime.now().year
-        
-        for row in rows:
-            do_name = row['do_name']
-            system_type = row['system_type']
-            install_year = int(row['install_year']) if row['install_year'] not in (None, '') else None
-            
-            if install_year:
-                age = current_year - install_year
-                age_group = get_age_group(age)
-                
-                result.append({
-                    'do_name': do_name,
-                    'system_type': system_type,
-                    'age_group': age_group
-                })
-        
-        # Применяем фильтр как в Tkinter
-        if system_filter != "Все системы":
-            system_keywords = {
-                "АСУ ТП УКПГ (УППГ)": ["УКПГ", "УППГ"],
-                "АСУ ТП": ["АСУ ТП"],
-                "САУ ГПА": ["САУ ГПА", "ГПА"],
-                "АСПС": ["АСПС", "пожар"],
-                "СТМ": ["СТМ", "телемех"]
-            }
-            keywords = system_keywords.get(system_filter, [])
-            result = [item for item in result if any(keyword in item["system_type"] for keyword in keywords)]
-        
-        conn.close()
+        result = await db.run(query_transport_condition_detailed, system_filter, aggregate,
+                              resolve_reference_year(reference_year))
         return JSONResponse(content=result)
-        
+
     except Exception as e:
         print(f"Ошибка реальных данных состояния: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
+
+def query_age_stats(cursor, reference_year: int, backend: str = ANALYTICS_BACKEND):
+    if backend == "memory":
+        return columnar.store.snapshot(cursor).age_stats(reference_year)
+
+    # Гистограмма годов внедрения из detail_rollup - группы возраста считаются от опорного года
+    cursor.execute("""
+        SELECT bucket, SUM(count)
+        FROM detail_rollup
+        WHERE dimension = 'install_year'
+        GROUP BY bucket
+    """)
+
+    groups = {}
+    for install_year, count in cursor.fetchall():
+        group = age_group_5y(reference_year - int(install_year))
+        groups[group] = groups.get(group, 0) + count
+
+    return [{"age_group": group, "count": count} for group, count in sorted(groups.items()) if count]
 
 @app.get("/api/analytics/age-stats")
-async def get_age_stats():
+async def get_age_stats(reference_year: Optional[int] = reference_year_query()):
     """Статистика по возрасту систем"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        cursor = conn.cursor()
-        
-        current_year = datetime.now().year
-        cursor.execute(f"""
-            SELECT 
-                CASE
-                    WHEN {current_year} - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) <= 5 THEN '0-5 лет'
-                    WHEN {current_year} - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) <= 10 THEN '6-10 лет' 
-                    WHEN {current_year} - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) <= 15 THEN '11-15 лет'
-                    ELSE '16+ лет'
-                END as age_group,
-                COUNT(*) as count
-            FROM sa_data_details
-            WHERE json_extract(detail_json, '$."Год внедрения системы автоматизации"') IS NOT NULL
-            GROUP BY age_group
-            ORDER BY age_group
-        """)
-        
-        result = [{"age_group": row[0], "count": row[1]} for row in cursor.fetchall()]
-        conn.close()
+        result = await run_cached(query_age_stats, resolve_reference_year(reference_year))
         return JSONResponse(content=result)
-        
+
     except Exception as e:
         print(f"Ошибка возрастной статистики: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
 
 # === ИМПОРТОЗАМЕЩЕНИЕ ===
+def query_import_substitution_stats(cursor):
+    # Общая статистика: сумма по всем ДО, включая строки без ДО (do_id = 0).
+    # "Не замещено" - как в исходном запросе: import_status IS NULL или 'Не замещено' (не '')
+    cursor.execute("""
+        SELECT
+            SUM(count) as total,
+            SUM(CASE WHEN bucket = ':Замещено' THEN count ELSE 0 END) as substituted,
+            SUM(CASE WHEN bucket = ':Испытания' THEN count ELSE 0 END) as testing,
+            SUM(CASE WHEN bucket IN ('', ':Не замещено') THEN count ELSE 0 END) as not_substituted
+        FROM detail_rollup
+        WHERE dimension = 'import_status'
+    """)
+
+    stats_row = cursor.fetchone()
+    overall_stats = {
+        "total": stats_row[0] or 0,
+        "substituted": stats_row[1] or 0,
+        "testing": stats_row[2] or 0,
+        "not_substituted": stats_row[3] or 0
+    }
+
+    # Статистика по ДО
+    cursor.execute("""
+        SELECT
+            d.name as do_name,
+            SUM(r.count) as total,
+            SUM(CASE WHEN r.bucket = ':Замещено' THEN r.count ELSE 0 END) as substituted,
+            SUM(CASE WHEN r.bucket = ':Испытания' THEN r.count ELSE 0 END) as testing
+        FROM detail_rollup r
+        JOIN do d ON r.do_id = d.id
+        WHERE r.dimension = 'import_status'
+        GROUP BY d.name
+        ORDER BY d.name
+    """)
+
+    do_stats = [dict(row) for row in cursor.fetchall()]
+
+    return {
+        "overall": overall_stats,
+        "by_do": do_stats
+    }
+
 @app.get("/api/import-substitution/stats")
 async def get_import_substitution_stats():
     """Статистика импортозамещения"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Общая статистика
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN import_status = 'Замещено' THEN 1 ELSE 0 END) as substituted,
-                SUM(CASE WHEN import_status = 'Испытания' THEN 1 ELSE 0 END) as testing,
-                SUM(CASE WHEN import_status IS NULL OR import_status = 'Не замещено' THEN 1 ELSE 0 END) as not_substituted
-            FROM sa_data_details
-        """)
-        
-        stats_row = cursor.fetchone()
-        overall_stats = {
-            "total": stats_row[0] or 0,
-            "substituted": stats_row[1] or 0,
-            "testing": stats_row[2] or 0,
-            "not_substituted": stats_row[3] or 0
-        }
-        
-        # Статистика по ДО
-        cursor.execute("""
-            SELECT 
-                d.name as do_name,
-                COUNT(*) as total,
-                SUM(CASE WHEN sdd.import_status = 'Замещено' THEN 1 ELSE 0 END) as substituted,
-                SUM(CASE WHEN sdd.import_status = 'Испытания' THEN 1 ELSE 0 END) as testing
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id
-            JOIN sa s ON sd.sa_id = s.id  
-            JOIN do d ON s.do_id = d.id
-            GROUP BY d.name
-            ORDER BY d.name
-        """)
-        
-        do_stats = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return JSONResponse(content={
-            "overall": overall_stats,
-            "by_do": do_stats
-        })
-        
+        stats = await run_cached(query_import_substitution_stats)
+        return JSONResponse(content=stats)
+
     except Exception as e:
         print(f"Ошибка статистики импортозамещения: {e}")
-        return JSONResponse(content={"overall": {"total": 0, "substituted": 0, "testing": 0, "not_substituted": 0}, "by_do": []})
+        return fallback_response({"overall": {"total": 0, "substituted": 0, "testing": 0, "not_substituted": 0}, "by_do": []})
+
+IMPORT_SYSTEMS_PAGE_SIZE = 100
+IMPORT_SYSTEMS_MAX_PAGE_SIZE = 1000
+# Верхняя граница диапазона строк с заданным префиксом: наибольший символ Unicode
+PREFIX_UPPER_BOUND = "\U0010ffff"
+
+# Порядок списка -> ключ keyset-пагинации: (SQL-выражение, поле строки ответа).
+# name - порядок исходного списка (ДО, система), id записи делает ключ однозначным;
+# id - порядок rowid, который не требует сортировки всей выборки на каждой странице.
+IMPORT_SYSTEMS_SORTS = {
+    "name": (("COALESCE(d.name, '')", "do_name"), ("COALESCE(s.name, '')", "system_name"), ("sdd.id", "detail_id")),
+    "id": (("sdd.id", "detail_id"),),
+}
+
+def import_systems_filter(filters):
+    """WHERE для списка импортозамещения; filters - кортеж пар (имя, значение)"""
+    conditions = ["(sdd.import_status IS NOT NULL OR sdd.test_stage IS NOT NULL)"]
+    params = []
+    for name, value in filters:
+        if name == "do_id":
+            conditions.append("s.do_id = ?")
+            params.append(value)
+        elif name == "import_status":
+            if value == "Не указан":
+                conditions.append("sdd.import_status IS NULL")
+            else:
+                conditions.append("sdd.import_status = ?")
+                params.append(value)
+        elif name == "test_stage":
+            conditions.append("sdd.test_stage = ?")
+            params.append(value)
+        elif name in ("plc", "scada"):
+            # Префикс - диапазоном по индексу колонки (LIKE без учета регистра индекс не использует)
+            column = "sdd.plc_type" if name == "plc" else "sdd.scada_type"
+            conditions.append(f"{column} >= ? AND {column} < ?")
+            params.extend([value, value + PREFIX_UPPER_BOUND])
+        elif name == "q":
+            # Слова - префиксы по индексу sdd_search (объект, вид системы, ПЛК, SCADA, ДО)
+            match = fts_query(value)
+            if match is None:
+                conditions.append("0")
+            else:
+                conditions.append("sdd.rowid IN (SELECT rowid FROM sdd_search WHERE sdd_search MATCH ?)")
+                params.append(match)
+    return " AND ".join(conditions), params
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+
+def decode_keyset_cursor(cursor: str, sort: str) -> list:
+    """Курсор страницы для порядка sort: строки для имен и целый id последним; иначе ValueError"""
+    try:
+        values = decode_cursor(cursor)
+    except Exception as e:
+        raise ValueError(str(e))
+    keys = IMPORT_SYSTEMS_SORTS[sort]
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError(f"ожидается курсор из {len(keys)} значений")
+    *names, detail_id = values
+    if type(detail_id) is not int or not all(isinstance(name, str) for name in names):
+        raise ValueError("ожидается курсор [имя, ..., id]")
+    return values
+
+def query_import_substitution_systems(cursor, filters, after, limit: int, sort: str = "name"):
+    where, params = import_systems_filter(filters)
+    keys = IMPORT_SYSTEMS_SORTS[sort]
+    order = ", ".join(expr for expr, _ in keys)
+
+    # Keyset-пагинация: следующая страница продолжает с последней строки предыдущей
+    # (сравнение кортежей ключа), без OFFSET
+    if after is not None:
+        where += f" AND ({order}) > ({', '.join('?' * len(keys))})"
+        params += list(after)
+
+    cursor.execute(f"""
+        SELECT
+            sdd.id as detail_id,
+            d.name as do_name,
+            s.name as system_name,
+            sdd.object_name as object_name,
+            sdd.plc_type as plc_type,
+            sdd.scada_type as scada_type,
+            COALESCE(sdd.import_status, 'Не указан') as import_status,
+            sdd.test_stage
+        FROM sa_data_details sdd
+        JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        JOIN sa s ON sd.sa_id = s.id
+        JOIN do d ON s.do_id = d.id
+        WHERE {where}
+        ORDER BY {order}
+        LIMIT ?
+    """, params + [limit + 1])
+
+    rows = [dict(row) for row in cursor.fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last[field] if last[field] is not None else "" for _, field in keys])
+    return rows, next_cursor
+
+def query_import_substitution_count(cursor, filters):
+    where, params = import_systems_filter(filters)
+    cursor.execute(f"""
+        SELECT COUNT(*)
+        FROM sa_data_details sdd
+        JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        JOIN sa s ON sd.sa_id = s.id
+        JOIN do d ON s.do_id = d.id
+        WHERE {where}
+    """, params)
+    return cursor.fetchone()[0]
 
 @app.get("/api/import-substitution/systems")
-async def get_import_substitution_systems():
-    """Список систем для импортозамещения"""
+async def get_import_substitution_systems(do_id: Optional[int] = None,
+                                          import_status: Optional[str] = None,
+                                          test_stage: Optional[str] = None,
+                                          plc: Optional[str] = None,
+                                          scada: Optional[str] = None,
+                                          q: Optional[str] = None,
+                                          sort: str = Query("name", pattern="^(name|id)$"),
+                                          cursor: Optional[str] = None,
+                                          limit: int = Query(IMPORT_SYSTEMS_PAGE_SIZE, ge=1, le=IMPORT_SYSTEMS_MAX_PAGE_SIZE)):
+    """Список систем для импортозамещения: фильтры, страницы по курсору и общее число.
+
+    sort=name (по умолчанию) - по ДО и системе, как исходный список; sort=id - по id записи.
+    Курсор действителен только для того порядка, в котором он выдан.
+    """
+    filters = tuple(
+        (name, value) for name, value in (
+            ("do_id", do_id), ("import_status", import_status), ("test_stage", test_stage),
+            ("plc", plc), ("scada", scada), ("q", q)
+        )
+        if value not in (None, "")
+    )
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                sdd.id as detail_id,
-                d.name as do_name,
-                s.name as system_name,
-                json_extract(sdd.detail_json, '$."Наименование объекта"') as object_name,
-                json_extract(sdd.detail_json, '$."Тип ПЛК"') as plc_type,
-                json_extract(sdd.detail_json, '$."Тип SCADA"') as scada_type,
-                COALESCE(sdd.import_status, 'Не указан') as import_status,
-                sdd.test_stage
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id
-            JOIN sa s ON sd.sa_id = s.id
-            JOIN do d ON s.do_id = d.id
-            WHERE sdd.import_status IS NOT NULL OR sdd.test_stage IS NOT NULL
-            ORDER BY d.name, s.name
-            LIMIT 100
-        """)
-        
-        systems = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return JSONResponse(content=systems)
-        
+        after = decode_keyset_cursor(cursor, sort) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+    try:
+        (items, next_cursor), total = await asyncio.gather(
+            db.run(query_import_substitution_systems, filters, after, limit, sort),
+            run_cached(query_import_substitution_count, filters)
+        )
+        return JSONResponse(content={
+            "items": items,
+            "total": total,
+            "next_cursor": next_cursor
+        })
+
     except Exception as e:
         print(f"Ошибка загрузки систем импортозамещения: {e}")
-        return JSONResponse(content=[])
+        return fallback_response({"items": [], "total": 0, "next_cursor": None})
 
-# === АВТОМАТИЗАЦИЯ ===
-@app.get("/api/automation/summary")
-async def get_automation_summary():
-    """Сводные данные по автоматизации"""
-    try:
-        conn = sqlite3.connect("do_system.db")
-        cursor = conn.cursor()
-        
-        # Получаем данные из automation_summary
+# === ПОИСК ===
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 200
+SEARCH_FACET_LIMIT = 50
+
+SEARCH_FACETS = ("do_id", "system_type", "import_status")
+
+SEARCH_FROM = """
+    FROM sdd_search
+    JOIN sa_data_details sdd ON sdd.rowid = sdd_search.rowid
+    LEFT JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    LEFT JOIN sa s ON sd.sa_id = s.id
+    LEFT JOIN do d ON s.do_id = d.id"""
+
+def fts_query(text: str, prefix: bool = True) -> Optional[str]:
+    """Строка пользователя -> выражение MATCH: все слова обязательны, каждое - как префикс.
+
+    Слова берутся в кавычки, поэтому синтаксис FTS5 (AND, NEAR, *, :) из ввода не действует.
+    """
+    tokens = re.findall(r"\w+", search_text(text).lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' if prefix else f'"{token}"' for token in tokens)
+
+def search_filter(filters):
+    """Условия WHERE для фильтров поиска (кроме MATCH)"""
+    conditions, params = [], []
+    for name, value in filters:
+        if name == "do_id":
+            conditions.append("s.do_id = ?")
+            params.append(value)
+        elif name == "system_type":
+            conditions.append("sdd.system_type = ?")
+            params.append(value)
+        elif name == "import_status":
+            if value == "Не указан":
+                conditions.append("sdd.import_status IS NULL")
+            else:
+                conditions.append("sdd.import_status = ?")
+                params.append(value)
+    return conditions, params
+
+def search_value_matches(name: str, value, wanted) -> bool:
+    if name == "import_status" and wanted == "Не указан":
+        return value is None
+    return value == wanted
+
+def facet_items(counts):
+    """Значения фасета по убыванию количества, не больше SEARCH_FACET_LIMIT"""
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0] is None, str(item[0] or "")))
+    return ordered[:SEARCH_FACET_LIMIT]
+
+def query_search_facets(cursor, match: str, filters):
+    """Итог и фасеты по одному GROUP BY (ДО, вид системы, статус) без фильтров.
+
+    Фасет считается без собственного фильтра - чтобы было видно, на что переключиться.
+    """
+    cursor.execute(f"""
+        SELECT s.do_id, d.name, sdd.system_type, sdd.import_status, COUNT(*)
+        {SEARCH_FROM}
+        WHERE sdd_search MATCH ?
+        GROUP BY s.do_id, sdd.system_type, sdd.import_status
+    """, (match,))
+
+    wanted = dict(filters)
+    total = 0
+    counts = {name: {} for name in SEARCH_FACETS}
+    do_names = {}
+    for do_id, do_name, system_type, import_status, count in cursor.fetchall():
+        values = {"do_id": do_id, "system_type": system_type, "import_status": import_status}
+        do_names[do_id] = do_name
+        failed = [name for name, value in wanted.items() if not search_value_matches(name, values[name], value)]
+        if not failed:
+            total += count
+        for name in SEARCH_FACETS:
+            if not failed or failed == [name]:
+                counts[name][values[name]] = counts[name].get(values[name], 0) + count
+
+    facets = {
+        "do": [{"do_id": do_id, "do_name": do_names[do_id], "count": count}
+               for do_id, count in facet_items(counts["do_id"])],
+        "system_type": [{"value": value, "count": count} for value, count in facet_items(counts["system_type"])],
+        "import_status": [{"value": value, "count": count} for value, count in facet_items(counts["import_status"])],
+    }
+    return total, facets
+
+def query_search(cursor, q: str, filters, prefix: bool, limit: int, offset: int):
+    match = fts_query(q, prefix)
+    if match is None:
+        return {"items": [], "total": 0, "facets": {"do": [], "system_type": [], "import_status": []}}
+
+    total, facets = query_search_facets(cursor, match, filters)
+    if offset >= total:
+        return {"items": [], "total": total, "facets": facets}
+
+    # Страница по rank (bm25 с весами колонок); без фильтров - прямо из FTS-индекса, без соединений
+    if filters:
+        conditions, params = search_filter(filters)
+        cursor.execute(f"""
+            SELECT sdd_search.rowid, sdd_search.rank
+            {SEARCH_FROM}
+            WHERE sdd_search MATCH ? AND {" AND ".join(conditions)}
+            ORDER BY sdd_search.rank, sdd_search.rowid
+            LIMIT ? OFFSET ?
+        """, [match, *params, limit, offset])
+    else:
         cursor.execute("""
-            SELECT 
-                d.name as do_name,
-                a.indicator_id,
-                a.indicator,
-                a.year,
-                a.value
-            FROM automation_summary a
-            JOIN do d ON a.do_id = d.id
-            WHERE a.year = 2023
-            ORDER BY d.name, CAST(a.indicator_id AS INTEGER)
-        """)
-        
-        # Группируем по ДО и показателям
-        data = {}
-        for row in cursor.fetchall():
-            do_name, indicator_id, indicator, year, value = row
-            if do_name not in data:
-                data[do_name] = []
-            
-            data[do_name].append({
+            SELECT rowid, rank
+            FROM sdd_search
+            WHERE sdd_search MATCH ?
+            ORDER BY rank, rowid
+            LIMIT ? OFFSET ?
+        """, (match, limit, offset))
+    ranked = cursor.fetchall()
+    if not ranked:
+        return {"items": [], "total": total, "facets": facets}
+
+    placeholders = ','.join('?' * len(ranked))
+    cursor.execute(f"""
+        SELECT
+            sdd.rowid as search_rowid,
+            sdd.id as detail_id,
+            s.do_id,
+            d.name as do_name,
+            s.name as system_name,
+            sd.year,
+            sdd.object_name,
+            sdd.system_type,
+            sdd.plc_type,
+            sdd.scada_type,
+            sdd.import_status,
+            sdd.test_stage
+        FROM sa_data_details sdd
+        LEFT JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        LEFT JOIN sa s ON sd.sa_id = s.id
+        LEFT JOIN do d ON s.do_id = d.id
+        WHERE sdd.rowid IN ({placeholders})
+    """, [rowid for rowid, _ in ranked])
+    rows = {row[0]: dict(row) for row in cursor.fetchall()}
+
+    items = []
+    for rowid, rank in ranked:
+        item = rows.get(rowid)
+        if item is not None:
+            del item['search_rowid']
+            # bm25 в SQLite отрицательный: чем меньше, тем релевантнее
+            item['score'] = round(-rank, 4)
+            items.append(item)
+    return {"items": items, "total": total, "facets": facets}
+
+@app.get("/api/search")
+async def search_systems(q: str = Query(..., min_length=1, max_length=200),
+                         do_id: Optional[int] = None,
+                         system_type: Optional[str] = None,
+                         import_status: Optional[str] = None,
+                         prefix: bool = True,
+                         limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+                         offset: int = Query(0, ge=0)):
+    """Полнотекстовый поиск систем по объекту, виду системы, ПЛК, SCADA и ДО.
+
+    Слова запроса ищутся как префиксы (prefix=false - только целые слова), результаты
+    упорядочены по bm25; facets - счетчики по ДО, виду системы и статусу импортозамещения.
+    """
+    filters = tuple(
+        (name, value) for name, value in (
+            ("do_id", do_id), ("system_type", system_type), ("import_status", import_status)
+        )
+        if value not in (None, "")
+    )
+    try:
+        result = await run_cached(query_search, q, filters, prefix, limit, offset)
+        return JSONResponse(content={"query": q, **result})
+
+    except sqlite3.OperationalError as e:
+        print(f"Ошибка поиска: {e}")
+        raise HTTPException(status_code=503, detail="Поисковый индекс недоступен")
+    except Exception as e:
+        print(f"Ошибка поиска: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+# === АВТОМАТИЗАЦИЯ ===
+def query_automation_summary(cursor, year: Optional[int] = None):
+    # Названия показателей и колонки широкой таблицы automation_pivot
+    cursor.execute("""
+        SELECT indicator_id, indicator
+        FROM automation_indicators
+        ORDER BY CAST(indicator_id AS INTEGER)
+    """)
+    indicators = [(indicator_id, indicator, indicator_column(indicator_id))
+                  for indicator_id, indicator in cursor.fetchall()]
+
+    if year is None:
+        # По умолчанию - последний год, за который есть показатели
+        cursor.execute("SELECT MAX(year) FROM automation_pivot")
+        year = cursor.fetchone()[0]
+
+    cursor.execute("""
+        SELECT d.name as do_name, p.*
+        FROM automation_pivot p
+        JOIN do d ON p.do_id = d.id
+        WHERE p.year = ?
+        ORDER BY d.name
+    """, (year,))
+
+    # Группируем по ДО и показателям
+    data = {}
+    for row in cursor.fetchall():
+        columns = row.keys()
+        items = data.setdefault(row['do_name'], [])
+        for indicator_id, indicator, column in indicators:
+            if column not in columns or row[column] is None:
+                continue
+            items.append({
                 "indicator_id": indicator_id,
                 "indicator": indicator,
-                "year": year,
-                "value": value
+                "year": row['year'],
+                "value": row[column]
             })
-        
-        conn.close()
+
+    return data
+
+@app.get("/api/automation/summary")
+async def get_automation_summary(year: Optional[int] = None):
+    """Сводные данные по автоматизации за год (по умолчанию - последний)"""
+    try:
+        data = await run_cached(query_automation_summary, year)
         return JSONResponse(content=data)
-        
+
     except Exception as e:
         print(f"Ошибка сводной автоматизации: {e}")
-        return JSONResponse(content={})
+        return fallback_response({})
+
+def query_automation_trend_years(cursor, do_id: Optional[int], years: List[int], indicators):
+    """Суммы показателей по ДО (или значения одного ДО) за несколько лет"""
+    placeholders = ','.join('?' * len(years))
+    sums = ", ".join(f"SUM({column})" for _, _, column in indicators)
+    cursor.execute(f"""
+        SELECT year, COUNT(*){", " + sums if sums else ""}
+        FROM automation_pivot
+        WHERE year IN ({placeholders}) {"AND do_id = ?" if do_id is not None else ""}
+        GROUP BY year
+    """, [*years] + ([do_id] if do_id is not None else []))
+
+    result = {year: None for year in years}
+    for row in cursor.fetchall():
+        result[row[0]] = {
+            "do_count": row[1],
+            "values": {indicator_id: value
+                       for (indicator_id, _, _), value in zip(indicators, row[2:]) if value is not None}
+        }
+    return result
+
+def query_automation_trend(cursor, do_id: Optional[int], year_from: Optional[int], year_to: Optional[int]):
+    indicators = pivot_indicators(cursor)
+    versions = query_year_versions(cursor, year_from, year_to)
+    key = ("automation_trend", do_id)
+    by_year, missing = year_cache.lookup(key, versions)
+    if missing:
+        computed = query_automation_trend_years(cursor, do_id, missing, indicators)
+        year_cache.store(key, computed, versions)
+        by_year.update(computed)
+
+    return {
+        "do_id": do_id,
+        "indicators": {indicator_id: indicator for indicator_id, indicator, _ in indicators},
+        "years": [{"year": year, **by_year[year]} for year in sorted(by_year) if by_year[year] is not None]
+    }
+
+@app.get("/api/automation/trend")
+async def get_automation_trend(do_id: Optional[int] = None,
+                               indicator: Optional[List[str]] = Query(None),
+                               year_from: Optional[int] = None, year_to: Optional[int] = None):
+    """Показатели automation_summary по годам: суммы по всем ДО или значения одного do_id.
+
+    indicator (можно повторять) - оставить в ответе только эти indicator_id.
+    """
+    try:
+        trend = await db.run(query_automation_trend, do_id, year_from, year_to)
+        if indicator:
+            wanted = set(indicator)
+            trend = {
+                **trend,
+                "indicators": {key: name for key, name in trend["indicators"].items() if key in wanted},
+                "years": [{**item, "values": {key: value for key, value in item["values"].items() if key in wanted}}
+                          for item in trend["years"]]
+            }
+        return JSONResponse(content=trend)
+
+    except Exception as e:
+        print(f"Ошибка динамики автоматизации: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
 # === СИСТЕМЫ И ДЕТАЛИЗАЦИЯ ===
+def query_system_types(cursor):
+    cursor.execute("""
+        SELECT DISTINCT system_type
+        FROM sa_data_details
+        WHERE system_type IS NOT NULL
+        ORDER BY system_type
+    """)
+
+    return [row[0] for row in cursor.fetchall() if row[0]]
+
 @app.get("/api/system-types")
 async def get_system_types():
     """Список типов систем"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT DISTINCT json_extract(detail_json, '$."Вид системы автоматизации"') as system_type
-            FROM sa_data_details
-            WHERE json_extract(detail_json, '$."Вид системы автоматизации"') IS NOT NULL
-            ORDER BY system_type
-        """)
-        
-        types = [row[0] for row in cursor.fetchall() if row[0]]
-        conn.close()
+        types = await run_cached(query_system_types)
         return JSONResponse(content=types)
-        
+
     except Exception as e:
         print(f"Ошибка получения типов систем: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
+
+def query_do_systems(cursor, do_id: int):
+    cursor.execute("""
+        SELECT
+            s.id,
+            s.name,
+            st.name as type
+        FROM sa s
+        LEFT JOIN sa_types st ON s.sa_type = st.id
+        WHERE s.do_id = ?
+        ORDER BY s.name
+    """, (do_id,))
+
+    return [dict(row) for row in cursor.fetchall()]
 
 @app.get("/api/do/{do_id}/systems")
 async def get_do_systems(do_id: int):
     """Системы конкретного ДО"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                s.id,
-                s.name,
-                st.name as type
-            FROM sa s
-            LEFT JOIN sa_types st ON s.sa_type = st.id
-            WHERE s.do_id = ?
-            ORDER BY s.name
-        """, (do_id,))
-        
-        systems = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        systems = await db.run(query_do_systems, do_id)
         return JSONResponse(content=systems)
-        
+
     except Exception as e:
         print(f"Ошибка получения систем ДО: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
+
+def age_group_5y(age):
+    """Возрастная группа с шагом 5 лет (как в SQL CASE)"""
+    if age <= 5:
+        return '0-5 лет'
+    elif age <= 10:
+        return '6-10 лет'
+    elif age <= 15:
+        return '11-15 лет'
+    return '16+ лет'
+
+def query_do_full_details(cursor, do_id: int, reference_year: int, backend: str = ANALYTICS_BACKEND):
+    # Основная информация о ДО
+    cursor.execute("SELECT id, name FROM do WHERE id = ?", (do_id,))
+    do_row = cursor.fetchone()
+
+    if not do_row:
+        raise HTTPException(status_code=404, detail="ДО не найдена")
+
+    do_info = dict(do_row)
+
+    # Системы ДО
+    cursor.execute("""
+        SELECT s.id, s.name, st.name as type
+        FROM sa s
+        LEFT JOIN sa_types st ON s.sa_type = st.id
+        WHERE s.do_id = ?
+    """, (do_id,))
+    systems = [dict(row) for row in cursor.fetchall()]
+
+    if backend == "memory":
+        details = columnar.store.snapshot(cursor).do_details(do_id, reference_year)
+        return {"do_info": do_info, "systems": systems, **details}
+
+    # Один проход по строкам ДО вместо отдельных запросов на KPI, возраст,
+    # проблемные системы и типы - каждый из них заново делал JOIN и скан
+    cursor.execute("""
+        SELECT
+            sdd.id,
+            sdd.object_name,
+            sdd.system_type,
+            sdd.wear,
+            sdd.functionality,
+            sdd.install_year
+        FROM sa_data_details sdd
+        JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        JOIN sa s ON sd.sa_id = s.id
+        WHERE s.do_id = ?
+    """, (do_id,))
+
+    total = 0
+    functionality_sum, functionality_n = 0.0, 0
+    age_sum, age_n = 0, 0
+    problem_count = 0
+    low_functionality_count = 0
+    age_counts = {}
+    type_counts = {}
+    problems = []
+
+    for detail_id, object_name, system_type, wear, functionality, install_year in cursor:
+        total += 1
+        type_counts[system_type] = type_counts.get(system_type, 0) + 1
+
+        if functionality is not None:
+            functionality_sum += functionality
+            functionality_n += 1
+        if install_year is not None:
+            age_sum += reference_year - install_year
+            age_n += 1
+            group = age_group_5y(reference_year - install_year)
+            age_counts[group] = age_counts.get(group, 0) + 1
+
+        high_wear = wear is not None and wear > 70
+        low_functionality = functionality is not None and functionality < 50
+        problem_count += high_wear
+        low_functionality_count += low_functionality
+        if high_wear or low_functionality:
+            problems.append((detail_id, {
+                "object_name": object_name,
+                "system_type": system_type,
+                "wear": wear,
+                "functionality": functionality,
+                "install_year": install_year
+            }))
+
+    kpi = {
+        "total_systems": total,
+        "automation_level": round(functionality_sum / functionality_n, 1) if functionality_n else 0,
+        "avg_age": round(age_sum / age_n, 1) if age_n else 0,
+        "problem_count": problem_count,
+        "low_functionality_count": low_functionality_count
+    }
+
+    # Порядок как у прежнего SQL: группы по алфавиту, проблемные - по износу
+    # (NULL в конце, при равном износе - по id), типы - по убыванию количества
+    age_distribution = [{"age_group": group, "count": count}
+                        for group, count in sorted(age_counts.items())]
+    problems.sort(key=lambda p: (p[1]["wear"] is None, -(p[1]["wear"] or 0), p[0]))
+    system_stats = [{"system_type": system_type, "count": count}
+                    for system_type, count in sorted(type_counts.items(),
+                                                     key=lambda t: (-t[1], t[0] is not None, t[0] or ""))]
+
+    return {
+        "do_info": do_info,
+        "systems": systems,
+        "kpi": kpi,
+        "age_distribution": age_distribution,
+        "problem_systems": [problem for _, problem in problems[:columnar.PROBLEM_SYSTEMS_LIMIT]],
+        "system_stats": system_stats
+    }
 
 @app.get("/api/do/{do_id}/full-details")
-async def get_do_full_details(do_id: int):
+async def get_do_full_details(do_id: int, reference_year: Optional[int] = reference_year_query()):
     """Полные детальные данные по ДО - аналог DODetailsWindow"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Основная информация о ДО
-        cursor.execute("SELECT id, name FROM do WHERE id = ?", (do_id,))
-        do_info = dict(cursor.fetchone())
-        
-        # Системы ДО
-        cursor.execute("""
-            SELECT s.id, s.name, st.name as type 
-            FROM sa s 
-            LEFT JOIN sa_types st ON s.sa_type = st.id 
-            WHERE s.do_id = ?
-        """, (do_id,))
-        systems = [dict(row) for row in cursor.fetchall()]
-        
-        # KPI данные
-        kpi_data = await get_do_kpi_data(do_id, cursor)
-        
-        # Возрастное распределение
-        age_data = await get_do_age_distribution(do_id, cursor)
-        
-        # Проблемные системы
-        problem_systems = await get_do_problem_systems(do_id, cursor)
-        
-        # Статистика по типам систем
-        system_stats = await get_do_system_stats(do_id, cursor)
-        
-        conn.close()
-        
-        return JSONResponse(content={
-            "do_info": do_info,
-            "systems": systems,
-            "kpi": kpi_data,
-            "age_distribution": age_data,
-            "problem_systems": problem_systems,
-            "system_stats": system_stats
-        })
-        
+        details = await run_cached(query_do_full_details, do_id, resolve_reference_year(reference_year))
+        return JSONResponse(content=details)
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Ошибка загрузки детальных данных ДО: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-async def get_do_kpi_data(do_id: int, cursor):
-    """KPI данные для ДО"""
+# === ТЕХНИЧЕСКИЕ ПОКАЗАТЕЛИ ДО ===
+TECH_DATA_MAX_LIMIT = 5000
+
+def query_do_name(cursor, do_id: int):
+    cursor.execute("SELECT name FROM do WHERE id = ?", (do_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def query_do_latest_year(cursor, do_id: int):
+    """Последний год, за который у ДО есть отчеты sa_data"""
     cursor.execute("""
-        SELECT 
-            COUNT(*) as total_systems,
-            AVG(CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL)) as automation_level,
-            AVG(2024 - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)) as avg_age,
-            SUM(CASE WHEN CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) > 70 THEN 1 ELSE 0 END) as problem_count,
-            SUM(CASE WHEN CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL) < 50 THEN 1 ELSE 0 END) as low_functionality_count
-        FROM sa_data_details sdd
-        JOIN sa_data sd ON sdd.sa_data_id = sd.id  
-        JOIN sa s ON sd.sa_id = s.id
+        SELECT MAX(sd.year)
+        FROM sa s
+        JOIN sa_data sd ON sd.sa_id = s.id
         WHERE s.do_id = ?
     """, (do_id,))
-    
-    result = dict(cursor.fetchone() or {})
-    return {
-        "total_systems": result.get('total_systems', 0) or 0,
-        "automation_level": round(result.get('automation_level', 0) or 0, 1),
-        "avg_age": round(result.get('avg_age', 0) or 0, 1),
-        "problem_count": result.get('problem_count', 0) or 0,
-        "low_functionality_count": result.get('low_functionality_count', 0) or 0
-    }
+    return cursor.fetchone()[0]
+
+def execute_do_tech_data(cursor, do_id: int, year: int, fields: List[str], after_id: int, limit: Optional[int]):
+    # Строки отдаются как готовый JSON-текст из БД, без json.loads/dumps в Python.
+    # id записи добавляется в объект - он же курсор для следующей страницы.
+    if fields:
+        pairs = ", ".join("?, json_extract(sdd.detail_json, ?)" for _ in fields)
+        payload = f"json_object('id', sdd.id, {pairs})"
+        params = [value for field in fields for value in (field, f'$."{field}"')]
+    else:
+        payload = "json_set(sdd.detail_json, '$.id', sdd.id)"
+        params = []
 
-async def get_do_age_distribution(do_id: int, cursor):
-    """Возрастное распределение систем ДО"""
-    current_year = datetime.now().year
     cursor.execute(f"""
-        SELECT 
-            CASE
-                WHEN {current_year} - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) <= 5 THEN '0-5 лет'
-                WHEN {current_year} - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) <= 10 THEN '6-10 лет'
-                WHEN {current_year} - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER) <= 15 THEN '11-15 лет'
-                ELSE '16+ лет'
-            END as age_group,
-            COUNT(*) as count
+        SELECT sdd.id, {payload} as detail
         FROM sa_data_details sdd
         JOIN sa_data sd ON sdd.sa_data_id = sd.id
         JOIN sa s ON sd.sa_id = s.id
-        WHERE s.do_id = ? AND json_extract(detail_json, '$."Год внедрения системы автоматизации"') IS NOT NULL
-        GROUP BY age_group
-    """, (do_id,))
-    
-    return [{"age_group": row[0], "count": row[1]} for row in cursor.fetchall()]
+        WHERE s.do_id = ? AND sd.year = ? AND sdd.id > ?
+            AND json_valid(sdd.detail_json)
+        ORDER BY sdd.id
+        {"LIMIT ?" if limit else ""}
+    """, params + [do_id, year, after_id] + ([limit] if limit else []))
 
-async def get_do_problem_systems(do_id: int, cursor):
-    """Проблемные системы ДО"""
-    cursor.execute("""
-        SELECT 
-            json_extract(detail_json, '$."Наименование объекта"') as object_name,
-            json_extract(detail_json, '$."Вид системы автоматизации"') as system_type,
-            CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) as wear,
-            CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL) as functionality,
-            json_extract(detail_json, '$."Год внедрения системы автоматизации"') as install_year
-        FROM sa_data_details sdd
-        JOIN sa_data sd ON sdd.sa_data_id = sd.id
-        JOIN sa s ON sd.sa_id = s.id
-        WHERE s.do_id = ? AND (
-            CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) > 70 OR
-            CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL) < 50
-        )
-        ORDER BY wear DESC
-        LIMIT 20
-    """, (do_id,))
-    
-    return [dict(row) for row in cursor.fetchall()]
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse, который закрывает генератор тела и выдачу db.stream() и при обрыве
+    соединения клиентом: соединение stream_pool возвращается сразу, а не при сборке мусора"""
 
-async def get_do_system_stats(do_id: int, cursor):
-    """Статистика по типам систем ДО"""
-    cursor.execute("""
-        SELECT 
-            json_extract(detail_json, '$."Вид системы автоматизации"') as system_type,
-            COUNT(*) as count
-        FROM sa_data_details sdd
-        JOIN sa_data sd ON sdd.sa_data_id = sd.id
-        JOIN sa s ON sd.sa_id = s.id
-        WHERE s.do_id = ?
-        GROUP BY json_extract(detail_json, '$."Вид системы автоматизации"')
-        ORDER BY count DESC
-    """, (do_id,))
-    
-    return [{"system_type": row[0], "count": row[1]} for row in cursor.fetchall()]
+    def __init__(self, content, rows, **kwargs):
+        super().__init__(content, **kwargs)
+        self.rows = rows
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+                # Выдача начата еще в обработчике (первая пачка) - закрываем ее, даже если
+                # тело так и не начало отдаваться
+                await self.rows.aclose()
+
+async def prefetch_stream(rows):
+    """Первая пачка db.stream() до отправки заголовков: ошибка запроса еще может стать
+    обычным ответом об ошибке, а не оборванным телом с кодом 200"""
+    try:
+        return await anext(rows, [])
+    except BaseException:
+        await rows.aclose()
+        raise
+
+async def stream_tech_data_json(do_name, year, first, rows, limit):
+    """Тело ответа в формате {"do_name", "year", "details": [...], "next_cursor"}"""
+    yield f'{{"do_name": {json.dumps(do_name, ensure_ascii=False)}, "year": {json.dumps(year)}, "details": ['.encode()
+    count, last_id = 0, None
+    try:
+        batch = first
+        while batch:
+            chunk = ",".join(row[1] for row in batch)
+            yield (("," if count else "") + chunk).encode()
+            count += len(batch)
+            last_id = batch[-1][0]
+            batch = await anext(rows, None)
+    except Exception as e:
+        # Код 200 уже отправлен: исключение обрывает соединение, и клиент не примет
+        # неполный JSON за целый ответ
+        print(f"Ошибка потоковой выдачи технических данных: {e}")
+        raise
+    finally:
+        await rows.aclose()
+    next_cursor = last_id if limit and count == limit else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'.encode()
+
+async def stream_tech_data_ndjson(first, rows):
+    """Одна запись detail_json на строку; курсор следующей страницы - id последней строки"""
+    try:
+        batch = first
+        while batch:
+            yield ("\n".join(row[1] for row in batch) + "\n").encode()
+            batch = await anext(rows, None)
+    except Exception as e:
+        print(f"Ошибка потоковой выдачи технических данных: {e}")
+        raise
+    finally:
+        await rows.aclose()
 
 # === ТЕХНИЧЕСКИЕ ПОКАЗАТЕЛИ ДО ===
 @app.get("/api/do/{do_id}/tech-data")
-async def get_do_tech_data(do_id: int, year: int = 2023):
-    """Технические показатели ДО за конкретный год"""
+async def get_do_tech_data(do_id: int, year: Optional[int] = None,
+                           format: str = Query("json", pattern="^(json|ndjson)$"),
+                           fields: Optional[List[str]] = Query(None),
+                           limit: Optional[int] = Query(None, ge=1, le=TECH_DATA_MAX_LIMIT),
+                           cursor: int = 0):
+    """Технические показатели ДО за конкретный год (по умолчанию - последний год отчетов ДО).
+
+    format=ndjson - поток по одной записи на строку; fields (можно повторять) -
+    ключи detail_json, которые нужно вернуть; limit/cursor - страницы по id записи.
+    """
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Получаем имя ДО
-        cursor.execute("SELECT name FROM do WHERE id = ?", (do_id,))
-        do_name = cursor.fetchone()[0]
-        
-        # Получаем технические данные
-        cursor.execute("""
-            SELECT sdd.detail_json
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id
-            JOIN sa s ON sd.sa_id = s.id
-            JOIN do d ON s.do_id = d.id
-            WHERE d.id = ? AND sd.year = ?
-        """, (do_id, year))
-        
-        details = []
-        for row in cursor.fetchall():
-            try:
-                detail_data = json.loads(row[0])
-                details.append(detail_data)
-            except json.JSONDecodeError:
-                continue
-        
-        conn.close()
-        return JSONResponse(content={
-            "do_name": do_name,
-            "year": year,
-            "details": details
-        })
-        
+        do_name = await db.run(query_do_name, do_id)
+        if do_name is None:
+            return JSONResponse(content={"do_name": "", "year": year, "details": []})
+        if year is None:
+            year = await db.run(query_do_latest_year, do_id)
+
+        rows = db.stream(execute_do_tech_data, do_id, year, fields or [], cursor, limit)
+        first = await prefetch_stream(rows)
+
+        if format == "ndjson":
+            return ClosingStreamingResponse(stream_tech_data_ndjson(first, rows), rows,
+                                            media_type="application/x-ndjson")
+        return ClosingStreamingResponse(stream_tech_data_json(do_name, year, first, rows, limit), rows,
+                                        media_type="application/json")
+
     except Exception as e:
         print(f"Ошибка загрузки технических данных: {e}")
-        return JSONResponse(content={"do_name": "", "year": year, "details": []})
+        return fallback_response({"do_name": "", "year": year, "details": []})
 
 # === РАСШИРЕННАЯ АНАЛИТИКА ===
 @app.get("/api/analytics/pererabotka/tech-objects")
 async def get_pererabotka_tech_objects():
     """Технологические объекты переработки"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # ID ДО переработки
-        do_pererabotka_ids = [11]  # ООО «Газпром переработка»
-        placeholders = ','.join('?' * len(do_pererabotka_ids))
-        
-        cursor.execute(f"""
-            SELECT 
-                d.name as do_name,
-                COUNT(*) as object_count,
-                SUM(CASE WHEN json_extract(sdd.detail_json, '$."Вид системы автоматизации"') LIKE '%установк%переработк%' THEN 1 ELSE 0 END) as processing_units,
-                SUM(CASE WHEN json_extract(sdd.detail_json, '$."Вид системы автоматизации"') LIKE '%ГПЗ%' THEN 1 ELSE 0 END) as gpz_count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id
-            JOIN sa s ON sd.sa_id = s.id
-            JOIN do d ON s.do_id = d.id
-            WHERE s.do_id IN ({placeholders})
-            GROUP BY d.name
-        """, do_pererabotka_ids)
-        
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        result = await load_sector_tech_objects("pererabotka")
         return JSONResponse(content=result)
-        
+
     except Exception as e:
         print(f"Ошибка аналитики переработки: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
 
 @app.get("/api/analytics/phg/tech-objects")
 async def get_phg_tech_objects():
     """Технологические объекты ПХГ"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # ID ДО ПХГ
-        do_phg_ids = [12]  # ООО «Газпром ПХГ»
-        placeholders = ','.join('?' * len(do_phg_ids))
-        
-        cursor.execute(f"""
-            SELECT 
-                d.name as do_name,
-                COUNT(*) as object_count,
-                SUM(CASE WHEN json_extract(sdd.detail_json, '$."Вид системы автоматизации"') LIKE '%ПХГ%' THEN 1 ELSE 0 END) as phg_objects,
-                SUM(CASE WHEN json_extract(sdd.detail_json, '$."Вид системы автоматизации"') LIKE '%КС ПХГ%' THEN 1 ELSE 0 END) as ks_phg_count
-            FROM sa_data_details sdd
-            JOIN sa_data sd ON sdd.sa_data_id = sd.id
-            JOIN sa s ON sd.sa_id = s.id
-            JOIN do d ON s.do_id = d.id
-            WHERE s.do_id IN ({placeholders})
-            GROUP BY d.name
-        """, do_phg_ids)
-        
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        result = await load_sector_tech_objects("phg")
         return JSONResponse(content=result)
-        
+
     except Exception as e:
         print(f"Ошибка аналитики ПХГ: {e}")
-        return JSONResponse(content=[])
+        return fallback_response([])
 
 # === ДАННЫЕ ДЛЯ СЛОЖНЫХ ГРАФИКОВ ТРАНСПОРТА ===
 @app.get("/api/analytics/transport/pipeline-coverage-detailed")
 async def get_transport_pipeline_coverage_detailed():
     """Детальные данные покрытия трубопроводов для сложных графиков"""
     try:
-        conn = sqlite3.connect("do_system.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Данные для МГ и ГО
         #mg_data = await get_transport_pipeline_coverage('mg')
         #go_data = await get_transport_pipeline_coverage('go')
-        
-        conn.close()
+
         return JSONResponse(content={
            # "mg": mg_data,
            # "go": go_data
         })
-        
+
     except Exception as e:
         print(f"Ошибка детальных данных транспорта: {e}")
-        return JSONResponse(content={"mg": [], "go": []})
+        return fallback_response({"mg": [], "go": []})
+
+
+# === КАЛЬКУЛЯТОР СТАНДАРТОВ ===
+def query_calculator_inputs(cursor, do_id: Optional[int]):
+    filled = " + ".join(f"(sdd.{column} IS NOT NULL)" for column in DETAIL_FIELDS)
+    cursor.execute(f"""
+        SELECT
+            sdd.id,
+            s.do_id,
+            sdd.install_year,
+            sdd.wear,
+            sdd.functionality,
+            sdd.import_status,
+            {filled} as filled_fields,
+            {len(DETAIL_FIELDS)} as total_fields
+        FROM sa_data_details sdd
+        JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        JOIN sa s ON sd.sa_id = s.id
+        {"WHERE s.do_id = ?" if do_id is not None else ""}
+        ORDER BY sdd.id
+    """, (do_id,) if do_id is not None else ())
+
+    return [tuple(row) for row in cursor.fetchall()]
+
+@app.post("/api/calculator/batch")
+async def calculator_batch(request: CalculatorBatchRequest):
+    """Модель калькулятора стандартов для множества систем сразу (NumPy)"""
+    if calculator.np is None:
+        raise HTTPException(status_code=503, detail="Для пакетного расчета нужен NumPy")
+
+    try:
+        if request.systems is not None:
+            ids, scores, criticality, horizon = calculator.explicit_inputs(request)
+            extra = None
+        else:
+            # Оценки выводятся из карточек систем всех ДО (или одного do_id)
+            rows = await db.run(query_calculator_inputs, request.do_id)
+            ids, scores, criticality, horizon, extra = calculator.derived_inputs(
+                rows, request, resolve_reference_year(request.reference_year))
+
+        # Сборка ответа на десятки тысяч систем - вне event loop
+        result = await asyncio.to_thread(
+            calculator.batch_result, ids, scores, criticality, horizon,
+            request.curve_years, request.include_systems, extra
+        )
+        return JSONResponse(content=result)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Ошибка пакетного расчета калькулятора: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+# === ДАШБОРД ===
+async def load_import_systems_first_page():
+    (items, next_cursor), total = await asyncio.gather(
+        db.run(query_import_substitution_systems, (), None, IMPORT_SYSTEMS_PAGE_SIZE),
+        run_cached(query_import_substitution_count, ())
+    )
+    return {"items": items, "total": total, "next_cursor": next_cursor}
+
+async def load_transport_tech_objects():
+    return transport_tech_objects_or_sample(transport_tech_objects(await run_cached(query_sector_analytics)))
+
+# Разделы начального состояния index.html: имя -> корутина (reference_year), которая его считает.
+# Каждый раздел выполняется на своем соединении пула, все разделы - одновременно.
+DASHBOARD_SECTIONS = {
+    "do_list": lambda reference_year: db.run(query_do_list, True, reference_year),
+    "dobycha_tech_objects": lambda reference_year: load_sector_tech_objects("dobycha"),
+    "transport_tech_objects": lambda reference_year: load_transport_tech_objects(),
+    "age_stats": lambda reference_year: run_cached(query_age_stats, reference_year),
+    "transport_coverage": lambda reference_year: load_transport_coverage_detailed(),
+    "import_stats": lambda reference_year: run_cached(query_import_substitution_stats),
+    "import_systems": lambda reference_year: load_import_systems_first_page(),
+}
+
+@app.get("/api/dashboard")
+async def get_dashboard(sections: Optional[str] = None, reference_year: Optional[int] = reference_year_query()):
+    """Начальное состояние дашборда одним ответом.
+
+    sections - разделы через запятую (по умолчанию все). Раздел, который не удалось
+    посчитать, возвращается как null, а текст ошибки - в errors.
+    """
+    names = [name.strip() for name in sections.split(",") if name.strip()] if sections else list(DASHBOARD_SECTIONS)
+    unknown = [name for name in names if name not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные разделы: {', '.join(unknown)}; "
+                                                    f"допустимо: {', '.join(DASHBOARD_SECTIONS)}")
+    names = list(dict.fromkeys(names))
+    reference_year = resolve_reference_year(reference_year)
+
+    results = await asyncio.gather(*(DASHBOARD_SECTIONS[name](reference_year) for name in names),
+                                   return_exceptions=True)
+    data, errors = {}, {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка раздела дашборда {name}: {result}")
+            data[name] = None
+            errors[name] = str(result)
+        else:
+            data[name] = result
+
+    # Разделы с ошибкой не должны закрепиться у клиента через ETag/304
+    return JSONResponse(content={
+        "reference_year": reference_year,
+        "sections": data,
+        "errors": errors
+    }, headers=NO_STORE_HEADERS if errors else None)
+
+# === ЗАГРУЗКА ДАННЫХ ===
+# Основной путь загрузки - python ingest.py. Через API загрузка возможна, только если задан
+# токен DO_INGEST_TOKEN: запрос передает его в заголовке X-Ingest-Token. Нестандартный заголовок
+# и Content-Type вне "простых" (text/plain, формы) не дают чужой странице отправить запрос
+# без preflight CORS.
+INGEST_TOKEN = os.environ.get("DO_INGEST_TOKEN", "")
+INGEST_TOKEN_HEADER = "x-ingest-token"
+# Тело больше этого размера при приеме сбрасывается из памяти во временный файл
+INGEST_SPOOL_SIZE = 16 * 1024 * 1024
+
+INGEST_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+# Принимаются только эти Content-Type; octet-stream - с format или filename
+INGEST_ALLOWED_CONTENT_TYPES = set(INGEST_CONTENT_TYPES) | {"application/octet-stream"}
+
+logger = logging.getLogger(__name__)
+
+def check_ingest_access(request: Request) -> str:
+    """Проверка токена и Content-Type запроса загрузки; возвращает Content-Type без параметров"""
+    if not INGEST_TOKEN:
+        raise HTTPException(status_code=403, detail="Загрузка через API отключена: задайте DO_INGEST_TOKEN "
+                                                    "или используйте python ingest.py")
+    token = request.headers.get(INGEST_TOKEN_HEADER, "")
+    if not hmac.compare_digest(token.encode(), INGEST_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Неверный или отсутствующий X-Ingest-Token")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in INGEST_ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Content-Type должен быть одним из: "
+                                                    + ", ".join(sorted(INGEST_ALLOWED_CONTENT_TYPES)))
+    return content_type
+
+def ingest_upload(conn, upload, name: str, fmt: str, year: Optional[int], replace: bool):
+    upload.seek(0)
+    return ingest(conn, [(name, upload, fmt)], year=year, replace=replace)
+
+@app.post("/api/ingest")
+async def ingest_report(
+    request: Request,
+    format: Optional[str] = None,
+    filename: Optional[str] = None,
+    year: Optional[int] = None,
+    replace: bool = False
+):
+    """Загрузка выгрузки отчетов ДО: тело запроса - файл CSV, JSONL или Excel.
+
+    Требует заголовок X-Ingest-Token (DO_INGEST_TOKEN). Пишет пачками в отдельном потоке записи;
+    читающие запросы (WAL) не блокируются.
+    """
+    content_type = check_ingest_access(request)
+    try:
+        if format:
+            fmt = format
+        elif filename:
+            fmt = detect_format(filename)
+        elif content_type in INGEST_CONTENT_TYPES:
+            fmt = INGEST_CONTENT_TYPES[content_type]
+        else:
+            raise IngestError("Формат не указан: передайте format, filename или Content-Type")
+
+        with tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_SIZE) as upload:
+            async for chunk in request.stream():
+                upload.write(chunk)
+            report = await db.write(ingest_upload, upload, filename or "upload", fmt, year, replace)
+
+        # Кэш сбросился бы и по data_version, но ответы после загрузки должны быть свежими сразу;
+        # новый отпечаток БД отсекает и записи общего кэша воркеров.
+        # year_cache не трогаем - измененные годы получили новую версию в year_versions
+        db.data_version.check(force=True)
+        response_cache.clear()
+        return JSONResponse(content=report)
+
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Ошибка загрузки данных")
+        raise HTTPException(status_code=500, detail="Ошибка загрузки данных")
 
 
 # === ЗДОРОВЬЕ СИСТЕМЫ ===
@@ -1094,9 +1775,88 @@ async def health_check():
         "status": "healthy",
         "service": "СА ДО API v4.0",
         "timestamp": datetime.now().isoformat(),
-        "version": "4.0"
+        "version": "4.0",
+        "uptime_seconds": round(time.time() - started_at, 1),
+        "requests_total": registry.total_requests(),
+        "slow_queries": len(slow_queries)
     })
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    cache = response_cache.stats()
+    shared = shared_cache.stats()
+    text = registry.prometheus(extra={
+        "uptime_seconds": ("Время работы процесса", round(time.time() - started_at, 1)),
+        "response_cache_hits": ("Попадания в кэш ответов", cache["hits"]),
+        "response_cache_misses": ("Промахи кэша ответов", cache["misses"]),
+        "response_cache_entries": ("Записей в кэше ответов", cache["entries"]),
+        "shared_cache_hits": ("Попадания в общий кэш воркеров", shared["hits"]),
+        "shared_cache_misses": ("Промахи общего кэша воркеров", shared["misses"]),
+        "shared_cache_waits": ("Ожидания расчета другим воркером", shared["waits"]),
+        "slow_queries": ("Записей в журнале медленных запросов", len(slow_queries)),
+    })
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/debug/slow-queries")
+async def get_slow_queries():
+    """Самые медленные SQL-запросы с планом выполнения"""
+    return JSONResponse(content={
+        "threshold_ms": slow_queries.threshold * 1000,
+        "queries": slow_queries.entries()
+    })
+
+def backend_checks(do_id: int, reference_year: int):
+    """Запросы, которые умеют оба бэкенда: имя -> (функция, аргументы без backend)"""
+    return {
+        "do_list": (query_do_list, (True, reference_year)),
+        "do_summary": (query_do_summary, (do_id, reference_year)),
+        "age_stats": (query_age_stats, (reference_year,)),
+        "do_full_details": (query_do_full_details, (do_id, reference_year)),
+    }
+
+@app.get("/api/debug/backend-check")
+async def check_backends(do_id: int = 1, reference_year: Optional[int] = reference_year_query()):
+    """Сверка бэкендов sql и memory: одни и те же запросы, результаты и время каждого"""
+    if not columnar.available():
+        raise HTTPException(status_code=503, detail="NumPy не установлен - бэкенд memory недоступен")
+    reference_year = resolve_reference_year(reference_year)
+
+    try:
+        # Загрузка снимка не входит во время запросов memory
+        await db.run(columnar.store.snapshot)
+        checks = {}
+        for name, (fn, args) in backend_checks(do_id, reference_year).items():
+            results, check = {}, {}
+            for backend in BACKENDS:
+                started = time.perf_counter()
+                results[backend] = await db.run(fn, *args, backend)
+                check[f"{backend}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            check["match"] = results["sql"] == results["memory"]
+            if not check["match"]:
+                check.update(results)
+            checks[name] = check
+
+        return JSONResponse(content={
+            "backend": ANALYTICS_BACKEND,
+            "do_id": do_id,
+            "reference_year": reference_year,
+            "match": all(check["match"] for check in checks.values()),
+            "checks": checks
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Ошибка сверки бэкендов: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Счетчики кэша аналитических запросов"""
+    return JSONResponse(content={**response_cache.stats(), "year_cache": year_cache.stats(),
+                                 "shared_cache": shared_cache.stats(), "columnar": columnar.store.stats()})
+
 @app.get("/")
 async def root():
     return {"message": "🚀 СА ДО API работает!", "version": "4.0"}
@@ -1106,9 +1866,16 @@ if __name__ == "__main__":
     print("🚀 ЗАПУСК СА ДО API v4.0 - ПОЛНАЯ ВЕРСИЯ")
     print("=" * 60)
     print("📡 Адрес: http://localhost:8000")
-    print("📚 Документация: http://localhost:8000/api/docs") 
+    print("📚 Документация: http://localhost:8000/api/docs")
     print("❤️  Проверка: http://localhost:8000/api/health")
+    workers = int(os.environ.get("DO_WORKERS", "1"))
+    if workers > 1:
+        print(f"👥 Воркеров: {workers} (общий кэш: {shared_cache.path or 'отключен'})")
     print("=" * 60)
-    
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+
+    if workers > 1:
+        # Несколько процессов запускаются по строке импорта; результаты они делят через shared_cache
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, log_level="info", workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
 
@@ -0,0 +1,311 @@
+# metrics.py - метрики запросов API и журнал медленных SQL-запросов
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
+from fastapi.responses import JSONResponse as _JSONResponse
+from starlette.routing import Match
+
+# Границы корзин гистограммы задержек (сек)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Запросы дольше порога попадают в журнал вместе с EXPLAIN QUERY PLAN
+SLOW_QUERY_SECONDS = 0.05
+SLOW_QUERY_LOG_SIZE = 50
+
+METRIC_PREFIX = "sado"
+
+# Счетчики текущего HTTP-запроса; db.run переносит контекст в поток пула
+current_request = contextvars.ContextVar("current_request", default=None)
+
+started_at = time.time()
+
+
+class RequestStats:
+    """SQL-счетчики одного запроса; пополняются из потоков пула"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.statements = 0
+        self.rows = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_sql(self, statements: int, rows: int, seconds: float):
+        with self._lock:
+            self.statements += statements
+            self.rows += rows
+            self.sql_seconds += seconds
+
+
+class _EndpointMetrics:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.statuses = {}
+        self.statements = 0
+        self.rows = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+class MetricsRegistry:
+    """Накопленные метрики по шаблонам маршрутов"""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stats: RequestStats, status: int, seconds: float):
+        with self._lock:
+            metrics = self._endpoints.get(stats.endpoint)
+            if metrics is None:
+                metrics = self._endpoints[stats.endpoint] = _EndpointMetrics()
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    metrics.buckets[i] += 1
+            metrics.count += 1
+            metrics.seconds += seconds
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.statements += stats.statements
+            metrics.rows += stats.rows
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.serialization_seconds += stats.serialization_seconds
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(metrics.count for metrics in self._endpoints.values())
+
+    def prometheus(self, extra=None) -> str:
+        """Текст в формате Prometheus exposition"""
+        p = METRIC_PREFIX
+        lines = [
+            f"# HELP {p}_request_duration_seconds Время обработки запроса",
+            f"# TYPE {p}_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            for endpoint, m in endpoints:
+                label = _label(endpoint)
+                for bound, count in zip(LATENCY_BUCKETS, m.buckets):
+                    lines.append(f'{p}_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {count}')
+                lines.append(f'{p}_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {m.count}')
+                lines.append(f'{p}_request_duration_seconds_sum{{endpoint="{label}"}} {m.seconds:.6f}')
+                lines.append(f'{p}_request_duration_seconds_count{{endpoint="{label}"}} {m.count}')
+
+            counters = [
+                ("requests_total", "Число запросов по коду ответа", None),
+                ("sql_statements_total", "Выполнено SQL-операторов", "statements"),
+                ("sql_rows_total", "Прочитано строк из SQLite", "rows"),
+                ("sql_seconds_total", "Время в SQLite (execute + fetch)", "sql_seconds"),
+                ("serialization_seconds_total", "Время сериализации JSON", "serialization_seconds"),
+            ]
+            for name, help_text, attr in counters:
+                lines.append(f"# HELP {p}_{name} {help_text}")
+                lines.append(f"# TYPE {p}_{name} counter")
+                for endpoint, m in endpoints:
+                    label = _label(endpoint)
+                    if attr is None:
+                        for status, count in sorted(m.statuses.items()):
+                            lines.append(f'{p}_{name}{{endpoint="{label}",status="{status}"}} {count}')
+                    else:
+                        value = getattr(m, attr)
+                        value = f"{value:.6f}" if isinstance(value, float) else value
+                        lines.append(f'{p}_{name}{{endpoint="{label}"}} {value}')
+
+        for name, (help_text, value) in (extra or {}).items():
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+registry = MetricsRegistry()
+
+
+class SlowQueryLog:
+    """Самые медленные SQL-запросы (не больше size): min-куча по duration_ms.
+
+    Новая запись вытесняет самую быструю из хранимых, поэтому всплеск умеренно медленных
+    запросов не выталкивает настоящие выбросы.
+    """
+
+    def __init__(self, size: int = SLOW_QUERY_LOG_SIZE, threshold: float = SLOW_QUERY_SECONDS):
+        self.size = size
+        self.threshold = threshold
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def admits(self, duration_ms: float) -> bool:
+        """Попадет ли запрос такой длительности в журнал (EXPLAIN для остальных не нужен)"""
+        with self._lock:
+            return len(self._heap) < self.size or duration_ms > self._heap[0][0]
+
+    def add(self, entry: dict):
+        item = (entry["duration_ms"], next(self._seq), entry)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def entries(self):
+        """Записи от самых медленных к быстрым"""
+        with self._lock:
+            items = list(self._heap)
+        return [entry for _, _, entry in sorted(items, key=lambda item: (-item[0], item[1]))]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+slow_queries = SlowQueryLog()
+
+
+class TracedCursor:
+    """Обертка над sqlite3.Cursor: время, число операторов и строк по каждому запросу"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._sql = None
+        self._params = None
+        self._seconds = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        """Завершает учет предыдущего оператора (execute + все его fetch)"""
+        if self._sql is None:
+            return
+        stats = current_request.get()
+        if stats is not None:
+            stats.add_sql(1, self._rows, self._seconds)
+        if self._seconds >= slow_queries.threshold and slow_queries.admits(round(self._seconds * 1000, 3)):
+            slow_queries.add({
+                "endpoint": stats.endpoint if stats is not None else None,
+                "sql": " ".join(self._sql.split()),
+                "params": [p if isinstance(p, (int, float, str)) or p is None else repr(p)
+                           for p in (self._params or [])],
+                "duration_ms": round(self._seconds * 1000, 3),
+                "rows": self._rows,
+                "plan": self._explain(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+            })
+        self._sql = None
+
+    def _explain(self):
+        try:
+            plan = self._cursor.connection.execute("EXPLAIN QUERY PLAN " + self._sql, self._params or ())
+            return [row[3] for row in plan.fetchall()]
+        except Exception as e:
+            return [f"недоступен: {e}"]
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._seconds += time.perf_counter() - started
+
+    def execute(self, sql, params=()):
+        self._finish()
+        self._sql, self._params, self._seconds, self._rows = sql, params, 0.0, 0
+        self._timed(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._finish()
+        self._sql, self._params, self._seconds, self._rows = sql, None, 0.0, 0
+        self._timed(self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class JSONResponse(_JSONResponse):
+    """JSONResponse, который учитывает время сериализации в метриках запроса"""
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            stats = current_request.get()
+            if stats is not None:
+                stats.serialization_seconds += time.perf_counter() - started
+
+
+def _route_template(scope) -> str:
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "<unmatched>"
+
+
+class MetricsMiddleware:
+    """ASGI middleware: задержка, SQL и сериализация по шаблону маршрута /api/*"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(_route_template(scope))
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Для потоковых ответов сюда попадаем после отправки последней пачки
+            registry.observe(stats, status, time.perf_counter() - started)
+            current_request.reset(token)
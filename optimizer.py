@@ -0,0 +1,195 @@
+# optimizer.py - индексы под запросы API, ANALYZE и отчет по планам выполнения
+#
+#   python optimizer.py check   - только показать планы запросов
+#   python optimizer.py apply   - создать индексы, обновить статистику и показать, что изменилось
+import argparse
+import json
+import sqlite3
+
+from schema import DB_PATH
+
+# Индексы под соединения sa -> sa_data -> sa_data_details и выборки по ДО/году.
+# Индекс sa_data_details покрывающий: агрегаты по ДО и фильтры по категории вида системы
+# читают только его, не трогая detail_json.
+OPTIMIZER_INDEXES = {
+    "idx_sdd_sa_data_covering":
+        "sa_data_details(sa_data_id, system_type, install_year, functionality, wear, object_name, system_category)",
+    "idx_sa_data_sa_year": "sa_data(sa_id, year)",
+    "idx_sa_do_id": "sa(do_id, sa_type, name)",
+    "idx_automation_summary_do_year_indicator": "automation_summary(do_id, year, indicator_id, value)",
+}
+
+# Индексы, которые перекрыты более широкими из OPTIMIZER_INDEXES
+SUPERSEDED_INDEXES = ["idx_automation_summary_do_year", "idx_sdd_sa_data_cover"]
+
+_DETAILS_JOIN = """
+    FROM sa_data_details sdd
+    JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    JOIN sa s ON sd.sa_id = s.id"""
+
+# Запросы, по форме совпадающие с запросами main.py: (SQL, параметры)
+PLAN_QUERIES = {
+    "do_summary": ("""
+        SELECT dimension, bucket, count, sum
+        FROM detail_rollup
+        WHERE do_id = ? AND dimension IN ('total', 'functionality', 'install_year', 'wear', 'system_type')""", (1,)),
+    "do_full_details": (f"""
+        SELECT sdd.object_name, sdd.system_type, sdd.wear, sdd.functionality, sdd.install_year
+        {_DETAILS_JOIN}
+        WHERE s.do_id = ?""", (1,)),
+    "do_trend": ("""
+        SELECT sd.year, COUNT(*), AVG(sdd.functionality), AVG(sdd.install_year),
+               SUM(CASE WHEN sdd.wear > 70 THEN 1 ELSE 0 END), COUNT(DISTINCT sdd.system_type)
+        FROM sa s
+        JOIN sa_data sd ON sd.sa_id = s.id
+        JOIN sa_data_details sdd ON sdd.sa_data_id = sd.id
+        WHERE s.do_id = ? AND sd.year IN (2022, 2023)
+        GROUP BY sd.year""", (1,)),
+    "do_systems": ("""
+        SELECT s.id, s.name, st.name
+        FROM sa s
+        LEFT JOIN sa_types st ON s.sa_type = st.id
+        WHERE s.do_id = ?
+        ORDER BY s.name""", (1,)),
+    "do_tech_data": (f"""
+        SELECT sdd.id, sdd.detail_json
+        {_DETAILS_JOIN}
+        WHERE s.do_id = ? AND sd.year = ? AND sdd.id > ?
+        ORDER BY sdd.id
+        LIMIT 500""", (1, 2023, 0)),
+    "sector_analytics": ("""
+        SELECT ds.sector, d.name, SUM(r.count)
+        FROM do_sector ds
+        JOIN do d ON d.id = ds.do_id
+        JOIN detail_rollup r ON r.do_id = ds.do_id AND r.dimension IN ('total', 'system_category')
+        GROUP BY ds.sector, d.name""", ()),
+    "import_systems_by_status": (f"""
+        SELECT sdd.id, d.name, s.name
+        {_DETAILS_JOIN}
+        JOIN do d ON s.do_id = d.id
+        WHERE sdd.import_status = ?
+            AND (COALESCE(d.name, ''), COALESCE(s.name, ''), sdd.id) > (?, ?, ?)
+        ORDER BY COALESCE(d.name, ''), COALESCE(s.name, ''), sdd.id
+        LIMIT 100""", ("Замещено", "", "", 0)),
+    "automation_pivot_refresh": ("""
+        SELECT do_id, year, MAX(CASE WHEN indicator_id = '54' THEN CAST(value AS REAL) END)
+        FROM automation_summary
+        WHERE do_id = ? AND year = ?
+        GROUP BY do_id, year""", (1, 2023)),
+    "automation_latest_year": ("""
+        SELECT MAX(year) FROM automation_pivot
+        WHERE do_id IN (13, 14, 15, 16, 17, 18, 19, 20)""", ()),
+}
+
+
+def explain(conn: sqlite3.Connection, sql: str, params=()):
+    """Строки EXPLAIN QUERY PLAN; None, если запрос не строится (нет таблицы)"""
+    try:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+    except sqlite3.Error:
+        return None
+
+
+def _scans(plan):
+    """Таблицы, которые читаются полным сканом (без индекса)"""
+    scans = set()
+    for step in plan or ():
+        parts = step.split()
+        if len(parts) >= 2 and parts[0] == "SCAN" and "USING" not in parts:
+            scans.add(parts[1])
+    return scans
+
+
+def query_plans(conn: sqlite3.Connection):
+    return {name: explain(conn, sql, params) for name, (sql, params) in PLAN_QUERIES.items()}
+
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def optimize(conn: sqlite3.Connection):
+    """Создает недостающие индексы, обновляет статистику и сравнивает планы до/после"""
+    before = query_plans(conn)
+
+    created = []
+    for name, target in OPTIMIZER_INDEXES.items():
+        table = target.split("(")[0]
+        if not _table_exists(conn, table):
+            continue
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone():
+            continue
+        conn.execute(f"CREATE INDEX {name} ON {target}")
+        created.append(name)
+    for name in SUPERSEDED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+    # Полный ANALYZE - только после новых индексов или если статистики еще нет;
+    # иначе PRAGMA optimize сам решит, какие таблицы переанализировать
+    analyzed = bool(created) or not _table_exists(conn, "sqlite_stat1")
+    if analyzed:
+        conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+
+    after = query_plans(conn)
+    changes = {}
+    for name in PLAN_QUERIES:
+        fixed = sorted(_scans(before[name]) - _scans(after[name]))
+        if fixed:
+            changes[name] = fixed
+
+    return {
+        "created_indexes": created,
+        "analyzed": analyzed,
+        "scan_to_search": changes,
+        "remaining_scans": {name: sorted(_scans(plan)) for name, plan in after.items() if _scans(plan)},
+        "plans": after,
+    }
+
+
+def print_report(report, verbose: bool = False):
+    if report["created_indexes"]:
+        print(f"✅ Созданы индексы: {', '.join(report['created_indexes'])}")
+    for name, tables in report["scan_to_search"].items():
+        print(f"✅ {name}: SCAN -> SEARCH для {', '.join(tables)}")
+    if verbose:
+        for name, tables in report["remaining_scans"].items():
+            print(f"ℹ️ {name}: полный скан {', '.join(tables)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индексы и планы запросов СА ДО API")
+    parser.add_argument("command", choices=["check", "apply"])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == "apply":
+            report = optimize(conn)
+        else:
+            plans = query_plans(conn)
+            report = {
+                "remaining_scans": {name: sorted(_scans(plan)) for name, plan in plans.items() if _scans(plan)},
+                "plans": plans,
+            }
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    if args.command == "apply":
+        print_report(report, verbose=True)
+    else:
+        for name, plan in report["plans"].items():
+            print(f"{name}:")
+            for step in plan or ["(запрос не строится - нет таблиц)"]:
+                print(f"    {step}")
+
+
+if __name__ == "__main__":
+    main()
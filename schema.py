@@ -0,0 +1,954 @@
+# schema.py - материализованные поля detail_json и производные таблицы
+import os
+import re
+import sqlite3
+
+# Путь к БД можно переопределить переменной окружения (тесты, стенды)
+DB_PATH = os.environ.get("DO_SYSTEM_DB", "do_system.db")
+# Опорный год для возраста систем, если запрос его не задает: 2024, как в исходных KPI
+# среднего возраста (DO_REFERENCE_YEAR - другой год)
+DEFAULT_REFERENCE_YEAR = int(os.environ.get("DO_REFERENCE_YEAR", "2024"))
+
+# Колонка -> (ключ в detail_json, тип). Значения вычисляются один раз при записи,
+# а не через json_extract + CAST в каждом запросе API.
+DETAIL_FIELDS = {
+    "system_type": ("Вид системы автоматизации", "TEXT"),
+    "install_year": ("Год внедрения системы автоматизации", "INTEGER"),
+    "functionality": ("Функциональность, %", "REAL"),
+    "wear": ("Эксплуатационный износ", "REAL"),
+    "do_name": ("Наименование ДО", "TEXT"),
+    "object_name": ("Наименование объекта", "TEXT"),
+    "plc_type": ("Тип ПЛК", "TEXT"),
+    "scada_type": ("Тип SCADA", "TEXT"),
+}
+
+# Индексы под фильтры API (кроме индексов материализованных колонок)
+API_INDEXES = {
+    "idx_sdd_import_status": "sa_data_details(import_status)",
+    "idx_sdd_test_stage": "sa_data_details(test_stage)",
+}
+
+# Показатели automation_summary, которые API читает из широкой таблицы automation_pivot.
+# Остальные indicator_id получают колонку REAL при миграции.
+AUTOMATION_INDICATORS = {
+    "4": "INTEGER",     # ЦДП
+    "7": "INTEGER",     # ДП
+    "33": "INTEGER",    # КС
+    "34": "INTEGER",    # КЦ
+    "54": "REAL",       # протяженность МГ
+    "56": "REAL",       # МГ, охваченные СЛТМ
+    "63": "REAL",       # протяженность ГО
+    "65": "REAL",       # ГО, охваченные СЛТМ
+    "85": "INTEGER",    # ГПА
+    "94": "INTEGER",    # ГРС
+    "95": "INTEGER",    # ГРС, охваченные СЛТМ
+}
+
+# Измерения detail_rollup: (bucket, sum, условие) как SQL-выражения над строкой {r}.
+# Строки без ДО (нет sa_data/sa) учитываются под do_id = 0 - они входят только в общие итоги.
+ROLLUP_DIMENSIONS = {
+    "total": ("''", "0", "1"),
+    "functionality": ("''", "{r}.functionality", "{r}.functionality IS NOT NULL"),
+    "install_year": ("CAST({r}.install_year AS TEXT)", "{r}.install_year", "{r}.install_year IS NOT NULL"),
+    # Корзины износа (10(k-1), 10k]: износ > 70 - это корзины от 8 и выше
+    "wear": ("CAST(CAST({r}.wear / 10 AS INTEGER) + ({r}.wear / 10 > CAST({r}.wear / 10 AS INTEGER)) AS TEXT)",
+             "{r}.wear", "{r}.wear IS NOT NULL"),
+    "system_type": ("{r}.system_type", "0", "{r}.system_type IS NOT NULL"),
+    # Пустой bucket - статус не указан (NULL); указанный статус - с префиксом ':', чтобы
+    # пустая строка в import_status не смешивалась с NULL
+    "import_status": ("CASE WHEN {r}.import_status IS NULL THEN '' ELSE ':' || {r}.import_status END", "0", "1"),
+    # Битовая маска категорий вида системы (system_category)
+    "system_category": ("CAST({r}.system_category AS TEXT)", "0", "{r}.system_category IS NOT NULL"),
+}
+ROLLUP_SOURCE_COLUMNS = ("sa_data_id", "functionality", "install_year", "wear", "system_type", "import_status",
+                         "system_category")
+
+# Категории видов систем: имя -> (код, название, шаблоны LIKE по виду системы).
+# Код - номер бита в sa_data_details.system_category; вид системы может входить
+# в несколько категорий. При создании таблиц правил они заполняются этим набором.
+SYSTEM_CATEGORIES = {
+    "ukpg": (0, "УКПГ", ("%УКПГ%",)),
+    "wells": (1, "Скважины", ("%скважин%",)),
+    "processing": (2, "Установки переработки", ("%установк%переработк%",)),
+    "gpz": (3, "ГПЗ", ("%ГПЗ%",)),
+    "phg": (4, "ПХГ", ("%ПХГ%",)),
+    "ks_phg": (5, "КС ПХГ", ("%КС ПХГ%",)),
+    "asu_tp_ukpg": (6, "АСУ ТП УКПГ (УППГ)", ("%УКПГ%", "%УППГ%")),
+    "asu_tp": (7, "АСУ ТП", ("%АСУ ТП%",)),
+    "sau_gpa": (8, "САУ ГПА", ("%САУ ГПА%", "%ГПА%")),
+    "asps": (9, "АСПС", ("%АСПС%", "%пожар%")),
+    "stm": (10, "СТМ", ("%СТМ%", "%телемех%")),
+}
+
+
+def field_expr(column: str, source: str = "detail_json") -> str:
+    """SQL-выражение, извлекающее поле из JSON с приведением типа"""
+    key, sql_type = DETAIL_FIELDS[column]
+    expr = f"json_extract({source}, '$.\"{key}\"')"
+    if sql_type == "TEXT":
+        return expr
+    return f"CAST({expr} AS {sql_type})"
+
+
+def _set_clause(source: str) -> str:
+    return ",\n        ".join(f"{column} = {field_expr(column, source)}" for column in DETAIL_FIELDS)
+
+
+def _triggers():
+    """Триггеры, поддерживающие колонки в актуальном состоянии при записи"""
+    return {
+        "trg_sdd_fields_insert": f"""CREATE TRIGGER trg_sdd_fields_insert
+    AFTER INSERT ON sa_data_details
+BEGIN
+    UPDATE sa_data_details SET
+        {_set_clause("NEW.detail_json")}
+    WHERE rowid = NEW.rowid;
+END""",
+        "trg_sdd_fields_update": f"""CREATE TRIGGER trg_sdd_fields_update
+    AFTER UPDATE OF detail_json ON sa_data_details
+BEGIN
+    UPDATE sa_data_details SET
+        {_set_clause("NEW.detail_json")}
+    WHERE rowid = NEW.rowid;
+END""",
+    }
+
+
+def ensure_detail_columns(conn: sqlite3.Connection) -> bool:
+    """Добавляет типизированные колонки, триггеры и индексы; возвращает True, если были изменения"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sa_data_details'")
+    if not cursor.fetchone():
+        return False
+
+    cursor.execute("PRAGMA table_info(sa_data_details)")
+    existing = {row[1] for row in cursor.fetchall()}
+    missing = [column for column in DETAIL_FIELDS if column not in existing]
+    changed = bool(missing)
+
+    for column in missing:
+        cursor.execute(f"ALTER TABLE sa_data_details ADD COLUMN {column} {DETAIL_FIELDS[column][1]}")
+
+    # Пересоздаем триггер, только если его определение изменилось
+    for name, sql in _triggers().items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+        changed = True
+
+    if missing:
+        # Первичное заполнение одним проходом по таблице
+        cursor.execute(f"UPDATE sa_data_details SET {_set_clause('detail_json')}")
+
+    for column in DETAIL_FIELDS:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_sdd_{column} ON sa_data_details({column})")
+
+    conn.commit()
+    return changed
+
+
+def ensure_indexes(conn: sqlite3.Connection):
+    """Создает индексы, которые нужны фильтрам API"""
+    cursor = conn.cursor()
+    for name, target in API_INDEXES.items():
+        table = target.split("(")[0]
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        if cursor.fetchone():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    conn.commit()
+
+
+def indicator_column(indicator_id: str) -> str:
+    """Имя колонки automation_pivot для показателя"""
+    return "ind_" + re.sub(r"\W", "_", str(indicator_id))
+
+
+def _pivot_select(columns, where: str) -> str:
+    values = ",\n            ".join(
+        f"MAX(CASE WHEN indicator_id = '{indicator_id}' THEN CAST(value AS {sql_type}) END)"
+        for indicator_id, (_, sql_type) in columns.items()
+    )
+    return f"""SELECT do_id, year,
+            {values}
+        FROM automation_summary
+        WHERE {where}
+        GROUP BY do_id, year"""
+
+
+def _pivot_refresh(columns, key: str) -> str:
+    """Пересчет одной строки automation_pivot для (do_id, year) из OLD или NEW"""
+    names = ", ".join(column for column, _ in columns.values())
+    return f"""DELETE FROM automation_pivot WHERE do_id = {key}.do_id AND year = {key}.year;
+    INSERT INTO automation_pivot (do_id, year, {names})
+        {_pivot_select(columns, f"do_id = {key}.do_id AND year = {key}.year")};"""
+
+
+def _pivot_triggers(columns):
+    """Триггеры, поддерживающие automation_pivot при изменении automation_summary"""
+    return {
+        "trg_automation_pivot_insert": f"""CREATE TRIGGER trg_automation_pivot_insert
+    AFTER INSERT ON automation_summary
+BEGIN
+    {_pivot_refresh(columns, "NEW")}
+    INSERT OR REPLACE INTO automation_indicators (indicator_id, indicator) VALUES (NEW.indicator_id, NEW.indicator);
+END""",
+        "trg_automation_pivot_update": f"""CREATE TRIGGER trg_automation_pivot_update
+    AFTER UPDATE ON automation_summary
+BEGIN
+    {_pivot_refresh(columns, "OLD")}
+    {_pivot_refresh(columns, "NEW")}
+    INSERT OR REPLACE INTO automation_indicators (indicator_id, indicator) VALUES (NEW.indicator_id, NEW.indicator);
+END""",
+        "trg_automation_pivot_delete": f"""CREATE TRIGGER trg_automation_pivot_delete
+    AFTER DELETE ON automation_summary
+BEGIN
+    {_pivot_refresh(columns, "OLD")}
+END""",
+    }
+
+
+def ensure_automation_pivot(conn: sqlite3.Connection) -> bool:
+    """Широкая таблица automation_pivot (do_id, year, колонка на показатель).
+
+    Строится один раз и дальше пересчитывается триггерами по затронутой паре
+    (do_id, year); индекс automation_summary(do_id, year, ...) создает optimizer.
+    Показатели, появившиеся после миграции, получат колонку при следующем запуске.
+    Возвращает True, если таблица была перестроена.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'automation_summary'")
+    if not cursor.fetchone():
+        return False
+
+    indicator_ids = dict(AUTOMATION_INDICATORS)
+    cursor.execute("SELECT DISTINCT indicator_id FROM automation_summary WHERE indicator_id IS NOT NULL")
+    for (indicator_id,) in cursor.fetchall():
+        indicator_ids.setdefault(str(indicator_id), "REAL")
+    columns = {
+        indicator_id: (indicator_column(indicator_id), sql_type)
+        for indicator_id, sql_type in sorted(indicator_ids.items(), key=lambda item: (len(item[0]), item[0]))
+    }
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS automation_pivot (
+            do_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            PRIMARY KEY (do_id, year)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS automation_indicators (
+            indicator_id TEXT PRIMARY KEY,
+            indicator TEXT
+        )
+    """)
+
+    cursor.execute("PRAGMA table_info(automation_pivot)")
+    existing = {row[1] for row in cursor.fetchall()}
+    missing = [(column, sql_type) for column, sql_type in columns.values() if column not in existing]
+    for column, sql_type in missing:
+        cursor.execute(f"ALTER TABLE automation_pivot ADD COLUMN {column} {sql_type}")
+
+    cursor.execute("SELECT COUNT(*) FROM automation_pivot")
+    rebuild = bool(missing) or cursor.fetchone()[0] == 0
+
+    for name, sql in _pivot_triggers(columns).items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+
+    if rebuild:
+        names = ", ".join(column for column, _ in columns.values())
+        cursor.execute("DELETE FROM automation_pivot")
+        cursor.execute(f"INSERT INTO automation_pivot (do_id, year, {names}) {_pivot_select(columns, '1')}")
+        cursor.execute("DELETE FROM automation_indicators")
+        cursor.execute("""
+            INSERT OR REPLACE INTO automation_indicators (indicator_id, indicator)
+            SELECT indicator_id, indicator FROM automation_summary
+            WHERE indicator_id IS NOT NULL
+            ORDER BY id
+        """)
+
+    conn.commit()
+    return rebuild
+
+
+# Классификация видов систем. Каждый различный system_type сопоставляется с правилами
+# system_type_rules один раз; маска категорий хранится в system_type_class и копируется
+# в sa_data_details.system_category. Новые виды систем триггер записывает в
+# system_type_class с categories = NULL, их классифицирует classify_system_types().
+def normalize_system_type(value: str) -> str:
+    """Форма для сопоставления с правилами: ё -> е, без регистра и лишних пробелов"""
+    return " ".join(value.replace("ё", "е").replace("Ё", "Е").split()).casefold()
+
+
+def _rule_regex(pattern: str):
+    """Шаблон LIKE (% и _) над нормализованной строкой -> регулярное выражение"""
+    parts = {"%": ".*", "_": "."}
+    return re.compile("".join(parts.get(ch) or re.escape(ch) for ch in normalize_system_type(pattern)), re.DOTALL)
+
+
+def system_category_expr(system_type: str) -> str:
+    """SQL-выражение: маска категорий для вида системы из system_type_class"""
+    return f"(SELECT categories FROM system_type_class WHERE system_type = {system_type})"
+
+
+def _category_statements(r: str) -> str:
+    return f"""INSERT OR IGNORE INTO system_type_class (system_type) SELECT {r}.system_type WHERE {r}.system_type IS NOT NULL;
+    UPDATE sa_data_details SET system_category = {system_category_expr(f"{r}.system_type")}
+    WHERE rowid = {r}.rowid AND system_category IS NOT {system_category_expr(f"{r}.system_type")};"""
+
+
+def _category_triggers():
+    return {
+        "trg_system_category_insert": f"""CREATE TRIGGER trg_system_category_insert
+    AFTER INSERT ON sa_data_details
+BEGIN
+    {_category_statements("NEW")}
+END""",
+        "trg_system_category_update": f"""CREATE TRIGGER trg_system_category_update
+    AFTER UPDATE OF system_type ON sa_data_details
+    WHEN OLD.system_type IS NOT NEW.system_type
+BEGIN
+    {_category_statements("NEW")}
+END""",
+    }
+
+
+def classify_system_types(conn: sqlite3.Connection) -> int:
+    """Пересчитывает маски видов систем по текущим правилам.
+
+    Строки sa_data_details переписываются только для видов систем, чья маска
+    изменилась (новые виды или изменившиеся правила). Возвращает число таких видов.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT code, pattern FROM system_type_rules")
+    rules = [(1 << code, _rule_regex(pattern)) for code, pattern in cursor.fetchall()]
+
+    # Виды систем, записанные в обход триггеров
+    cursor.execute("""
+        INSERT OR IGNORE INTO system_type_class (system_type)
+        SELECT DISTINCT system_type FROM sa_data_details WHERE system_type IS NOT NULL
+    """)
+
+    changed = []
+    cursor.execute("SELECT system_type, categories FROM system_type_class")
+    for system_type, categories in cursor.fetchall():
+        normalized = normalize_system_type(system_type)
+        mask = 0
+        for bit, regex in rules:
+            if regex.fullmatch(normalized):
+                mask |= bit
+        if mask != categories:
+            changed.append((mask, system_type))
+
+    cursor.executemany("UPDATE system_type_class SET categories = ? WHERE system_type = ?", changed)
+    cursor.executemany("""
+        UPDATE sa_data_details SET system_category = ?1
+        WHERE system_type = ?2 AND system_category IS NOT ?1
+    """, changed)
+    conn.commit()
+    return len(changed)
+
+
+def ensure_system_categories(conn: sqlite3.Connection) -> bool:
+    """Правила классификации, колонка sa_data_details.system_category и ее триггеры.
+
+    Правила заполняются только при создании таблиц, поэтому их правки переживают
+    перезапуск; после правок достаточно снова вызвать classify_system_types().
+    Возвращает True, если изменилась классификация хотя бы одного вида систем.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sa_data_details'")
+    if not cursor.fetchone():
+        return False
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'system_categories'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS system_categories (
+            code INTEGER PRIMARY KEY CHECK (code BETWEEN 0 AND 62),
+            name TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS system_type_rules (
+            id INTEGER PRIMARY KEY,
+            code INTEGER NOT NULL REFERENCES system_categories(code),
+            pattern TEXT NOT NULL,
+            UNIQUE (code, pattern)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS system_type_class (
+            system_type TEXT PRIMARY KEY,
+            categories INTEGER
+        )
+    """)
+    if created:
+        cursor.executemany("INSERT INTO system_categories (code, name, title) VALUES (?, ?, ?)",
+                           [(code, name, title) for name, (code, title, _) in SYSTEM_CATEGORIES.items()])
+        cursor.executemany("INSERT INTO system_type_rules (code, pattern) VALUES (?, ?)",
+                           [(code, pattern) for code, _, patterns in SYSTEM_CATEGORIES.values()
+                            for pattern in patterns])
+
+    cursor.execute("PRAGMA table_info(sa_data_details)")
+    if "system_category" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE sa_data_details ADD COLUMN system_category INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sdd_system_category ON sa_data_details(system_category)")
+
+    for name, sql in _category_triggers().items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+    conn.commit()
+
+    return classify_system_types(conn) > 0
+
+
+def _rollup_do_id(r: str) -> str:
+    return f"""COALESCE((SELECT s.do_id FROM sa_data sd JOIN sa s ON sd.sa_id = s.id
+                 WHERE sd.id = {r}.sa_data_id), 0)"""
+
+
+def _rollup_delta(r: str, sign: int) -> str:
+    """Добавляет (sign=1) или вычитает (sign=-1) вклад строки {r} во все измерения"""
+    statements = []
+    for dimension, (bucket, value, condition) in ROLLUP_DIMENSIONS.items():
+        statements.append(f"""INSERT INTO detail_rollup (do_id, dimension, bucket, count, sum)
+        SELECT {_rollup_do_id(r)}, '{dimension}', {bucket.format(r=r)}, {sign}, {sign} * {value.format(r=r)}
+        WHERE {condition.format(r=r)}
+        ON CONFLICT (do_id, dimension, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            sum = sum + excluded.sum;""")
+    if sign < 0:
+        statements.append(f"DELETE FROM detail_rollup WHERE do_id = {_rollup_do_id(r)} AND count = 0;")
+    return "\n    ".join(statements)
+
+
+def _rollup_move(rows: str, do_id: str, sign: int) -> str:
+    """Добавляет (sign=1) или вычитает (sign=-1) вклад строк sa_data_details, отобранных
+    условием rows над sdd, под ДО do_id - для переноса отчета или системы между ДО"""
+    statements = []
+    for dimension, (bucket, value, condition) in ROLLUP_DIMENSIONS.items():
+        statements.append(f"""INSERT INTO detail_rollup (do_id, dimension, bucket, count, sum)
+        SELECT {do_id}, '{dimension}', {bucket.format(r="sdd")},
+               {sign} * COUNT(*), {sign} * TOTAL({value.format(r="sdd")})
+        FROM sa_data_details sdd
+        WHERE {rows} AND {condition.format(r="sdd")}
+        GROUP BY 3
+        ON CONFLICT (do_id, dimension, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            sum = sum + excluded.sum;""")
+    if sign < 0:
+        statements.append(f"DELETE FROM detail_rollup WHERE do_id = {do_id} AND count = 0;")
+    return "\n    ".join(statements)
+
+
+def _changed(columns) -> str:
+    """Условие WHEN: хотя бы одна из колонок действительно изменилась"""
+    return " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in columns)
+
+
+def _rollup_triggers():
+    """Триггеры, поддерживающие detail_rollup по каждой измененной строке sa_data_details,
+    а также при переносе отчетов sa_data и систем sa между ДО"""
+    report_do = "COALESCE((SELECT do_id FROM sa WHERE id = {r}.sa_id), 0)"
+    report_rows = "sdd.sa_data_id = {r}.id"
+    system_rows = "sdd.sa_data_id IN (SELECT id FROM sa_data WHERE sa_id = {r}.id)"
+    return {
+        "trg_detail_rollup_insert": f"""CREATE TRIGGER trg_detail_rollup_insert
+    AFTER INSERT ON sa_data_details
+BEGIN
+    {_rollup_delta("NEW", 1)}
+END""",
+        "trg_detail_rollup_update": f"""CREATE TRIGGER trg_detail_rollup_update
+    AFTER UPDATE OF {", ".join(ROLLUP_SOURCE_COLUMNS)} ON sa_data_details
+    WHEN {_changed(ROLLUP_SOURCE_COLUMNS)}
+BEGIN
+    {_rollup_delta("OLD", -1)}
+    {_rollup_delta("NEW", 1)}
+END""",
+        "trg_detail_rollup_delete": f"""CREATE TRIGGER trg_detail_rollup_delete
+    AFTER DELETE ON sa_data_details
+BEGIN
+    {_rollup_delta("OLD", -1)}
+END""",
+        # Строки отчета без sa_data или без sa учитываются под do_id = 0: вставка и удаление
+        # отчета или системы тоже переносят их строки
+        "trg_detail_rollup_sa_data_insert": f"""CREATE TRIGGER trg_detail_rollup_sa_data_insert
+    AFTER INSERT ON sa_data
+BEGIN
+    {_rollup_move(report_rows.format(r="NEW"), "0", -1)}
+    {_rollup_move(report_rows.format(r="NEW"), report_do.format(r="NEW"), 1)}
+END""",
+        "trg_detail_rollup_sa_data_update": f"""CREATE TRIGGER trg_detail_rollup_sa_data_update
+    AFTER UPDATE OF sa_id ON sa_data
+    WHEN {_changed(("sa_id",))}
+BEGIN
+    {_rollup_move(report_rows.format(r="NEW"), report_do.format(r="OLD"), -1)}
+    {_rollup_move(report_rows.format(r="NEW"), report_do.format(r="NEW"), 1)}
+END""",
+        "trg_detail_rollup_sa_data_delete": f"""CREATE TRIGGER trg_detail_rollup_sa_data_delete
+    AFTER DELETE ON sa_data
+BEGIN
+    {_rollup_move(report_rows.format(r="OLD"), report_do.format(r="OLD"), -1)}
+    {_rollup_move(report_rows.format(r="OLD"), "0", 1)}
+END""",
+        "trg_detail_rollup_sa_insert": f"""CREATE TRIGGER trg_detail_rollup_sa_insert
+    AFTER INSERT ON sa
+BEGIN
+    {_rollup_move(system_rows.format(r="NEW"), "0", -1)}
+    {_rollup_move(system_rows.format(r="NEW"), "COALESCE(NEW.do_id, 0)", 1)}
+END""",
+        "trg_detail_rollup_sa_update": f"""CREATE TRIGGER trg_detail_rollup_sa_update
+    AFTER UPDATE OF do_id ON sa
+    WHEN {_changed(("do_id",))}
+BEGIN
+    {_rollup_move(system_rows.format(r="NEW"), "COALESCE(OLD.do_id, 0)", -1)}
+    {_rollup_move(system_rows.format(r="NEW"), "COALESCE(NEW.do_id, 0)", 1)}
+END""",
+        "trg_detail_rollup_sa_delete": f"""CREATE TRIGGER trg_detail_rollup_sa_delete
+    AFTER DELETE ON sa
+BEGIN
+    {_rollup_move(system_rows.format(r="OLD"), "COALESCE(OLD.do_id, 0)", -1)}
+    {_rollup_move(system_rows.format(r="OLD"), "0", 1)}
+END""",
+    }
+
+
+def rebuild_rollups(conn: sqlite3.Connection):
+    """Полный пересчет detail_rollup (при новой таблице или измененных триггерах)"""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM detail_rollup")
+    for dimension, (bucket, value, condition) in ROLLUP_DIMENSIONS.items():
+        cursor.execute(f"""
+            INSERT INTO detail_rollup (do_id, dimension, bucket, count, sum)
+            SELECT COALESCE(s.do_id, 0), '{dimension}', {bucket.format(r="sdd")},
+                   COUNT(*), TOTAL({value.format(r="sdd")})
+            FROM sa_data_details sdd
+            LEFT JOIN sa_data sd ON sdd.sa_data_id = sd.id
+            LEFT JOIN sa s ON sd.sa_id = s.id
+            WHERE {condition.format(r="sdd")}
+            GROUP BY 1, 3
+        """)
+    conn.commit()
+
+
+def ensure_rollups(conn: sqlite3.Connection) -> bool:
+    """Таблица detail_rollup: счетчики, суммы и гистограммы по ДО.
+
+    Заполняется один раз, дальше триггеры применяют к ней разницу по каждой
+    вставленной, измененной или удаленной строке sa_data_details и переносят строки
+    отчетов sa_data и систем sa, сменивших ДО. Возвращает True, если таблица была
+    построена заново.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN "
+                   "('sa_data_details', 'sa_data', 'sa')")
+    if len(cursor.fetchall()) < 3:
+        return False
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detail_rollup'")
+    rebuild = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS detail_rollup (
+            do_id INTEGER NOT NULL,
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            PRIMARY KEY (do_id, dimension, bucket)
+        ) WITHOUT ROWID
+    """)
+
+    for name, sql in _rollup_triggers().items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+        # Триггеры изменились - данные могли считаться по-старому
+        rebuild = True
+
+    if rebuild:
+        rebuild_rollups(conn)
+    conn.commit()
+    return rebuild
+
+
+# Версии лет: меняются при любой записи, влияющей на данные года (строки отчетов
+# и показатели automation_summary). Результаты по прошлым годам кэшируются по версии
+# и не пересчитываются, пока их год не изменился.
+def _bump_year(year_select: str) -> str:
+    return f"""INSERT INTO year_versions (year, version)
+        {year_select}
+        ON CONFLICT(year) DO UPDATE SET version = version + 1;"""
+
+
+def _year_triggers():
+    detail_year = "SELECT year, 1 FROM sa_data WHERE id = {r}.sa_data_id AND year IS NOT NULL"
+    sa_years = "SELECT DISTINCT year, 1 FROM sa_data WHERE sa_id = {r}.id AND year IS NOT NULL"
+    summary_year = "SELECT {r}.year, 1 WHERE {r}.year IS NOT NULL"
+    return {
+        "trg_year_versions_detail_insert": f"""CREATE TRIGGER trg_year_versions_detail_insert
+    AFTER INSERT ON sa_data_details
+BEGIN
+    {_bump_year(detail_year.format(r="NEW"))}
+END""",
+        "trg_year_versions_detail_update": f"""CREATE TRIGGER trg_year_versions_detail_update
+    AFTER UPDATE OF {", ".join(ROLLUP_SOURCE_COLUMNS)} ON sa_data_details
+    WHEN {_changed(ROLLUP_SOURCE_COLUMNS)}
+BEGIN
+    {_bump_year(detail_year.format(r="OLD"))}
+    {_bump_year(detail_year.format(r="NEW"))}
+END""",
+        "trg_year_versions_detail_delete": f"""CREATE TRIGGER trg_year_versions_detail_delete
+    AFTER DELETE ON sa_data_details
+BEGIN
+    {_bump_year(detail_year.format(r="OLD"))}
+END""",
+        "trg_year_versions_sa_data_update": f"""CREATE TRIGGER trg_year_versions_sa_data_update
+    AFTER UPDATE OF sa_id, year ON sa_data
+    WHEN {_changed(("sa_id", "year"))}
+BEGIN
+    {_bump_year(summary_year.format(r="OLD"))}
+    {_bump_year(summary_year.format(r="NEW"))}
+END""",
+        "trg_year_versions_sa_update": f"""CREATE TRIGGER trg_year_versions_sa_update
+    AFTER UPDATE OF do_id ON sa
+    WHEN {_changed(("do_id",))}
+BEGIN
+    {_bump_year(sa_years.format(r="NEW"))}
+END""",
+        "trg_year_versions_summary_insert": f"""CREATE TRIGGER trg_year_versions_summary_insert
+    AFTER INSERT ON automation_summary
+BEGIN
+    {_bump_year(summary_year.format(r="NEW"))}
+END""",
+        "trg_year_versions_summary_update": f"""CREATE TRIGGER trg_year_versions_summary_update
+    AFTER UPDATE ON automation_summary
+BEGIN
+    {_bump_year(summary_year.format(r="OLD"))}
+    {_bump_year(summary_year.format(r="NEW"))}
+END""",
+        "trg_year_versions_summary_delete": f"""CREATE TRIGGER trg_year_versions_summary_delete
+    AFTER DELETE ON automation_summary
+BEGIN
+    {_bump_year(summary_year.format(r="OLD"))}
+END""",
+    }
+
+
+def ensure_year_versions(conn: sqlite3.Connection) -> bool:
+    """Таблица year_versions (year, version) и триггеры, которые ее ведут.
+
+    Возвращает True, если таблица или триггеры были созданы заново.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN "
+                   "('sa_data_details', 'sa_data', 'sa', 'automation_summary')")
+    if len(cursor.fetchall()) < 4:
+        return False
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'year_versions'")
+    changed = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS year_versions (
+            year INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+
+    for name, sql in _year_triggers().items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+        changed = True
+
+    if changed:
+        # Годы, записанные до появления триггеров; у существующих версия увеличивается,
+        # чтобы закэшированные по старым правилам результаты стали недействительны
+        cursor.execute(_bump_year("""SELECT year, 1 FROM sa_data WHERE year IS NOT NULL
+        UNION SELECT year, 1 FROM automation_summary WHERE year IS NOT NULL"""))
+    conn.commit()
+    return changed
+
+
+
+# Ревизии данных: счетчик, который растет при любой записи в таблицу-источник.
+# В отличие от PRAGMA data_version он хранится в БД и одинаков для всех процессов:
+# по нему воркеры проверяют, что файл снимка (columnar.py) соответствует данным.
+REVISION_SOURCES = {
+    "sa_data_details": ("sa_data_details", "sa_data", "sa"),
+}
+
+
+def _revision_triggers():
+    triggers = {}
+    for name, tables in REVISION_SOURCES.items():
+        for table in tables:
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                trigger = f"trg_revision_{name}_{table}_{event.lower()}"
+                triggers[trigger] = f"""CREATE TRIGGER {trigger}
+    AFTER {event} ON {table}
+BEGIN
+    UPDATE data_revisions SET revision = revision + 1 WHERE name = '{name}';
+END"""
+    return triggers
+
+
+def ensure_data_revisions(conn: sqlite3.Connection) -> bool:
+    """Таблица data_revisions (name, revision) и триггеры, которые ее ведут.
+
+    Возвращает True, если таблица или триггеры были созданы заново.
+    """
+    cursor = conn.cursor()
+    tables = {table for sources in REVISION_SOURCES.values() for table in sources}
+    cursor.execute(f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN "
+                   f"({', '.join('?' * len(tables))})", tuple(tables))
+    if cursor.fetchone()[0] < len(tables):
+        return False
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_revisions'")
+    changed = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_revisions (
+            name TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL
+        )
+    """)
+    cursor.executemany("INSERT OR IGNORE INTO data_revisions (name, revision) VALUES (?, 0)",
+                       [(name,) for name in REVISION_SOURCES])
+
+    for name, sql in _revision_triggers().items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+        changed = True
+
+    if changed:
+        # Записи до появления триггеров не учтены - ревизия увеличивается, и старые снимки
+        # становятся недействительными
+        cursor.execute("UPDATE data_revisions SET revision = revision + 1")
+    conn.commit()
+    return changed
+
+
+def query_data_revision(cursor, name: str):
+    """Текущая ревизия источника; None, если data_revisions еще не создана"""
+    try:
+        cursor.execute("SELECT revision FROM data_revisions WHERE name = ?", (name,))
+    except sqlite3.OperationalError:
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# Реестр секторов: do_id -> сектор. При создании заполняется составом секторов,
+# который раньше был зашит в эндпоинты; дальше таблица - единственный источник.
+SECTORS = {
+    "dobycha": ("Добыча", (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 34, 35)),
+    "pererabotka": ("Переработка", (11,)),
+    "phg": ("ПХГ", (12,)),
+    "transport": ("Транспорт", tuple(range(13, 33))),
+}
+
+# ДО транспорта, которые condition-detailed находил по названию; попадают в реестр,
+# если их id нет среди id по умолчанию
+TRANSPORT_DO_NAMES = (
+    "ООО «Газпром трансгаз Ухта»",
+    "ООО «Газпром трансгаз Махачкала»",
+    "ООО «Газпром трансгаз Ставрополь»",
+    "ООО «Газпром трансгаз Сургут»",
+    "ООО «Газпром трансгаз Волгоград»",
+    "ООО «Газпром трансгаз Югорск»",
+    "ООО «Газпром трансгаз Самара»",
+    "ООО «Газпром трансгаз Краснодар»",
+    "ООО «Газпром трансгаз Санкт-Петербург»",
+    "ООО «Газпром трансгаз Саратов»",
+    "ООО «Газпром трансгаз Чайковский»",
+    "ООО «Газпром трансгаз Беларусь»",
+    "ООО «Газпром трансгаз Нижний Новгород»",
+    "ООО «Газпром трансгаз Екатеринбург»",
+    "ООО «Газпром трансгаз Казань»",
+    "ООО «Газпром трансгаз Москва»",
+    "ООО «Газпром трансгаз Томск»",
+    "ООО «Газпром трансгаз Уфа»",
+    "АО «Газпром трансгаз Грозный»",
+    "ЗАО «Газпром Армения»",
+    "АО «Газпром Кыргызстан»",
+)
+
+
+def ensure_sector_registry(conn: sqlite3.Connection) -> bool:
+    """Таблица do_sector (do_id, sector) с индексом по сектору.
+
+    Заполняется только при создании, поэтому правки реестра переживают перезапуск.
+    Возвращает True, если таблица была создана.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'do'")
+    if not cursor.fetchone():
+        return False
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'do_sector'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS do_sector (
+            do_id INTEGER PRIMARY KEY,
+            sector TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_do_sector_sector ON do_sector(sector, do_id)")
+
+    if created:
+        cursor.executemany("INSERT OR IGNORE INTO do_sector (do_id, sector) VALUES (?, ?)",
+                           [(do_id, sector) for sector, (_, do_ids) in SECTORS.items() for do_id in do_ids])
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO do_sector (do_id, sector)
+            SELECT id, 'transport' FROM do WHERE name IN ({",".join("?" * len(TRANSPORT_DO_NAMES))})
+        """, TRANSPORT_DO_NAMES)
+    conn.commit()
+    return created
+
+
+# Полнотекстовый поиск: бесконтентная FTS5-таблица над типизированными колонками
+# sa_data_details (rowid = rowid строки). В индекс попадает текст с ё -> е; стемминга
+# в SQLite нет, частичные слова ищутся префиксными запросами.
+SEARCH_COLUMNS = ("object_name", "system_type", "plc_type", "scada_type", "do_name")
+# Веса bm25 по SEARCH_COLUMNS (сохраняются в индексе как ранжирование по умолчанию):
+# совпадение в названии объекта важнее, чем в наименовании ДО
+SEARCH_WEIGHTS = (5.0, 3.0, 2.0, 2.0, 1.0)
+SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+SEARCH_PREFIXES = "2 3"
+
+
+def search_text(value: str) -> str:
+    """Та же нормализация, что у индексируемого текста"""
+    return value.replace("ё", "е").replace("Ё", "Е")
+
+
+def _search_values(r: str) -> str:
+    return ", ".join(f"replace(replace({r}.{column}, 'ё', 'е'), 'Ё', 'Е')" for column in SEARCH_COLUMNS)
+
+
+def _search_triggers():
+    columns = ", ".join(SEARCH_COLUMNS)
+    insert = f"INSERT INTO sdd_search (rowid, {columns}) VALUES (NEW.rowid, {_search_values('NEW')});"
+    # У бесконтентной таблицы удаление - команда 'delete' с теми же значениями, что были вставлены
+    delete = f"INSERT INTO sdd_search (sdd_search, rowid, {columns}) VALUES ('delete', OLD.rowid, {_search_values('OLD')});"
+    return {
+        "trg_sdd_search_insert": f"""CREATE TRIGGER trg_sdd_search_insert
+    AFTER INSERT ON sa_data_details
+BEGIN
+    {insert}
+END""",
+        "trg_sdd_search_update": f"""CREATE TRIGGER trg_sdd_search_update
+    AFTER UPDATE OF {columns} ON sa_data_details
+    WHEN {_changed(SEARCH_COLUMNS)}
+BEGIN
+    {delete}
+    {insert}
+END""",
+        "trg_sdd_search_delete": f"""CREATE TRIGGER trg_sdd_search_delete
+    AFTER DELETE ON sa_data_details
+BEGIN
+    {delete}
+END""",
+    }
+
+
+def ensure_search_index(conn: sqlite3.Connection) -> bool:
+    """FTS5-индекс sdd_search и триггеры синхронизации.
+
+    Индекс строится заново, если таблицы еще нет или изменились триггеры.
+    Возвращает True, если индекс был построен; без FTS5 в сборке SQLite - False.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sa_data_details'")
+    if not cursor.fetchone():
+        return False
+
+    triggers = _search_triggers()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sdd_search'")
+    rebuild = cursor.fetchone() is None
+    for name, sql in triggers.items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if not row or row[0] != sql:
+            rebuild = True
+    if not rebuild:
+        return False
+
+    try:
+        for name in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute("DROP TABLE IF EXISTS sdd_search")
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE sdd_search USING fts5(
+                {", ".join(SEARCH_COLUMNS)},
+                content = '',
+                tokenize = '{SEARCH_TOKENIZER}',
+                prefix = '{SEARCH_PREFIXES}'
+            )
+        """)
+        cursor.execute("INSERT INTO sdd_search (sdd_search, rank) VALUES ('rank', ?)",
+                       (f"bm25({', '.join(map(str, SEARCH_WEIGHTS))})",))
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        print(f"⚠️ Полнотекстовый поиск недоступен: {e}")
+        return False
+
+    cursor.execute(f"""
+        INSERT INTO sdd_search (rowid, {", ".join(SEARCH_COLUMNS)})
+        SELECT rowid, {_search_values("sa_data_details")}
+        FROM sa_data_details
+    """)
+    cursor.execute("INSERT INTO sdd_search (sdd_search) VALUES ('optimize')")
+    for sql in triggers.values():
+        cursor.execute(sql)
+    conn.commit()
+    return True
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if ensure_detail_columns(conn):
+            print("✅ Колонки detail_json материализованы")
+        else:
+            print("✅ Схема уже актуальна")
+        ensure_indexes(conn)
+        if ensure_system_categories(conn):
+            print("✅ Виды систем классифицированы")
+        if ensure_automation_pivot(conn):
+            print("✅ automation_pivot перестроена")
+        if ensure_rollups(conn):
+            print("✅ detail_rollup перестроена")
+        if ensure_year_versions(conn):
+            print("✅ year_versions создана")
+        if ensure_data_revisions(conn):
+            print("✅ data_revisions создана")
+        if ensure_sector_registry(conn):
+            print("✅ Реестр секторов do_sector создан")
+        if ensure_search_index(conn):
+            print("✅ Поисковый индекс sdd_search построен")
+    finally:
+        conn.close()
@@ -1,11 +1,9 @@
 # server.py - простой сервер для фронтенда
-import http.server
-import socketserver
-import webbrowser
+from static_server import CachedRequestHandler, serve
 
 PORT = 3000
 
-class Handler(http.server.SimpleHTTPRequestHandler):
+class Handler(CachedRequestHandler):
     def end_headers(self):
         # Добавляем CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -16,11 +14,4 @@ class Handler(http.server.SimpleHTTPRequestHandler):
 print(f"🚀 Запуск фронтенд-сервера на http://localhost:{PORT}")
 print("📁 Обслуживаю файлы из текущей папки")
 
-with socketserver.TCPServer(("", PORT), Handler) as httpd:
-    print(f"✅ Открой http://localhost:{PORT}/index.html в браузере")
-    webbrowser.open(f'http://localhost:{PORT}/index.html')
-    
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\n🛑 Сервер остановлен")
\ No newline at end of file
+serve(PORT, Handler)
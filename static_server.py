@@ -0,0 +1,213 @@
+# static_server.py - многопоточный сервер фронтенда с кэшем и сжатием
+import gzip
+import http.server
+import io
+import os
+import threading
+import webbrowser
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него остается gzip
+    brotli = None
+
+# Файлы крупнее этого размера не держим в памяти, а отдаем через sendfile
+CACHE_MAX_FILE_SIZE = 4 * 1024 * 1024
+# Всего в кэше (файлы и их сжатые варианты); сверх - вытесняются давно не запрошенные
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 9
+# Сжатие идет в потоке запроса при первой загрузке: качество 11 на мегабайтах JS - секунды
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class _CachedFile:
+    """Содержимое файла и его сжатые варианты для одного mtime"""
+
+    def __init__(self, path: str, st: os.stat_result, content_type: str):
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.content_type = content_type
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        with open(path, "rb") as f:
+            self.body = f.read()
+
+        # Сжимаем один раз при загрузке, а не на каждый запрос
+        self.variants = {}
+        if content_type.startswith(COMPRESSIBLE_TYPES) and len(self.body) >= COMPRESS_MIN_SIZE:
+            self.variants["gzip"] = gzip.compress(self.body, GZIP_LEVEL)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(self.body, quality=BROTLI_QUALITY)
+        self.nbytes = len(self.body) + sum(len(variant) for variant in self.variants.values())
+
+
+class FileCache:
+    """LRU-кэш содержимого файлов, ключ - путь; запись устаревает при смене mtime/size.
+
+    Размер ограничен суммой байт файлов и их сжатых вариантов (max_bytes).
+    """
+
+    def __init__(self, max_file_size: int = CACHE_MAX_FILE_SIZE, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_file_size = max_file_size
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, st: os.stat_result, content_type: str):
+        if st.st_size > self.max_file_size:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                self._entries.move_to_end(path)
+                return entry
+        entry = _CachedFile(path, st, content_type)
+        if entry.nbytes > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[path] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return entry
+
+
+file_cache = FileCache()
+
+
+def _accepted_encodings(header: str):
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+class CachedRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Раздача статики: кэш в памяти, gzip/brotli, ETag/Last-Modified и 304"""
+
+    protocol_version = "HTTP/1.1"
+    cache_control = "no-cache"
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = next((os.path.join(path, name) for name in ("index.html", "index.htm")
+                          if os.path.isfile(os.path.join(path, name))), None)
+            if index is None or not self.path.split("?", 1)[0].endswith("/"):
+                # Листинг каталога и редирект на "/" - стандартная обработка
+                return super().send_head()
+            path = index
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
+            st = os.fstat(f.fileno())
+            content_type = self.guess_type(path)
+            entry = file_cache.get(path, st, content_type)
+        except Exception:
+            f.close()
+            raise
+
+        etag = entry.etag if entry else f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        last_modified = entry.last_modified if entry else formatdate(st.st_mtime, usegmt=True)
+
+        if self._not_modified(etag, st.st_mtime):
+            f.close()
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Cache-Control", self.cache_control)
+            self.end_headers()
+            return None
+
+        body = None
+        encoding = None
+        if entry is not None:
+            f.close()
+            body = entry.body
+            accepted = _accepted_encodings(self.headers.get("Accept-Encoding", ""))
+            for candidate in ("br", "gzip"):
+                if candidate in accepted and candidate in entry.variants:
+                    encoding = candidate
+                    body = entry.variants[candidate]
+                    break
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body) if body is not None else st.st_size))
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("ETag", etag[:-1] + "-" + encoding + '"' if encoding else etag)
+        self.send_header("Cache-Control", self.cache_control)
+        if entry is not None and entry.variants:
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+
+        return io.BytesIO(body) if body is not None else f
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            base = etag.strip('"')
+            for tag in if_none_match.split(","):
+                tag = tag.strip()
+                if tag == "*":
+                    return True
+                tag = tag[2:] if tag.startswith("W/") else tag
+                tag = tag.strip('"')
+                # Сжатые варианты помечены суффиксом кодировки
+                if tag == base or tag.rsplit("-", 1)[0] == base:
+                    return True
+            return False
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, io.BytesIO):
+            outputfile.write(source.getbuffer())
+            return
+        # Некэшированные файлы - через sendfile, без копирования в user space
+        outputfile.flush()
+        self.connection.sendfile(source)
+
+
+class FrontendServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port: int, handler_class=CachedRequestHandler, open_browser: bool = True):
+    """Запускает сервер фронтенда; каждый запрос обрабатывается в своем потоке"""
+    with FrontendServer(("", port), handler_class) as httpd:
+        print(f"✅ Открой http://localhost:{port}/index.html в браузере")
+        if open_browser:
+            webbrowser.open(f'http://localhost:{port}/index.html')
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\n🛑 Сервер остановлен")
@@ -0,0 +1,122 @@
+# conftest.py - общая синтетическая БД для тестов
+#
+# Путь к БД и к общему кэшу читаются модулями приложения при импорте, поэтому
+# переменные окружения задаются здесь, до импорта schema/database/main.
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+DATA_DIR = Path(tempfile.mkdtemp(prefix="do-tests-"))
+TEMPLATE_DB = DATA_DIR / "template.db"
+APP_DB = DATA_DIR / "do_system.db"
+
+os.environ["DO_SYSTEM_DB"] = str(APP_DB)
+os.environ["DO_SHARED_CACHE_PATH"] = ""
+os.environ["DO_SNAPSHOT_PATH"] = str(DATA_DIR / "do_system.db.columns")
+os.environ["DO_INGEST_TOKEN"] = "test-token"
+# Опорный год - значение по умолчанию
+os.environ.pop("DO_REFERENCE_YEAR", None)
+
+YEARS = (2022, 2023)
+
+
+def _build_template():
+    import benchmark
+    import schema
+
+    benchmark.generate(str(TEMPLATE_DB), systems_per_do=2, details_per_system=6, years=YEARS, seed=7)
+    conn = sqlite3.connect(TEMPLATE_DB)
+    try:
+        schema.ensure_detail_columns(conn)
+        schema.ensure_indexes(conn)
+        schema.ensure_system_categories(conn)
+        schema.ensure_automation_pivot(conn)
+        schema.ensure_rollups(conn)
+        schema.ensure_year_versions(conn)
+        schema.ensure_data_revisions(conn)
+        schema.ensure_sector_registry(conn)
+        schema.ensure_search_index(conn)
+    finally:
+        conn.close()
+    shutil.copy(TEMPLATE_DB, APP_DB)
+
+
+_build_template()
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Соединение с копией мигрированной БД (запись разрешена)"""
+    path = tmp_path / "do_system.db"
+    shutil.copy(TEMPLATE_DB, path)
+    connection = sqlite3.connect(path)
+    yield connection
+    connection.close()
+
+
+def _detail(**fields) -> str:
+    from schema import DETAIL_FIELDS
+
+    return json.dumps({DETAIL_FIELDS[name][0]: value for name, value in fields.items()}, ensure_ascii=False)
+
+
+def write_details(conn: sqlite3.Connection):
+    """Набор записей в sa_data_details, затрагивающий все триггеры: вставка, правка карточки,
+    статуса и принадлежности отчету, удаление, строка без ДО"""
+    other_do = conn.execute("""
+        SELECT sd.id FROM sa_data sd JOIN sa s ON sd.sa_id = s.id
+        WHERE s.do_id <> (SELECT s2.do_id FROM sa_data_details sdd JOIN sa_data sd2 ON sdd.sa_data_id = sd2.id
+                          JOIN sa s2 ON sd2.sa_id = s2.id WHERE sdd.id = 3)
+        ORDER BY sd.id LIMIT 1
+    """).fetchone()[0]
+    conn.executemany(
+        "INSERT INTO sa_data_details (sa_data_id, detail_json, import_status, test_stage) VALUES (?, ?, ?, ?)",
+        [
+            (1, _detail(system_type="АСУ ТП УКПГ-5", install_year="2015", wear=55.5, functionality=80,
+                        object_name="УКПГ-5 Ёлкинская", plc_type="Siemens S7-300"), "Замещено", None),
+            (2, _detail(system_type="Новая СТМ скважин", install_year=1998, wear="100",
+                        object_name="Куст скважин 12"), None, "Завершено"),
+            (2, _detail(object_name="Без вида системы"), "", None),
+            # Отчет, которого нет в sa_data: строка учитывается под do_id = 0
+            (999999, _detail(system_type="САУ ГПА", install_year=2020, wear=0, functionality=100), "Испытания", None),
+        ],
+    )
+    conn.execute("UPDATE sa_data_details SET detail_json = ? WHERE id = 1",
+                 (_detail(system_type="АСПС КС", install_year=2001, wear=71, functionality=35.5,
+                          object_name="КС Пуровская", scada_type="WinCC"),))
+    conn.execute("UPDATE sa_data_details SET import_status = '' WHERE id = 2")
+    conn.execute("UPDATE sa_data_details SET import_status = NULL WHERE id IN (4, 5)")
+    conn.execute("UPDATE sa_data_details SET sa_data_id = ? WHERE id = 3", (other_do,))
+    conn.execute("UPDATE sa_data_details SET test_stage = 'Лабораторные' WHERE id = 6")
+    conn.execute("DELETE FROM sa_data_details WHERE id IN (7, 8, 9)")
+    conn.commit()
+
+
+@pytest.fixture
+def written(conn):
+    """Копия БД после write_details()"""
+    write_details(conn)
+    return conn
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient приложения над общей БД; lifespan выполняет миграции при старте"""
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
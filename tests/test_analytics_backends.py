@@ -0,0 +1,16 @@
+# Бэкенд memory (columnar.py) дает те же ответы, что и SQL
+import pytest
+
+pytest.importorskip("numpy")
+
+
+@pytest.mark.parametrize("do_id, reference_year", [(1, None), (11, 2030), (13, 2024), (33, 2024)])
+def test_backends_match(client, do_id, reference_year):
+    params = {"do_id": do_id}
+    if reference_year:
+        params["reference_year"] = reference_year
+    body = client.get("/api/debug/backend-check", params=params).json()
+    assert body["checks"]
+    mismatched = {name: check for name, check in body["checks"].items() if not check["match"]}
+    assert mismatched == {}
+    assert body["match"] is True
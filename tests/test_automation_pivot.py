@@ -0,0 +1,38 @@
+# automation_pivot: строки, которые ведут триггеры, совпадают с полным перестроением
+from schema import ensure_automation_pivot
+
+
+def pivot(conn):
+    return conn.execute("SELECT * FROM automation_pivot ORDER BY do_id, year").fetchall()
+
+
+def rebuilt(conn):
+    conn.execute("DELETE FROM automation_pivot")
+    assert ensure_automation_pivot(conn) is True
+    return pivot(conn)
+
+
+def test_pivot_matches_rebuild_after_writes(conn):
+    conn.executemany(
+        "INSERT INTO automation_summary (do_id, year, indicator_id, indicator, value) VALUES (?, ?, ?, ?, ?)",
+        [(1, 2024, "4", "Количество ЦДП", "3"), (1, 2024, "54", "Протяженность МГ, км", "120.5"),
+         (2, 2022, "85", "Количество ГПА", "17")],
+    )
+    conn.execute("UPDATE automation_summary SET value = '999' WHERE do_id = 3 AND year = 2022 AND indicator_id = '94'")
+    # Перенос показателя в другой год меняет обе строки pivot
+    conn.execute("UPDATE automation_summary SET year = 2021 WHERE do_id = 4 AND year = 2023 AND indicator_id = '7'")
+    conn.execute("DELETE FROM automation_summary WHERE do_id = 5")
+    conn.commit()
+
+    maintained = pivot(conn)
+    assert (5, 2022) not in {row[:2] for row in maintained}
+    assert (4, 2021) in {row[:2] for row in maintained}
+    assert maintained == rebuilt(conn)
+
+
+def test_indicator_names_follow_inserts(conn):
+    conn.execute("INSERT INTO automation_summary (do_id, year, indicator_id, indicator, value) "
+                 "VALUES (1, 2023, '4', 'ЦДП (уточнено)', '1')")
+    conn.commit()
+    row = conn.execute("SELECT indicator FROM automation_indicators WHERE indicator_id = '4'").fetchone()
+    assert row == ("ЦДП (уточнено)",)
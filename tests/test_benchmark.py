@@ -0,0 +1,74 @@
+# benchmark.py: генератор синтетической БД и прогон эндпоинтов
+import json
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmark import DO_NAMES, collect_cases, generate, latency_summary, percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def dump(path):
+    conn = sqlite3.connect(path)
+    try:
+        return list(conn.iterdump())
+    finally:
+        conn.close()
+
+
+def test_generate_is_deterministic(tmp_path):
+    first, second = str(tmp_path / "first.db"), str(tmp_path / "second.db")
+    generate(first, systems_per_do=1, details_per_system=4, years=(2023,), seed=3)
+    generate(second, systems_per_do=1, details_per_system=4, years=(2023,), seed=3)
+    assert dump(first) == dump(second)
+
+    conn = sqlite3.connect(first)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM do").fetchone()[0] == len(DO_NAMES)
+        assert conn.execute("SELECT COUNT(*) FROM sa").fetchone()[0] == len(DO_NAMES)
+        assert conn.execute("SELECT COUNT(*) FROM sa_data_details").fetchone()[0] >= 2 * len(DO_NAMES)
+    finally:
+        conn.close()
+
+
+def test_percentiles():
+    assert percentile([], 50) == 0.0
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(range(1, 101), 99) == 99
+    assert percentile(range(1, 101), 95) == 95
+    assert percentile([5], 99) == 5
+    summary = latency_summary([0.001, 0.003])
+    assert summary["p50"] == 1.0
+    assert summary["max"] == 3.0
+    assert summary["mean"] == 2.0
+
+
+def test_collect_cases_covers_get_routes(client):
+    from main import app
+
+    names = [name for name, _ in collect_cases(app, 5)]
+    assert len(names) == len(set(names))
+    assert "/api/do-list?include=summary" in names
+    urls = dict(collect_cases(app, 5))
+    assert urls["/api/do/{do_id}/summary"] == "/api/do/5/summary"
+
+
+def test_cli_generate_and_run(tmp_path):
+    db_path = tmp_path / "bench.db"
+    out = tmp_path / "report.json"
+    subprocess.run([sys.executable, str(ROOT / "benchmark.py"), "generate", "--db", str(db_path),
+                    "--systems-per-do", "1", "--details-per-system", "4", "--years", "2023"],
+                   check=True, capture_output=True, cwd=tmp_path)
+    subprocess.run([sys.executable, str(ROOT / "benchmark.py"), "run", "--db", str(db_path),
+                    "--requests", "2", "--concurrency", "2", "--only", "/api/do-list", "--out", str(out)],
+                   check=True, capture_output=True, cwd=tmp_path)
+
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert report["meta"]["detail_rows"] > 0
+    assert set(report["endpoints"]) == {"/api/do-list", "/api/do-list?include=summary"}
+    for result in report["endpoints"].values():
+        assert result["status"] == 200
+        assert result["requests"] == 2
+        assert result["sql_statements"] >= 0
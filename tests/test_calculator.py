@@ -0,0 +1,132 @@
+# Пакетный калькулятор: совпадение с моделью calculateStandardMetrics из index.html
+import math
+import random
+
+import pytest
+
+import calculator
+
+# weights из index.html (W5 в расчете не участвует)
+JS_WEIGHTS = {
+    "safety": {"W1": 0.35, "W2": 0.25, "W3": 0.15, "W4": 0.15, "W5": 0.10},
+    "reliability": {"W1": 0.25, "W2": 0.35, "W3": 0.15, "W4": 0.15, "W5": 0.10},
+    "standard": {"W1": 0.20, "W2": 0.20, "W3": 0.20, "W4": 0.20, "W5": 0.20},
+}
+
+
+def js_maturity_level(total_score):
+    """calculateMaturityLevel"""
+    if total_score >= 25:
+        return 5
+    if total_score >= 20:
+        return 4
+    if total_score >= 15:
+        return 3
+    if total_score >= 8:
+        return 2
+    return 1
+
+
+def js_standard_metrics(scores, criticality="standard"):
+    """calculateStandardMetrics построчно, как в index.html"""
+    total_score = scores["A"] + scores["B"] + scores["C"] + scores["D"] + scores["E"] + scores["F"]
+    normalized_score = total_score / 30
+
+    R = 1 - scores["A"] / 5
+    M = scores["C"] / 5
+    T = scores["B"] / 5
+    L = 1 - scores["D"] / 5
+
+    weights = JS_WEIGHTS[criticality]
+    influence = weights["W1"] * R + weights["W2"] * M + weights["W3"] * T + weights["W4"] * L
+    deterministic_tout = 6 - influence
+
+    lam = 0.15 * (1 + (1 - normalized_score))
+    probability3y = 1 - math.exp(-lam * 3)
+
+    if total_score >= 25:
+        recommendation = "Поддерживать, ревизия по плану"
+    elif total_score >= 20:
+        recommendation = "Актуализировать в течение 2-3 лет"
+    elif total_score >= 15:
+        recommendation = "Частичная актуализация в 1-2 года"
+    elif total_score >= 8:
+        recommendation = "Приоритетная ревизия в годовом плане"
+    else:
+        recommendation = "Утилизация или полная переработка"
+
+    return {"deterministicTout": deterministic_tout, "lambda": lam, "probability3y": probability3y,
+            "recommendation": recommendation, "R": R, "M": M, "T": T, "L": L}
+
+
+def random_scores(rng, n):
+    systems = [{key: rng.randint(0, 5) for key in calculator.CRITERIA} for _ in range(n)]
+    # Границы уровней зрелости и дробные оценки
+    systems += [dict(zip(calculator.CRITERIA, row)) for row in
+                [(0,) * 6, (5,) * 6, (5, 5, 5, 5, 5, 0), (4, 4, 4, 4, 4, 0), (5, 5, 5, 0, 0, 0),
+                 (2, 2, 2, 1, 1, 0), (2, 2, 2, 1, 0, 0), (2.5, 3.5, 4.25, 0.5, 1, 4)]]
+    return systems
+
+
+@pytest.mark.parametrize("criticality", calculator.CRITICALITIES)
+def test_evaluate_matches_js_model(criticality):
+    np = pytest.importorskip("numpy")
+    systems = random_scores(random.Random(criticality), 300)
+    scores = np.array([[system[key] for key in calculator.CRITERIA] for system in systems], dtype=float)
+    index = np.full(len(systems), calculator.CRITICALITIES.index(criticality))
+
+    result = calculator.evaluate(scores, index, 3)
+
+    for i, system in enumerate(systems):
+        expected = js_standard_metrics(system, criticality)
+        total = sum(system.values())
+        assert result["total"][i] == pytest.approx(total)
+        assert result["maturity"][i] == js_maturity_level(total)
+        assert calculator.RECOMMENDATIONS[int(result["maturity"][i])] == expected["recommendation"]
+        assert result["deterministic_tout"][i] == pytest.approx(expected["deterministicTout"], abs=1e-12)
+        assert result["lambda"][i] == pytest.approx(expected["lambda"], abs=1e-12)
+        assert result["probability"][i] == pytest.approx(expected["probability3y"], abs=1e-12)
+        assert result["factors"][i].tolist() == pytest.approx(
+            [expected["R"], expected["M"], expected["T"], expected["L"]], abs=1e-12)
+
+
+def test_batch_endpoint_matches_js_model(client):
+    pytest.importorskip("numpy")
+    systems = random_scores(random.Random(15), 40)
+    criticalities = [calculator.CRITICALITIES[i % 3] for i in range(len(systems))]
+    response = client.post("/api/calculator/batch", json={
+        "systems": [{"id": f"СТО-{i}", "scores": scores, "criticality": criticality}
+                    for i, (scores, criticality) in enumerate(zip(systems, criticalities))],
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == len(systems)
+
+    for i, item in enumerate(body["systems"]):
+        expected = js_standard_metrics(systems[i], criticalities[i])
+        assert item["id"] == f"СТО-{i}"
+        assert item["maturity_level"] == js_maturity_level(sum(systems[i].values()))
+        assert item["recommendation"] == expected["recommendation"]
+        assert item["deterministic_tout"] == pytest.approx(expected["deterministicTout"], abs=5e-4)
+        assert item["lambda"] == pytest.approx(expected["lambda"], abs=5e-5)
+        assert item["probability"] == pytest.approx(expected["probability3y"], abs=5e-5)
+
+
+def test_batch_endpoint_rejects_bad_input(client):
+    pytest.importorskip("numpy")
+    bad_score = client.post("/api/calculator/batch", json={"systems": [{"scores": {"A": 6}}]})
+    assert bad_score.status_code == 400
+    bad_criticality = client.post("/api/calculator/batch",
+                                  json={"systems": [{"scores": {"A": 1}}], "criticality": "unknown"})
+    assert bad_criticality.status_code == 400
+
+
+def test_batch_endpoint_derives_scores_from_details(client):
+    pytest.importorskip("numpy")
+    response = client.post("/api/calculator/batch", json={"do_id": 1, "include_systems": True})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] > 0
+    assert sum(body["summary"]["maturity_levels"].values()) == body["count"]
+    assert all(item["do_id"] == 1 for item in body["systems"])
+    assert all(0 <= value <= calculator.MAX_SCORE for item in body["systems"] for value in item["scores"].values())
@@ -0,0 +1,101 @@
+# Файл колоночного снимка: совпадает с загрузкой из SQL и делится между воркерами
+import itertools
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import columnar  # noqa: E402
+import database as db  # noqa: E402
+from columnar import ColumnStore, LOAD_SQL, NUMERIC_COLUMNS, STRING_COLUMNS, Snapshot, open_snapshot  # noqa: E402
+from schema import query_data_revision  # noqa: E402
+
+
+class FakeVersion:
+    """Версия данных, которая растет при каждой проверке: ColumnStore всегда сверяет ревизию"""
+
+    def __init__(self):
+        self._counter = itertools.count(1)
+
+    def check(self, force: bool = False):
+        return next(self._counter)
+
+
+@pytest.fixture
+def store(conn, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "data_version", FakeVersion())
+    return ColumnStore(str(tmp_path / "do_system.db.columns"))
+
+
+def values(snapshot, name):
+    if name in STRING_COLUMNS:
+        table = getattr(snapshot, name + "s")
+        return [None if code < 0 else table[code] for code in getattr(snapshot, name).tolist()]
+    return np.asarray(getattr(snapshot, name)).tolist()
+
+
+def assert_same(left, right):
+    assert len(left) == len(right)
+    for name, _, _ in NUMERIC_COLUMNS:
+        np.testing.assert_array_equal(getattr(left, name), getattr(right, name))
+    for name in STRING_COLUMNS:
+        assert values(left, name) == values(right, name)
+
+
+def from_sql(conn):
+    return Snapshot.from_rows(conn.execute(LOAD_SQL).fetchall(), 0)
+
+
+def test_file_matches_sql_load(written, store):
+    snapshot = store.snapshot(written.cursor())
+    assert snapshot.source == "mmap"
+    assert store.file_writes == 1
+    assert snapshot.revision == query_data_revision(written.cursor(), "sa_data_details")
+    assert_same(snapshot, from_sql(written))
+
+    details = dict(written.execute("SELECT id, detail_json FROM sa_data_details").fetchall())
+    assert [snapshot.detail_json(i) for i in range(len(snapshot))] == [details[i] for i in snapshot.id.tolist()]
+
+
+def test_second_worker_opens_the_file(conn, store):
+    store.snapshot(conn.cursor())
+    other = ColumnStore(store.path)
+    snapshot = other.snapshot(conn.cursor())
+    assert snapshot.source == "mmap"
+    assert other.file_writes == 0
+    assert_same(snapshot, from_sql(conn))
+
+
+def test_reload_only_on_detail_revision(conn, store):
+    first = store.snapshot(conn.cursor())
+
+    # Запись вне sa_data_details / sa_data / sa ревизию не меняет
+    conn.execute("UPDATE do SET name = name || '!' WHERE id = 1")
+    conn.commit()
+    assert store.snapshot(conn.cursor()) is first
+    assert store.loads == 1
+
+    conn.execute("DELETE FROM sa_data_details WHERE id IN (SELECT id FROM sa_data_details LIMIT 5)")
+    conn.commit()
+    second = store.snapshot(conn.cursor())
+    assert second is not first
+    assert store.file_writes == 2
+    assert len(second) == len(first) - 5
+    assert_same(second, from_sql(conn))
+
+
+def test_corrupt_or_foreign_file_is_ignored(conn, store):
+    with open(store.path, "wb") as f:
+        f.write(b"not a snapshot" * 10)
+    assert open_snapshot(store.path) is None
+    snapshot = store.snapshot(conn.cursor())
+    assert snapshot.source == "mmap"
+    assert store.file_writes == 1
+
+
+def test_empty_table(conn, store):
+    conn.execute("DELETE FROM sa_data_details")
+    conn.commit()
+    snapshot = store.snapshot(conn.cursor())
+    assert len(snapshot) == 0
+    assert snapshot.summaries(2024) == columnar.Snapshot.from_rows([], 0).summaries(2024)
@@ -0,0 +1,107 @@
+# Пул read-only соединений и выполнение запросов вне event loop
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import database as db
+from database import ConnectionPool, open_write_connection
+
+
+@pytest.fixture
+def pool(tmp_path):
+    path = str(tmp_path / "pool.db")
+    conn = open_write_connection(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    conn.close()
+    pool = ConnectionPool(path, size=2)
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused_and_bounded(pool):
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+            acquired = []
+            waiter = threading.Thread(target=lambda: acquired.append(pool._acquire()))
+            waiter.start()
+            waiter.join(0.2)
+            # Третьему потоку соединения нет, пока одно не вернется в пул
+            assert waiter.is_alive()
+        waiter.join(5)
+        assert acquired == [second]
+        pool._release(acquired[0])
+
+    with pool.connection() as again:
+        assert again in (first, second)
+    assert pool._created == 2
+
+
+def test_connections_are_read_only(pool):
+    with pool.connection() as conn:
+        assert conn.execute("SELECT x FROM t").fetchone()["x"] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO t VALUES (2)")
+
+
+def test_open_transaction_is_rolled_back(pool):
+    with pool.connection() as conn:
+        conn.execute("BEGIN")
+        conn.execute("SELECT x FROM t").fetchall()
+    assert not conn.in_transaction
+
+
+def test_writes_are_visible_to_pooled_readers(pool):
+    with pool.connection() as conn:
+        conn.execute("SELECT COUNT(*) FROM t").fetchone()
+    writer = open_write_connection(pool.path)
+    writer.execute("INSERT INTO t VALUES (2)")
+    writer.commit()
+    writer.close()
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+
+
+def test_close_drops_idle_connections(pool):
+    with pool.connection():
+        pass
+    assert pool._created == 1
+    pool.close()
+    assert pool._created == 0
+
+
+def test_run_does_not_block_event_loop(pool, monkeypatch):
+    monkeypatch.setattr(db, "pool", pool)
+
+    def slow_query(cursor):
+        time.sleep(0.2)
+        cursor.execute("SELECT COUNT(*) FROM t")
+        return threading.current_thread().name, cursor.fetchone()[0]
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        results = await asyncio.gather(db.run(slow_query), db.run(slow_query))
+        elapsed = time.monotonic() - started
+        task.cancel()
+        return results, elapsed, ticks
+
+    results, elapsed, ticks = asyncio.run(main())
+    assert all(name.startswith("sqlite") for name, _ in results)
+    assert results[0][1] == results[1][1] > 0
+    # Два запроса идут параллельно в потоках пула, loop тем временем работает
+    assert elapsed < 0.35
+    assert ticks >= 5
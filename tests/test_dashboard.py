@@ -0,0 +1,49 @@
+# /api/dashboard: разделы совпадают с отдельными эндпоинтами, ошибка раздела не ломает ответ
+import main
+
+SECTION_ENDPOINTS = {
+    "do_list": ("/api/do-list", {"include": "summary"}),
+    "dobycha_tech_objects": ("/api/analytics/dobycha/tech-objects", {}),
+    "transport_tech_objects": ("/api/analytics/transport/tech-objects", {}),
+    "age_stats": ("/api/analytics/age-stats", {}),
+    "transport_coverage": ("/api/analytics/transport/coverage-detailed", {}),
+    "import_stats": ("/api/import-substitution/stats", {}),
+    "import_systems": ("/api/import-substitution/systems", {}),
+}
+
+
+def test_sections_match_endpoints(client):
+    assert set(SECTION_ENDPOINTS) == set(main.DASHBOARD_SECTIONS)
+    body = client.get("/api/dashboard").json()
+    assert body["errors"] == {}
+    assert body["reference_year"] == 2024
+    for name, (path, params) in SECTION_ENDPOINTS.items():
+        assert body["sections"][name] == client.get(path, params=params).json(), name
+
+
+def test_selected_sections_and_reference_year(client):
+    body = client.get("/api/dashboard", params={"sections": "age_stats, do_list,age_stats",
+                                                "reference_year": 2030}).json()
+    assert list(body["sections"]) == ["age_stats", "do_list"]
+    assert body["sections"]["age_stats"] == client.get("/api/analytics/age-stats",
+                                                       params={"reference_year": 2030}).json()
+
+
+def test_unknown_section(client):
+    assert client.get("/api/dashboard", params={"sections": "do_list,weather"}).status_code == 400
+
+
+def test_failed_section_is_null_and_not_cached(client, monkeypatch):
+    async def failing(reference_year):
+        raise RuntimeError("сбой раздела")
+
+    monkeypatch.setitem(main.DASHBOARD_SECTIONS, "age_stats", failing)
+    response = client.get("/api/dashboard", params={"sections": "age_stats,import_stats"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["sections"]["age_stats"] is None
+    assert body["errors"] == {"age_stats": "сбой раздела"}
+    assert body["sections"]["import_stats"] is not None
+    assert response.headers["cache-control"] == "no-store"
+    assert "etag" not in response.headers
+
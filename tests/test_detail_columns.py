@@ -0,0 +1,27 @@
+# Материализованные поля detail_json: колонки, которые ведут триггеры, совпадают с json_extract
+from schema import DETAIL_FIELDS, ensure_detail_columns, field_expr
+
+
+def _mismatches(conn):
+    checks = " OR ".join(f"{column} IS NOT {field_expr(column)}" for column in DETAIL_FIELDS)
+    return conn.execute(f"SELECT id FROM sa_data_details WHERE {checks}").fetchall()
+
+
+def test_columns_match_json_after_migration(conn):
+    assert conn.execute("SELECT COUNT(*) FROM sa_data_details").fetchone()[0] > 0
+    assert _mismatches(conn) == []
+
+
+def test_columns_follow_writes(written):
+    assert _mismatches(written) == []
+    row = written.execute("SELECT system_type, install_year, wear, functionality FROM sa_data_details "
+                          "WHERE id = 1").fetchone()
+    assert row == ("АСПС КС", 2001, 71.0, 35.5)
+    # Строка из JSON приводится к типу колонки
+    row = written.execute("SELECT install_year, typeof(install_year) FROM sa_data_details "
+                          "WHERE object_name = 'УКПГ-5 Ёлкинская'").fetchone()
+    assert row == (2015, "integer")
+
+
+def test_migration_is_idempotent(conn):
+    assert ensure_detail_columns(conn) is False
@@ -0,0 +1,55 @@
+# /api/do-list?include=summary: сводки всех ДО одним ответом совпадают с исходным расчетом по строкам
+import sqlite3
+
+import pytest
+
+from schema import DB_PATH
+
+# Сводка ДО так, как ее считал исходный /api/do/{do_id}/summary - по detail_json каждой строки
+BASELINE_SQL = """
+    SELECT
+        COUNT(*),
+        AVG(CAST(json_extract(detail_json, '$."Функциональность, %"') AS REAL)),
+        AVG(? - CAST(json_extract(detail_json, '$."Год внедрения системы автоматизации"') AS INTEGER)),
+        SUM(CASE WHEN CAST(json_extract(detail_json, '$."Эксплуатационный износ"') AS REAL) > 70 THEN 1 ELSE 0 END),
+        COUNT(DISTINCT json_extract(detail_json, '$."Вид системы автоматизации"'))
+    FROM sa_data_details sdd
+    JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    JOIN sa s ON sd.sa_id = s.id
+    WHERE s.do_id = ?
+"""
+
+
+def baseline_summary(conn, do_id, reference_year):
+    total, automation, age, problems, types = conn.execute(BASELINE_SQL, (reference_year, do_id)).fetchone()
+    return {"total_systems": total, "automation_level": round(automation or 0, 1), "avg_age": round(age or 0, 1),
+            "problem_count": problems or 0, "system_types": types}
+
+
+@pytest.mark.parametrize("reference_year", [2024, 2030])
+def test_summaries_match_baseline(client, reference_year):
+    do_list = client.get("/api/do-list", params={"include": "summary", "reference_year": reference_year}).json()
+    assert len(do_list) == 35
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        for item in do_list:
+            expected = baseline_summary(conn, item["id"], reference_year)
+            summary = item["summary"]
+            assert summary["total_systems"] == expected["total_systems"]
+            assert summary["problem_count"] == expected["problem_count"]
+            assert summary["system_types"] == expected["system_types"]
+            assert summary["automation_level"] == pytest.approx(expected["automation_level"], abs=0.1)
+            assert summary["avg_age"] == pytest.approx(expected["avg_age"], abs=0.1)
+
+            single = client.get(f"/api/do/{item['id']}/summary", params={"reference_year": reference_year}).json()
+            assert single == summary
+    finally:
+        conn.close()
+
+
+def test_list_without_summary(client):
+    do_list = client.get("/api/do-list").json()
+    names = [item["name"] for item in do_list]
+    assert names == sorted(names)
+    assert all(set(item) == {"id", "name", "system_count"} for item in do_list)
+    assert sum(item["system_count"] for item in do_list) >= 70
@@ -0,0 +1,80 @@
+# /api/do/{do_id}/full-details: один проход по строкам ДО совпадает с прежними отдельными запросами
+import sqlite3
+
+import pytest
+
+from main import query_do_full_details
+
+FROM_DO = """
+    FROM sa_data_details sdd
+    JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    JOIN sa s ON sd.sa_id = s.id
+    WHERE s.do_id = ?
+"""
+
+
+def baseline(conn, do_id, reference_year):
+    """Разделы так, как их считали отдельные запросы до однопроходной версии"""
+    kpi = conn.execute(f"""
+        SELECT
+            COUNT(*) as total_systems,
+            AVG(sdd.functionality) as automation_level,
+            AVG(? - sdd.install_year) as avg_age,
+            SUM(CASE WHEN sdd.wear > 70 THEN 1 ELSE 0 END) as problem_count,
+            SUM(CASE WHEN sdd.functionality < 50 THEN 1 ELSE 0 END) as low_functionality_count
+        {FROM_DO}
+    """, (reference_year, do_id)).fetchone()
+    age_distribution = conn.execute(f"""
+        SELECT
+            CASE
+                WHEN ? - sdd.install_year <= 5 THEN '0-5 лет'
+                WHEN ? - sdd.install_year <= 10 THEN '6-10 лет'
+                WHEN ? - sdd.install_year <= 15 THEN '11-15 лет'
+                ELSE '16+ лет'
+            END as age_group,
+            COUNT(*) as count
+        {FROM_DO} AND sdd.install_year IS NOT NULL
+        GROUP BY age_group
+        ORDER BY age_group
+    """, (reference_year, reference_year, reference_year, do_id)).fetchall()
+    problem_systems = conn.execute(f"""
+        SELECT sdd.object_name, sdd.system_type, sdd.wear, sdd.functionality, sdd.install_year
+        {FROM_DO} AND (sdd.wear > 70 OR sdd.functionality < 50)
+        ORDER BY sdd.wear DESC, sdd.id
+        LIMIT 20
+    """, (do_id,)).fetchall()
+    system_stats = conn.execute(f"""
+        SELECT sdd.system_type, COUNT(*) as count
+        {FROM_DO}
+        GROUP BY sdd.system_type
+        ORDER BY count DESC, sdd.system_type IS NOT NULL, sdd.system_type
+    """, (do_id,)).fetchall()
+
+    return {
+        "kpi": {
+            "total_systems": kpi["total_systems"],
+            "automation_level": round(kpi["automation_level"] or 0, 1),
+            "avg_age": round(kpi["avg_age"] or 0, 1),
+            "problem_count": kpi["problem_count"] or 0,
+            "low_functionality_count": kpi["low_functionality_count"] or 0,
+        },
+        "age_distribution": [dict(row) for row in age_distribution],
+        "problem_systems": [dict(row) for row in problem_systems],
+        "system_stats": [dict(row) for row in system_stats],
+    }
+
+
+@pytest.mark.parametrize("reference_year", [2024, 2030])
+def test_single_pass_matches_queries(written, reference_year):
+    written.row_factory = sqlite3.Row
+    do_ids = [row[0] for row in written.execute("SELECT id FROM do ORDER BY id")]
+    assert do_ids
+    for do_id in do_ids:
+        details = query_do_full_details(written.cursor(), do_id, reference_year, backend="sql")
+        assert details["do_info"]["id"] == do_id
+        expected = baseline(written, do_id, reference_year)
+        assert {key: details[key] for key in expected} == expected, do_id
+
+
+def test_unknown_do(client):
+    assert client.get("/api/do/999999/full-details").status_code == 404
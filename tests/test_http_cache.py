@@ -0,0 +1,86 @@
+# HTTPCacheMiddleware: ETag/304, сжатие, заглушки без ETag, смена ETag при записи
+import sqlite3
+
+import pytest
+
+import database as db
+import main
+
+
+@pytest.fixture(autouse=True)
+def check_every_request(monkeypatch):
+    monkeypatch.setattr(db.data_version, "interval", 0)
+
+
+def test_etag_and_not_modified(client):
+    response = client.get("/api/do-list", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert "content-encoding" not in response.headers
+
+    cached = client.get("/api/do-list", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    # Другие параметры запроса - другой ETag
+    other = client.get("/api/do-list?include=summary", headers={"Accept-Encoding": "identity"})
+    assert other.headers["etag"] != etag
+    assert client.get("/api/do-list", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_gzip_variant_has_own_etag(client):
+    plain = client.get("/api/do-list", headers={"Accept-Encoding": "identity"})
+    response = client.get("/api/do-list", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    # httpx распаковывает сам; тело совпадает с несжатым
+    assert response.content == plain.content
+
+    cached = client.get("/api/do-list", headers={"Accept-Encoding": "gzip",
+                                                 "If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+
+def test_write_changes_etag(client):
+    etag = client.get("/api/do-list").headers["etag"]
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        conn.execute("UPDATE do SET name = name || ' ' WHERE id = 1")
+        conn.commit()
+        changed = client.get("/api/do-list", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["etag"] != etag
+    finally:
+        conn.execute("UPDATE do SET name = rtrim(name) WHERE id = 1")
+        conn.commit()
+        conn.close()
+
+
+def test_fallback_has_no_etag(client, monkeypatch):
+    def failing(*args):
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(main, "query_import_substitution_systems", failing)
+    response = client.get("/api/import-substitution/systems")
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+    assert response.headers["cache-control"] == "no-store"
+    assert "etag" not in response.headers
+
+
+@pytest.mark.parametrize("encoding", ["identity", "gzip"])
+def test_streamed_response_has_no_etag(client, encoding):
+    response = client.get("/api/do/1/tech-data", params={"year": 2022}, headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert response.json()["details"]
+    assert "etag" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+
+
+@pytest.mark.parametrize("path", ["/api/health", "/api/cache/stats", "/api/debug/backend-check"])
+def test_service_endpoints_have_no_etag(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert "etag" not in response.headers
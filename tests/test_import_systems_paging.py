@@ -0,0 +1,142 @@
+# Keyset-пагинация /api/import-substitution/systems: каждая строка ровно один раз, в порядке sort
+import sqlite3
+
+import pytest
+
+import database as db
+from main import encode_cursor
+
+JOINS = """
+    FROM sa_data_details sdd
+    JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    JOIN sa s ON sd.sa_id = s.id
+    JOIN do d ON s.do_id = d.id"""
+# Список всегда ограничен строками со статусом или этапом испытаний
+BASE = "(sdd.import_status IS NOT NULL OR sdd.test_stage IS NOT NULL)"
+# Порядок исходного списка - по ДО и системе
+ORDERS = {"name": "d.name, s.name, sdd.id", "id": "sdd.id"}
+
+
+def expected_rows(where: str = "1", params=(), sort: str = "name"):
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        return conn.execute(f"SELECT sdd.id, d.name, s.name {JOINS} WHERE {BASE} AND {where} "
+                            f"ORDER BY {ORDERS[sort]}", params).fetchall()
+    finally:
+        conn.close()
+
+
+def expected_ids(where: str = "1", params=(), sort: str = "name"):
+    return [row[0] for row in expected_rows(where, params, sort)]
+
+
+def fetch_all(client, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, limit=37)
+        if cursor:
+            query["cursor"] = cursor
+        response = client.get("/api/import-substitution/systems", params=query)
+        assert response.status_code == 200
+        body = response.json()
+        ids.extend(item["detail_id"] for item in body["items"])
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, body["total"], pages
+
+
+@pytest.mark.parametrize("sort", ["name", "id"])
+@pytest.mark.parametrize("params, where, args", [
+    ({}, "1", ()),
+    ({"import_status": "Замещено"}, "sdd.import_status = ?", ("Замещено",)),
+    ({"do_id": 13}, "s.do_id = ?", (13,)),
+])
+def test_pages_cover_every_row_once(client, params, where, args, sort):
+    expected = expected_ids(where, args, sort)
+    assert expected
+    ids, total, pages = fetch_all(client, **params, sort=sort)
+    assert ids == expected
+    assert total == len(expected)
+    assert pages == -(-len(expected) // 37)
+
+
+def test_default_order_is_by_do_and_system(client):
+    items = client.get("/api/import-substitution/systems", params={"limit": 50}).json()["items"]
+    keys = [(item["do_name"], item["system_name"], item["detail_id"]) for item in items]
+    assert keys == sorted(keys)
+    assert [item["detail_id"] for item in items] == expected_ids()[:50]
+
+
+@pytest.mark.parametrize("sort", ["name", "id"])
+def test_cursor_past_the_end(client, sort):
+    detail_id, do_name, system_name = expected_rows(sort=sort)[-1]
+    last = [do_name, system_name, detail_id] if sort == "name" else [detail_id]
+    response = client.get("/api/import-substitution/systems", params={"sort": sort, "cursor": encode_cursor(last)})
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+    assert response.json()["next_cursor"] is None
+
+
+@pytest.mark.parametrize("sort, cursor", [
+    ("name", "не base64!"),
+    ("name", encode_cursor([12])),
+    ("name", encode_cursor(["ДО", "Система", "12"])),
+    ("name", encode_cursor(["ДО", 1, 12])),
+    ("name", encode_cursor(["ДО", "Система", True])),
+    ("id", encode_cursor(["12"])),
+    ("id", encode_cursor([1, 2])),
+    ("id", encode_cursor([True])),
+    ("id", encode_cursor({"id": 1})),
+    ("id", encode_cursor(1.5)),
+])
+def test_malformed_cursor_is_rejected(client, sort, cursor):
+    response = client.get("/api/import-substitution/systems", params={"sort": sort, "cursor": cursor})
+    assert response.status_code == 400
+
+
+def test_unknown_sort_is_rejected(client):
+    assert client.get("/api/import-substitution/systems", params={"sort": "wear"}).status_code == 422
+
+
+@pytest.mark.parametrize("params, where, args", [
+    # ПЛК и SCADA - префикс значения колонки, с учетом регистра
+    ({"plc": "Siemens"}, "sdd.plc_type LIKE 'Siemens%'", ()),
+    ({"plc": "siemens"}, "0", ()),
+    ({"scada": "WinCC"}, "sdd.scada_type GLOB 'WinCC*'", ()),
+    ({"scada": "WinCC OA", "import_status": "Замещено"},
+     "sdd.scada_type = 'WinCC OA' AND sdd.import_status = ?", ("Замещено",)),
+])
+def test_plc_and_scada_prefix(client, params, where, args):
+    ids, total, _ = fetch_all(client, **params)
+    assert ids == expected_ids(where, args)
+    assert total == len(ids)
+
+
+def test_q_uses_search_index(client):
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        matched = {row[0] for row in conn.execute(
+            "SELECT rowid FROM sdd_search WHERE sdd_search MATCH '\"укпг\"* \"элес\"*'")}
+    finally:
+        conn.close()
+    assert matched
+    # Слова - префиксы в любых индексируемых колонках, регистр не важен
+    ids, total, _ = fetch_all(client, q="Укпг ЭЛЕС")
+    assert set(ids) == matched and len(ids) == len(matched)
+    assert ids == [row_id for row_id in expected_ids() if row_id in matched]
+    assert total == len(ids)
+    assert fetch_all(client, q="!!!")[:2] == ([], 0)
+
+
+def test_filters_use_indexes():
+    from main import import_systems_filter
+
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        for filters, index in (((("plc", "Siemens"),), "idx_sdd_plc_type"), ((("q", "укпг"),), "sdd_search")):
+            where, params = import_systems_filter(filters)
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN SELECT sdd.id {JOINS} WHERE {where}", params)]
+            assert any(index in step for step in plan) and "SCAN sdd" not in plan, plan
+    finally:
+        conn.close()
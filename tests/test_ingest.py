@@ -0,0 +1,154 @@
+# Пакетная загрузка: --replace, отклонение строк, форматы, CLI и POST /api/ingest
+import io
+import json
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import main
+from ingest import ingest
+from schema import rebuild_rollups
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def jsonl(*records) -> io.BytesIO:
+    return io.BytesIO("\n".join(json.dumps(record, ensure_ascii=False) for record in records).encode())
+
+
+def record(object_name, **extra):
+    return {"sa_id": 1, "year": 2022, "Наименование объекта": object_name,
+            "Год внедрения системы автоматизации": "2010", "Эксплуатационный износ": "40 %", **extra}
+
+
+def report_rows(conn, sa_id=1, year=2022):
+    return conn.execute("""
+        SELECT sdd.object_name, sdd.install_year, sdd.wear, sdd.import_status
+        FROM sa_data_details sdd JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        WHERE sd.sa_id = ? AND sd.year = ?
+        ORDER BY sdd.id
+    """, (sa_id, year)).fetchall()
+
+
+def other_rows(conn):
+    return conn.execute("""
+        SELECT sdd.id, sdd.detail_json FROM sa_data_details sdd JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        WHERE NOT (sd.sa_id = 1 AND sd.year = 2022) ORDER BY sdd.id
+    """).fetchall()
+
+
+def rollup(conn):
+    return conn.execute("SELECT do_id, dimension, bucket, count FROM detail_rollup ORDER BY 1, 2, 3").fetchall()
+
+
+def test_replace_swaps_rows_of_the_report(conn):
+    before = report_rows(conn)
+    untouched = other_rows(conn)
+    assert before
+
+    source = jsonl(record("Зеленодольск 1", import_status="Замещено"), record("Зеленодольск 2"))
+    report = ingest(conn, [("a.jsonl", source, None)], replace=True)
+
+    assert report["written"] == 2
+    assert report["deleted"] == len(before)
+    assert report["rejected"] == 0
+    assert report_rows(conn) == [("Зеленодольск 1", 2010, 40.0, "Замещено"),
+                                  ("Зеленодольск 2", 2010, 40.0, None)]
+    assert other_rows(conn) == untouched
+
+    # Производные таблицы обновлены триггерами в той же загрузке
+    maintained = rollup(conn)
+    rebuild_rollups(conn)
+    assert maintained == rollup(conn)
+    found = conn.execute("SELECT COUNT(*) FROM sdd_search WHERE sdd_search MATCH 'зеленодольск'").fetchone()
+    assert found == (2,)
+
+
+def test_replace_clears_each_report_once_across_batches(conn):
+    records = [record(f"Объект {i}") for i in range(7)]
+    report = ingest(conn, [("a.jsonl", jsonl(*records), "jsonl")], replace=True, batch_size=2)
+    assert report["written"] == 7
+    assert [row[0] for row in report_rows(conn)] == [f"Объект {i}" for i in range(7)]
+
+
+def test_without_replace_rows_are_appended(conn):
+    before = report_rows(conn)
+    report = ingest(conn, [("a.jsonl", jsonl(record("Объект 1")), None)])
+    assert report["deleted"] == 0
+    assert report_rows(conn) == before + [("Объект 1", 2010, 40.0, None)]
+
+
+def test_invalid_rows_are_rejected_and_the_rest_loaded(conn):
+    source = jsonl(
+        record("Хороший"),
+        record("Плохой статус", import_status="Готово"),
+        record("Будущее", **{"Год внедрения системы автоматизации": "2999"}),
+        {"Наименование объекта": "Без системы", "year": 2022},
+        record("Без года", year=None),
+    )
+    source = io.BytesIO(source.getvalue() + b"\n{not json}\n")
+    report = ingest(conn, [("a.jsonl", source, None)], replace=True)
+    assert report["read"] == 6
+    assert report["written"] == 1
+    assert report["rejected"] == 5
+    assert [error["line"] for error in report["errors"]] == [2, 3, 4, 5, 6]
+    # Отклоненные строки не мешают замене: остается только принятая
+    assert [row[0] for row in report_rows(conn)] == ["Хороший"]
+
+
+def test_csv_with_semicolons_and_decimal_commas(conn):
+    source = io.BytesIO(
+        "sa_id;year;Наименование объекта;Эксплуатационный износ;Функциональность, %\n"
+        "1;2022;КС «Северная»;45,5;н/д\n".encode("utf-8-sig")
+    )
+    report = ingest(conn, [("report.csv", source, None)], replace=True)
+    assert report["written"] == 1
+    assert conn.execute("SELECT object_name, wear, functionality FROM sa_data_details "
+                        "WHERE object_name = 'КС «Северная»'").fetchone() == ("КС «Северная»", 45.5, None)
+
+
+def test_cli_replace(conn, tmp_path):
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    conn.close()
+    source = tmp_path / "report.jsonl"
+    source.write_bytes(jsonl(record("Из CLI")).getvalue())
+
+    result = subprocess.run([sys.executable, str(ROOT / "ingest.py"), str(source), "--db", path, "--replace",
+                             "--json"], capture_output=True, text=True, cwd=ROOT, timeout=60)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    assert report["written"] == 1
+    assert report["deleted"] > 0
+
+    check = sqlite3.connect(path)
+    try:
+        assert [row[0] for row in report_rows(check)] == ["Из CLI"]
+    finally:
+        check.close()
+
+
+def test_api_requires_token_and_content_type(client, monkeypatch):
+    body = jsonl(record("Через API", sa_id=2)).getvalue()
+    headers = {"Content-Type": "application/x-ndjson", "X-Ingest-Token": "test-token"}
+
+    def post(**overrides):
+        return client.post("/api/ingest", content=body, headers={**headers, **overrides}).status_code
+
+    assert post(**{"X-Ingest-Token": "wrong"}) == 401
+    assert client.post("/api/ingest", content=body, headers={"Content-Type": "application/x-ndjson"}).status_code == 401
+    # "Простой" Content-Type, который браузер отправил бы без preflight
+    assert post(**{"Content-Type": "text/plain"}) == 415
+
+    response = client.post("/api/ingest", content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["written"] == 1
+
+    monkeypatch.setattr(main, "INGEST_TOKEN", "")
+    assert post() == 403
+
+
+def test_api_reports_bad_format(client):
+    response = client.post("/api/ingest", params={"filename": "report.pdf"}, content=b"x",
+                           headers={"Content-Type": "application/octet-stream", "X-Ingest-Token": "test-token"})
+    assert response.status_code == 400
@@ -0,0 +1,64 @@
+# Метрики: журнал самых медленных запросов, учет SQL по запросу, /api/metrics
+import random
+import sqlite3
+import time
+
+import metrics
+from metrics import RequestStats, SlowQueryLog, TracedCursor
+
+
+def test_slow_query_log_keeps_the_slowest():
+    log = SlowQueryLog(size=5)
+    durations = list(range(1, 101))
+    random.Random(13).shuffle(durations)
+    for duration in durations:
+        if log.admits(duration):
+            log.add({"duration_ms": duration})
+    assert [entry["duration_ms"] for entry in log.entries()] == [100, 99, 98, 97, 96]
+    assert not log.admits(96)
+    assert log.admits(96.5)
+    # Всплеск умеренно медленных запросов не вытесняет выбросы
+    for _ in range(50):
+        log.add({"duration_ms": 50})
+    assert len(log) == 5
+    assert log.entries()[-1]["duration_ms"] == 96
+
+
+def test_traced_cursor_counts_statements_and_logs_slow_ones(monkeypatch):
+    log = SlowQueryLog(size=3, threshold=0.01)
+    monkeypatch.setattr(metrics, "slow_queries", log)
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("pause", 1, lambda seconds: time.sleep(seconds) or 0)
+    conn.execute("CREATE TABLE t (x INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+
+    stats = RequestStats("/api/test")
+    token = metrics.current_request.set(stats)
+    try:
+        cursor = TracedCursor(conn.cursor())
+        cursor.execute("SELECT x FROM t WHERE x < ?", (5,))
+        assert len(cursor.fetchall()) == 5
+        cursor.execute("SELECT pause(0.02) FROM t WHERE x = ?", (1,))
+        assert cursor.fetchone() == (0,)
+        cursor.close()
+    finally:
+        metrics.current_request.reset(token)
+        conn.close()
+
+    assert stats.statements == 2
+    assert stats.rows == 6
+    entries = log.entries()
+    assert len(entries) == 1
+    assert entries[0]["endpoint"] == "/api/test"
+    assert entries[0]["params"] == [1]
+    assert entries[0]["duration_ms"] >= 20
+    assert any("t" in step for step in entries[0]["plan"])
+
+
+def test_metrics_endpoint_groups_by_route_template(client):
+    client.get("/api/do/1/systems")
+    client.get("/api/do/2/systems")
+    text = client.get("/api/metrics").text
+    assert 'endpoint="/api/do/{do_id}/systems"' in text
+    assert "/api/do/1/systems" not in text
+    assert 'sado_sql_statements_total{endpoint="/api/do/{do_id}/systems"}' in text
@@ -0,0 +1,47 @@
+# optimizer.py: недостающие индексы, ANALYZE и планы запросов API без полных сканов
+import sqlite3
+
+from optimizer import OPTIMIZER_INDEXES, PLAN_QUERIES, SUPERSEDED_INDEXES, optimize, query_plans
+
+
+def indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_optimize_creates_indexes_and_removes_scans(conn):
+    conn.execute("CREATE INDEX idx_automation_summary_do_year ON automation_summary(do_id, year)")
+    conn.commit()
+
+    report = optimize(conn)
+    assert report["created_indexes"] == list(OPTIMIZER_INDEXES)
+    assert report["analyzed"] is True
+    assert set(OPTIMIZER_INDEXES) <= indexes(conn)
+    assert not indexes(conn) & set(SUPERSEDED_INDEXES)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+
+    # Запросы по ДО читают sa_data_details по индексу, а не полным сканом
+    assert "sdd" in report["scan_to_search"]["do_full_details"]
+    assert report["remaining_scans"] == {}
+    assert all(plan is not None for plan in report["plans"].values())
+
+
+def test_second_run_changes_nothing(conn):
+    first = optimize(conn)
+    second = optimize(conn)
+    assert second["created_indexes"] == []
+    assert second["analyzed"] is False
+    assert second["scan_to_search"] == {}
+    assert second["plans"] == first["plans"]
+
+
+def test_missing_tables_are_skipped(tmp_path):
+    conn = sqlite3.connect(tmp_path / "bare.db")
+    try:
+        conn.execute("CREATE TABLE sa (id INTEGER PRIMARY KEY, do_id INTEGER, sa_type INTEGER, name TEXT)")
+        report = optimize(conn)
+        assert report["created_indexes"] == ["idx_sa_do_id"]
+        plans = query_plans(conn)
+        assert set(plans) == set(PLAN_QUERIES)
+        assert plans["do_full_details"] is None
+    finally:
+        conn.close()
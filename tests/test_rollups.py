@@ -0,0 +1,100 @@
+# detail_rollup: разница, которую применяют триггеры, совпадает с полным пересчетом
+import pytest
+
+from schema import rebuild_rollups
+
+
+def rollup(conn):
+    return conn.execute("SELECT do_id, dimension, bucket, count, sum FROM detail_rollup "
+                        "ORDER BY do_id, dimension, bucket").fetchall()
+
+
+def assert_matches_rebuild(conn):
+    maintained = rollup(conn)
+    rebuild_rollups(conn)
+    expected = rollup(conn)
+    assert [row[:4] for row in maintained] == [row[:4] for row in expected]
+    # Суммы накапливаются по строке - допускается погрешность округления
+    assert [row[4] for row in maintained] == pytest.approx([row[4] for row in expected])
+
+
+def test_rollup_after_migration(conn):
+    assert_matches_rebuild(conn)
+
+
+def test_rollup_follows_writes(written):
+    assert_matches_rebuild(written)
+
+
+def test_import_status_buckets(written):
+    rebuild_rollups(written)
+    buckets = dict(written.execute("""
+        SELECT bucket, SUM(count) FROM detail_rollup WHERE dimension = 'import_status' GROUP BY bucket
+    """).fetchall())
+    expected = dict(written.execute("""
+        SELECT CASE WHEN import_status IS NULL THEN '' ELSE ':' || import_status END, COUNT(*)
+        FROM sa_data_details GROUP BY 1
+    """).fetchall())
+    assert buckets == expected
+    # Пустая строка в import_status не смешивается с NULL
+    assert buckets[":"] == 2
+    assert "" in buckets
+
+
+def test_rows_without_do_are_counted_under_zero(written):
+    total, = written.execute("SELECT count FROM detail_rollup WHERE do_id = 0 AND dimension = 'total'").fetchone()
+    assert total == 1
+    written.execute("DELETE FROM sa_data_details WHERE sa_data_id = 999999")
+    written.commit()
+    assert written.execute("SELECT COUNT(*) FROM detail_rollup WHERE do_id = 0").fetchone()[0] == 0
+    assert_matches_rebuild(written)
+
+
+def test_rollup_follows_system_move(written):
+    sa_id, do_id = written.execute("""
+        SELECT s.id, s.do_id FROM sa s WHERE EXISTS (
+            SELECT 1 FROM sa_data sd JOIN sa_data_details sdd ON sdd.sa_data_id = sd.id WHERE sd.sa_id = s.id)
+        ORDER BY s.id LIMIT 1
+    """).fetchone()
+    moved, = written.execute("""
+        SELECT COUNT(*) FROM sa_data_details sdd JOIN sa_data sd ON sdd.sa_data_id = sd.id WHERE sd.sa_id = ?
+    """, (sa_id,)).fetchone()
+    target = written.execute("SELECT MAX(id) FROM do").fetchone()[0]
+    assert target != do_id
+    before = dict(written.execute("SELECT do_id, count FROM detail_rollup WHERE dimension = 'total'").fetchall())
+
+    written.execute("UPDATE sa SET do_id = ? WHERE id = ?", (target, sa_id))
+    written.commit()
+    after = dict(written.execute("SELECT do_id, count FROM detail_rollup WHERE dimension = 'total'").fetchall())
+    assert after.get(do_id, 0) == before[do_id] - moved
+    assert after[target] == before.get(target, 0) + moved
+    assert_matches_rebuild(written)
+
+
+def test_rollup_follows_report_moves(written):
+    sa_data_id, = written.execute("SELECT MIN(sa_data_id) FROM sa_data_details").fetchone()
+    other_sa = written.execute("""
+        SELECT s.id FROM sa s WHERE s.do_id <> (
+            SELECT s2.do_id FROM sa_data sd JOIN sa s2 ON sd.sa_id = s2.id WHERE sd.id = ?)
+        ORDER BY s.id LIMIT 1
+    """, (sa_data_id,)).fetchone()[0]
+    written.execute("UPDATE sa_data SET sa_id = ? WHERE id = ?", (other_sa, sa_data_id))
+    written.commit()
+    assert_matches_rebuild(written)
+
+    # Система без ДО, удаление отчета и системы: их строки переходят под do_id = 0
+    written.execute("UPDATE sa SET do_id = NULL WHERE id = ?", (other_sa,))
+    written.execute("DELETE FROM sa_data WHERE id = (SELECT MAX(sa_data_id) FROM sa_data_details "
+                    "WHERE sa_data_id IN (SELECT id FROM sa_data))")
+    written.execute("DELETE FROM sa WHERE id = (SELECT MAX(sa_id) FROM sa_data)")
+    written.commit()
+    assert_matches_rebuild(written)
+
+    # Отчет, на который уже ссылаются строки, появляется позже них
+    orphans = "SELECT count FROM detail_rollup WHERE do_id = 0 AND dimension = 'total'"
+    before, = written.execute(orphans).fetchone()
+    written.execute("INSERT INTO sa_data (id, sa_id, year) "
+                    "VALUES (999999, (SELECT MIN(id) FROM sa WHERE do_id IS NOT NULL), 2023)")
+    written.commit()
+    assert written.execute(orphans).fetchone() == (before - 1,)
+    assert_matches_rebuild(written)
@@ -0,0 +1,143 @@
+# run_cached: один расчет на одновременные промахи, сброс при изменении БД, отмена считающего запроса
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import database as db
+from cache import TTLCache, _MISSING, response_cache, run_cached
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    # Версия данных перепроверяется на каждом вызове, а не раз в секунду
+    monkeypatch.setattr(db.data_version, "interval", 0)
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
+def counting_query(delay: float = 0.0):
+    calls = []
+    lock = threading.Lock()
+
+    def query_probe(cursor, value):
+        with lock:
+            calls.append(value)
+        time.sleep(delay)
+        cursor.execute("SELECT ?", (value,))
+        return cursor.fetchone()[0]
+
+    return query_probe, calls
+
+
+def test_concurrent_misses_compute_once():
+    query, calls = counting_query(delay=0.1)
+
+    async def scenario():
+        return await asyncio.gather(*(run_cached(query, 7) for _ in range(10)))
+
+    assert asyncio.run(scenario()) == [7] * 10
+    assert calls == [7]
+
+    # Повторный вызов - из кэша; другие параметры - другой ключ
+    assert asyncio.run(run_cached(query, 7)) == 7
+    assert asyncio.run(run_cached(query, 8)) == 8
+    assert calls == [7, 8]
+
+
+def test_write_invalidates_cache():
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache_probe (value INTEGER)")
+    conn.execute("DELETE FROM cache_probe")
+    conn.execute("INSERT INTO cache_probe VALUES (1)")
+    conn.commit()
+    calls = []
+
+    def query_cache_probe(cursor):
+        calls.append(1)
+        cursor.execute("SELECT SUM(value) FROM cache_probe")
+        return cursor.fetchone()[0]
+
+    try:
+        assert asyncio.run(run_cached(query_cache_probe)) == 1
+        assert asyncio.run(run_cached(query_cache_probe)) == 1
+        assert len(calls) == 1
+
+        conn.execute("INSERT INTO cache_probe VALUES (2)")
+        conn.commit()
+        assert asyncio.run(run_cached(query_cache_probe)) == 3
+        assert len(calls) == 2
+    finally:
+        conn.execute("DROP TABLE cache_probe")
+        conn.commit()
+        conn.close()
+
+
+def test_errors_reach_waiters_and_are_not_cached():
+    calls = []
+
+    def query_failing(cursor):
+        calls.append(1)
+        time.sleep(0.05)
+        raise RuntimeError("сбой")
+
+    async def scenario():
+        return await asyncio.gather(*(run_cached(query_failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 1
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_cached(query_failing))
+    assert len(calls) == 2
+
+
+def test_cancelled_leader_does_not_strand_waiters():
+    query, calls = counting_query(delay=0.2)
+
+    async def scenario():
+        leader = asyncio.create_task(run_cached(query, 1))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(run_cached(query, 1))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        result = await asyncio.wait_for(waiter, timeout=5)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return result
+
+    # Ожидающий пересчитывает результат сам
+    assert asyncio.run(scenario()) == 1
+    assert calls == [1, 1]
+
+
+def test_cancelled_waiter_does_not_affect_leader():
+    query, calls = counting_query(delay=0.2)
+
+    async def scenario():
+        leader = asyncio.create_task(run_cached(query, 2))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(run_cached(query, 2))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(scenario()) == 2
+    assert calls == [2]
+
+
+def test_ttl_cache_drops_entries_on_new_version():
+    cache = TTLCache(maxsize=2)
+    cache.get("a", 1)
+    cache.set("a", "A", 1)
+    cache.set("b", "B", 1)
+    cache.set("c", "C", 1)
+    assert cache.get("a", 1) is _MISSING   # вытеснен (LRU)
+    assert cache.get("c", 1) == "C"
+    assert cache.get("c", 2) is _MISSING   # новая версия данных
+    assert cache.stats()["invalidations"] == 1
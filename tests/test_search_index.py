@@ -0,0 +1,74 @@
+# sdd_search: индекс, который ведут триггеры, совпадает с построенным заново; /api/search
+import sqlite3
+
+import pytest
+
+import database as db
+from main import fts_query
+from schema import ensure_search_index
+
+
+def index_terms(conn):
+    conn.execute("CREATE VIRTUAL TABLE temp.sdd_search_terms USING fts5vocab(main, sdd_search, 'instance')")
+    rows = conn.execute("SELECT term, doc, col, offset FROM temp.sdd_search_terms ORDER BY 1, 2, 3, 4").fetchall()
+    conn.execute("DROP TABLE temp.sdd_search_terms")
+    return rows
+
+
+def test_index_matches_rebuild_after_writes(written):
+    maintained = index_terms(written)
+    assert maintained
+    written.execute("DROP TABLE sdd_search")
+    written.commit()
+    assert ensure_search_index(written) is True
+    assert maintained == index_terms(written)
+
+
+def test_updated_and_deleted_rows_leave_the_index(written):
+    def found(text):
+        return [row[0] for row in written.execute("SELECT rowid FROM sdd_search WHERE sdd_search MATCH ?",
+                                                  (fts_query(text),))]
+
+    assert found("Пуровская") == [1]
+    assert found("wincc пуров") == [1]
+    # ё и е не различаются
+    assert found("елкинская") == found("Ёлкинская") != []
+    # Прежняя карточка строки 1 и удаленные строки не находятся
+    assert found("Объект 1") and 1 not in found("Объект 1")
+    assert not {7, 8, 9} & set(found("Объект"))
+
+
+def test_fts_query_quotes_user_syntax():
+    assert fts_query("АСУ ТП") == '"асу"* "тп"*'
+    assert fts_query("NEAR(a b) OR c*", prefix=False) == '"near" "a" "b" "or" "c"'
+    assert fts_query("  ,.;") is None
+
+
+def test_search_endpoint(client):
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        expected = conn.execute("""
+            SELECT COUNT(*) FROM sa_data_details sdd JOIN sa_data sd ON sdd.sa_data_id = sd.id
+            JOIN sa s ON sd.sa_id = s.id WHERE sdd.do_name LIKE '%Ямбург%'
+        """).fetchone()[0]
+    finally:
+        conn.close()
+    assert expected > 0
+
+    body = client.get("/api/search", params={"q": "ямбург", "limit": 5}).json()
+    assert body["total"] == expected
+    assert len(body["items"]) == min(5, expected)
+    assert all("Ямбург" in item["do_name"] for item in body["items"])
+    scores = [item["score"] for item in body["items"]]
+    assert scores == sorted(scores, reverse=True)
+    assert body["facets"]["do"] == [{"do_id": 1, "do_name": body["items"][0]["do_name"], "count": expected}]
+
+    # Фасет по статусу считается без собственного фильтра
+    filtered = client.get("/api/search", params={"q": "ямбург", "import_status": "Не указан"}).json()
+    assert all(item["import_status"] is None for item in filtered["items"])
+    assert sum(item["count"] for item in filtered["facets"]["import_status"]) == expected
+
+
+@pytest.mark.parametrize("q", ["", "x" * 201])
+def test_search_validates_query(client, q):
+    assert client.get("/api/search", params={"q": q}).status_code == 422
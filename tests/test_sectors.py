@@ -0,0 +1,76 @@
+# Аналитика секторов: один проход по реестру do_sector совпадает с подсчетом по строкам
+import sqlite3
+
+import pytest
+
+import main
+from main import SECTOR_OBJECT_COUNTERS, query_sector_analytics
+from schema import SECTORS, ensure_sector_registry
+
+EXPECTED_SQL = """
+    SELECT
+        COUNT(*),
+        {counters}
+    FROM sa_data_details sdd
+    JOIN sa_data sd ON sdd.sa_data_id = sd.id
+    JOIN sa s ON sd.sa_id = s.id
+    WHERE s.do_id = ?
+"""
+
+
+def expected_by_do(conn, do_id):
+    codes = dict(conn.execute("SELECT name, code FROM system_categories").fetchall())
+    counters = ", ".join(f"SUM(CASE WHEN sdd.system_category & {1 << codes[category]} THEN 1 ELSE 0 END)"
+                         for category in SECTOR_OBJECT_COUNTERS.values())
+    total, *values = conn.execute(EXPECTED_SQL.format(counters=counters), (do_id,)).fetchone()
+    return {"object_count": total, **{field: value or 0 for field, value in zip(SECTOR_OBJECT_COUNTERS, values)}}
+
+
+def analytics(conn):
+    conn.row_factory = sqlite3.Row
+    try:
+        return query_sector_analytics(conn.cursor())
+    finally:
+        conn.row_factory = None
+
+
+def assert_matches_rows(conn, sectors):
+    registry = conn.execute("SELECT ds.sector, ds.do_id, d.name FROM do_sector ds JOIN do d ON d.id = ds.do_id "
+                            "ORDER BY ds.sector, d.name").fetchall()
+    for sector, do_id, do_name in registry:
+        expected = expected_by_do(conn, do_id)
+        by_do = {row["do_name"]: row for row in sectors[sector]["by_do"]}
+        if expected["object_count"] == 0:
+            assert do_name not in by_do
+            continue
+        assert {field: by_do[do_name][field] for field in expected} == expected, (sector, do_name)
+
+    for sector in sectors.values():
+        for field in ("object_count", *SECTOR_OBJECT_COUNTERS):
+            assert sector[field] == sum(row[field] for row in sector["by_do"])
+
+
+def test_sectors_match_rows(written):
+    sectors = analytics(written)
+    assert set(SECTORS) <= set(sectors)
+    assert sectors["dobycha"]["do_ids"] == sorted(SECTORS["dobycha"][1])
+    assert_matches_rows(written, sectors)
+
+
+def test_registry_edits_survive_migration(conn):
+    conn.execute("UPDATE do_sector SET sector = 'pererabotka' WHERE do_id = 1")
+    conn.commit()
+    assert ensure_sector_registry(conn) is False
+    sectors = analytics(conn)
+    assert 1 in sectors["pererabotka"]["do_ids"]
+    assert 1 not in sectors["dobycha"]["do_ids"]
+    assert_matches_rows(conn, sectors)
+
+
+@pytest.mark.parametrize("sector, fields", main.SECTOR_TECH_OBJECT_FIELDS.items())
+def test_tech_objects_are_slices_of_sectors(client, sector, fields):
+    sectors = client.get("/api/analytics/sectors").json()
+    expected = [{"do_name": row["do_name"], "object_count": row["object_count"],
+                 **{field: row[field] for field in fields}}
+                for row in sectors[sector]["by_do"]]
+    assert client.get(f"/api/analytics/{sector}/tech-objects").json() == expected
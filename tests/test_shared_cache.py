@@ -0,0 +1,160 @@
+# SharedCache: общий для воркеров кэш результатов в файле SQLite
+import os
+import sqlite3
+import stat
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import cache
+from cache import SharedCache, _MISSING, _PENDING
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_claim_wait_and_store(tmp_path):
+    path = str(tmp_path / "results.cache")
+    first, second = SharedCache(path), SharedCache(path)
+    key = ("query_age_stats", 2024)
+    try:
+        assert first.get(key, "s1") is _MISSING
+        assert first.claim(key, "s1") is True
+        # Другой воркер видит заявку и ждет, а не считает сам
+        assert second.get(key, "s1") is _PENDING
+        assert second.claim(key, "s1") is False
+
+        first.set(key, {"Аналитика": [1, 2.5, None]}, "s1")
+        assert second.get(key, "s1") == {"Аналитика": [1, 2.5, None]}
+        # Другой отпечаток БД - запись устарела
+        assert second.get(key, "s2") is _MISSING
+        assert second.claim(key, "s2") is True
+    finally:
+        first.close()
+        second.close()
+
+
+def test_release_and_eviction(tmp_path):
+    cache = SharedCache(str(tmp_path / "results.cache"), maxsize=2)
+    try:
+        assert cache.claim("a", "s")
+        cache.release("a", "s")
+        assert cache.get("a", "s") is _MISSING
+
+        for key in ("a", "b", "c"):
+            cache.set(key, key.upper(), "s")
+        assert cache.evictions == 1
+        assert cache.stats()["entries"] == 2
+        assert cache.get("c", "s") == "C"
+
+        cache.clear()
+        assert cache.get("c", "s") is _MISSING
+    finally:
+        cache.close()
+
+
+def test_broken_file_is_a_miss(tmp_path):
+    path = tmp_path / "results.cache"
+    path.write_bytes(b"not a database" * 100)
+    cache = SharedCache(str(path))
+    try:
+        assert cache.get("a", "s") is _MISSING
+        assert cache.claim("a", "s") is True
+        assert cache.errors >= 2
+    finally:
+        cache.close()
+
+
+def test_values_are_json_in_private_file(tmp_path):
+    path = tmp_path / "results.cache"
+    cache = SharedCache(str(path))
+    try:
+        cache.set("a", {"ДО": [1, None]}, "s")
+        # Значения, которые JSON не сохраняет как есть, в общий кэш не попадают
+        cache.set("b", (1, 2), "s")
+        cache.set("c", {2024: 1}, "s")
+        cache.set("d", object(), "s")
+        assert cache.get("a", "s") == {"ДО": [1, None]}
+        assert [cache.get(key, "s") for key in "bcd"] == [_MISSING] * 3
+    finally:
+        cache.close()
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT value FROM results").fetchall() == [('{"ДО":[1,null]}'.encode(),)]
+    finally:
+        conn.close()
+
+
+def test_non_json_entry_is_dropped(tmp_path):
+    path = str(tmp_path / "results.cache")
+    cache = SharedCache(path)
+    try:
+        cache.set("a", 1, "s")
+        # Запись прежнего формата (pickle) не загружается и не мешает новой заявке
+        cache._connect().execute("UPDATE results SET value = ?", (b"\x80\x04K\x01.",))
+        assert cache.get("a", "s") is _MISSING
+        assert cache.claim("a", "s") is True
+    finally:
+        cache.close()
+
+
+def test_default_path_is_private(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    path = cache.default_shared_cache_path(str(tmp_path / "data" / "do_system.db"))
+    assert path.startswith(str(tmp_path / "do-dashboard") + os.sep)
+    assert path != cache.default_shared_cache_path(str(tmp_path / "other" / "do_system.db"))
+    monkeypatch.setattr(cache, "default_shared_cache_path", lambda: path)
+
+    shared = SharedCache(path)
+    try:
+        shared.set("a", 1, "s")
+        assert shared.get("a", "s") == 1
+    finally:
+        shared.close()
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+
+    # Каталог, открытый другим, не используется: кэш работает как промах
+    os.chmod(os.path.dirname(path), 0o777)
+    shared = SharedCache(path)
+    try:
+        assert shared.get("a", "s") is _MISSING
+        assert shared.errors == 1
+    finally:
+        shared.close()
+
+
+def test_disabled_cache():
+    cache = SharedCache("")
+    assert cache.enabled is False
+    cache.clear()
+    assert cache.stats()["entries"] is None
+
+
+WORKER = textwrap.dedent("""
+    import asyncio, os, sys, time
+    sys.path.insert(0, sys.argv[1])
+    from cache import run_cached, shared_cache
+
+    def query_shared_probe(cursor):
+        with open(os.environ["PROBE_LOG"], "a") as f:
+            f.write("x")
+        time.sleep(0.3)
+        cursor.execute("SELECT COUNT(*) FROM sa_data_details")
+        return cursor.fetchone()[0]
+
+    print(asyncio.run(run_cached(query_shared_probe)))
+    shared_cache.close()
+""")
+
+
+def test_workers_compute_once(tmp_path):
+    log = tmp_path / "computed.log"
+    env = dict(os.environ, DO_SHARED_CACHE_PATH=str(tmp_path / "results.cache"), PROBE_LOG=str(log))
+    workers = [subprocess.Popen([sys.executable, "-c", WORKER, str(ROOT)], env=env, cwd=tmp_path,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+               for _ in range(4)]
+    outputs = [worker.communicate(timeout=60) for worker in workers]
+    assert [worker.returncode for worker in workers] == [0] * 4, [err for _, err in outputs]
+    assert len({out.strip() for out, _ in outputs}) == 1
+    assert log.read_text() == "x"
@@ -0,0 +1,135 @@
+# static_server.py: кэш и сжатие статики, ETag/304, параллельная обработка запросов
+import functools
+import gzip
+import http.client
+import os
+import socket
+import threading
+
+import pytest
+
+import static_server
+from static_server import CachedRequestHandler, FileCache, FrontendServer
+
+APP_JS = ("function render(data) { return data.map(item => item.name); }\n" * 100).encode()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(static_server, "file_cache", FileCache(max_file_size=64 * 1024))
+    (tmp_path / "index.html").write_text("<html>СА ДО</html>", encoding="utf-8")
+    (tmp_path / "app.js").write_bytes(APP_JS)
+    (tmp_path / "big.bin").write_bytes(os.urandom(128 * 1024))
+    handler = functools.partial(CachedRequestHandler, directory=str(tmp_path))
+    httpd = FrontendServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield tmp_path, httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(port, path, headers=None, conn=None):
+    conn = conn or http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("GET", path, headers=headers or {})
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_index_and_missing_file(server):
+    _, port = server
+    response, body = get(port, "/")
+    assert response.status == 200
+    assert body.decode("utf-8") == "<html>СА ДО</html>"
+    assert get(port, "/missing.js")[0].status == 404
+
+
+def test_compressed_variant_and_not_modified(server):
+    _, port = server
+    plain, body = get(port, "/app.js")
+    assert body == APP_JS
+    assert plain.getheader("Vary") == "Accept-Encoding"
+    etag = plain.getheader("ETag")
+
+    compressed, body = get(port, "/app.js", {"Accept-Encoding": "gzip"})
+    assert compressed.getheader("Content-Encoding") == "gzip"
+    assert compressed.getheader("ETag") == etag[:-1] + '-gzip"'
+    assert gzip.decompress(body) == APP_JS
+    assert get(port, "/app.js", {"Accept-Encoding": "gzip;q=0"})[0].getheader("Content-Encoding") is None
+
+    for tag in (etag, compressed.getheader("ETag"), "W/" + etag):
+        response, body = get(port, "/app.js", {"If-None-Match": tag})
+        assert response.status == 304
+        assert body == b""
+    assert get(port, "/app.js", {"If-None-Match": '"other"'})[0].status == 200
+    assert get(port, "/app.js", {"If-Modified-Since": plain.getheader("Last-Modified")})[0].status == 304
+
+
+def test_changed_file_is_reloaded(server):
+    root, port = server
+    first, _ = get(port, "/app.js")
+    path = root / "app.js"
+    path.write_bytes(b"console.log('v2');")
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    response, body = get(port, "/app.js", {"If-None-Match": first.getheader("ETag")})
+    assert response.status == 200
+    assert body == b"console.log('v2');"
+
+
+def test_large_file_is_not_cached(server):
+    root, port = server
+    response, body = get(port, "/big.bin")
+    assert response.status == 200
+    assert body == (root / "big.bin").read_bytes()
+    get(port, "/app.js")
+    assert str(root / "app.js") in static_server.file_cache._entries
+    assert str(root / "big.bin") not in static_server.file_cache._entries
+
+
+def test_cache_is_bounded_by_bytes(tmp_path):
+    paths = []
+    for name in "abc":
+        path = tmp_path / f"{name}.bin"
+        path.write_bytes(os.urandom(400))
+        paths.append(str(path))
+    cache = FileCache(max_bytes=1000)
+
+    def load(path):
+        return cache.get(path, os.stat(path), "application/octet-stream")
+
+    load(paths[0])
+    load(paths[1])
+    load(paths[0])  # a запрошен недавно - вытесняется b
+    load(paths[2])
+    assert list(cache._entries) == [paths[0], paths[2]]
+    assert cache.nbytes == 800
+
+    # Перезагрузка измененного файла не учитывается дважды
+    with open(paths[0], "ab") as f:
+        f.write(b"x" * 100)
+    assert load(paths[0]).body.endswith(b"x" * 100)
+    assert list(cache._entries) == [paths[2], paths[0]]
+    assert cache.nbytes == 900
+
+    # Файл больше всего кэша отдается, но не вытесняет остальные
+    big = tmp_path / "big.js"
+    big.write_bytes(os.urandom(2000))
+    assert load(str(big)).body == big.read_bytes()
+    assert list(cache._entries) == [paths[2], paths[0]]
+
+
+def test_keep_alive_and_concurrent_clients(server):
+    _, port = server
+    # Клиент, который открыл соединение и молчит, не задерживает остальных
+    idle = socket.create_connection(("127.0.0.1", port))
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        for _ in range(3):
+            response, body = get(port, "/app.js", conn=conn)
+            assert response.status == 200
+            assert body == APP_JS
+        conn.close()
+    finally:
+        idle.close()
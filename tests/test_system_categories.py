@@ -0,0 +1,58 @@
+# Категории видов систем: маски, которые ведут триггеры, совпадают с классификацией заново
+from schema import SYSTEM_CATEGORIES, _rule_regex, classify_system_types, normalize_system_type
+
+
+def expected_mask(system_type, rules):
+    if system_type is None:
+        return None
+    normalized = normalize_system_type(system_type)
+    mask = 0
+    for code, pattern in rules:
+        if _rule_regex(pattern).fullmatch(normalized):
+            mask |= 1 << code
+    return mask
+
+
+def rules(conn):
+    return conn.execute("SELECT code, pattern FROM system_type_rules").fetchall()
+
+
+def categories(conn):
+    return conn.execute("SELECT id, system_type, system_category FROM sa_data_details ORDER BY id").fetchall()
+
+
+def test_masks_after_migration(conn):
+    current = rules(conn)
+    assert {row[1] for row in current} == {p for _, _, patterns in SYSTEM_CATEGORIES.values() for p in patterns}
+    for _, system_type, mask in categories(conn):
+        assert mask == expected_mask(system_type, current)
+
+
+def test_known_types_are_classified_by_trigger(written):
+    # Вид, уже бывший в system_type_class, получает маску сразу при записи
+    row = written.execute("SELECT system_category FROM sa_data_details "
+                          "WHERE id = (SELECT MAX(id) FROM sa_data_details)").fetchone()
+    assert row == (expected_mask("САУ ГПА", rules(written)),)
+    # Новый вид ждет classify_system_types()
+    row = written.execute("SELECT system_category FROM sa_data_details WHERE system_type = 'АСПС КС'").fetchone()
+    assert row == (None,)
+
+
+def test_classify_matches_rules_after_writes(written):
+    assert classify_system_types(written) > 0
+    current = rules(written)
+    for _, system_type, mask in categories(written):
+        assert mask == expected_mask(system_type, current)
+    assert classify_system_types(written) == 0
+
+
+def test_rule_changes_reclassify(written):
+    written.execute("INSERT INTO system_type_rules (code, pattern) VALUES (3, '%скважин%')")
+    written.execute("DELETE FROM system_type_rules WHERE pattern = '%ГПА%'")
+    written.commit()
+    classify_system_types(written)
+    current = rules(written)
+    for _, system_type, mask in categories(written):
+        assert mask == expected_mask(system_type, current)
+    assert written.execute("SELECT system_category & 8 FROM sa_data_details "
+                           "WHERE system_type = 'Новая СТМ скважин'").fetchone() == (8,)
@@ -0,0 +1,174 @@
+# Потоковая выдача tech-data: состав ответа, страницы по id и возврат соединений stream_pool
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+import database as db
+from main import execute_do_tech_data
+
+
+def in_use(pool) -> int:
+    return pool._created - pool._idle.qsize()
+
+
+def expected_ids(do_id, year):
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        return [row[0] for row in conn.execute("""
+            SELECT sdd.id FROM sa_data_details sdd JOIN sa_data sd ON sdd.sa_data_id = sd.id
+            JOIN sa s ON sd.sa_id = s.id WHERE s.do_id = ? AND sd.year = ? ORDER BY sdd.id
+        """, (do_id, year))]
+    finally:
+        conn.close()
+
+
+def test_json_and_ndjson_bodies(client):
+    expected = expected_ids(2, 2023)
+    body = client.get("/api/do/2/tech-data", params={"year": 2023}).json()
+    assert body["year"] == 2023
+    assert [detail["id"] for detail in body["details"]] == expected
+    assert body["next_cursor"] is None
+
+    response = client.get("/api/do/2/tech-data", params={"year": 2023, "format": "ndjson",
+                                                          "fields": ["Наименование объекта", "Тип ПЛК"]})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == expected
+    assert all(set(line) == {"id", "Наименование объекта", "Тип ПЛК"} for line in lines)
+    assert in_use(db.stream_pool) == 0
+
+
+def test_pages_by_cursor(client):
+    expected = expected_ids(3, 2022)
+    ids, cursor = [], 0
+    while True:
+        body = client.get("/api/do/3/tech-data", params={"year": 2022, "limit": 4, "cursor": cursor}).json()
+        ids.extend(detail["id"] for detail in body["details"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == expected
+
+
+def test_held_streams_do_not_block_queries():
+    def query_one(cursor):
+        cursor.execute("SELECT 1")
+        return cursor.fetchone()[0]
+
+    async def scenario():
+        streams = [db.stream(execute_do_tech_data, 1, 2022, [], 0, None, batch_size=1)
+                   for _ in range(db.STREAM_POOL_SIZE)]
+        for rows in streams:
+            assert len(await rows.__anext__()) == 1
+        assert in_use(db.stream_pool) == db.STREAM_POOL_SIZE
+
+        # Пул обычных запросов свободен, пока потоковые выдачи держат свои соединения
+        results = await asyncio.wait_for(asyncio.gather(*(db.run(query_one) for _ in range(2 * db.POOL_SIZE))),
+                                         timeout=5)
+        assert results == [1] * (2 * db.POOL_SIZE)
+
+        # Следующая выдача ждет места и получает его, когда одна из начатых закрыта
+        waiting = db.stream(execute_do_tech_data, 1, 2022, [], 0, None, batch_size=1)
+        first = asyncio.ensure_future(waiting.__anext__())
+        await asyncio.sleep(0.05)
+        assert not first.done()
+        await streams[0].aclose()
+        assert len(await asyncio.wait_for(first, timeout=5)) == 1
+
+        for rows in streams[1:] + [waiting]:
+            await rows.aclose()
+        assert in_use(db.stream_pool) == 0
+
+    asyncio.run(scenario())
+
+
+def request_scope(query_string: bytes):
+    return {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": "/api/do/1/tech-data", "raw_path": b"/api/do/1/tech-data",
+            "query_string": query_string, "root_path": "", "headers": [(b"host", b"test")],
+            "client": ("test", 1), "server": ("test", 80)}
+
+
+def test_client_disconnect_releases_connection(client):
+    from main import app
+
+    scope = request_scope(b"year=2022&format=ndjson")
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message["type"])
+        if message["type"] == "http.response.body":
+            raise OSError("клиент отключился")
+
+    async def scenario():
+        try:
+            await app(scope, receive, send)
+        except (OSError, ClientDisconnect):
+            pass
+        # Проверка - до закрытия event loop, который сам финализирует брошенные генераторы
+        assert in_use(db.stream_pool) == 0
+
+    asyncio.run(scenario())
+    assert "http.response.body" in sent
+
+
+def failing_stream(fail_after: int):
+    """db.stream, который отдает fail_after пачек по одной строке и затем падает"""
+    stream = db.stream
+
+    async def failing(fn, *args, **kwargs):
+        rows = stream(fn, *args, batch_size=1)
+        try:
+            for _ in range(fail_after):
+                yield await rows.__anext__()
+            raise sqlite3.OperationalError("database is locked")
+        finally:
+            await rows.aclose()
+
+    return failing
+
+
+@pytest.mark.parametrize("format", ["json", "ndjson"])
+def test_error_mid_stream_aborts_response(client, monkeypatch, format):
+    from main import app
+
+    monkeypatch.setattr(db, "stream", failing_stream(2))
+    messages = []
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        messages.append(message)
+
+    async def scenario():
+        with pytest.raises(sqlite3.OperationalError):
+            await app(request_scope(f"year=2022&format={format}".encode()), receive, send)
+        assert in_use(db.stream_pool) == 0
+
+    asyncio.run(scenario())
+    assert messages[0]["status"] == 200
+    # Ответ не завершен: последнего сообщения без more_body нет, и частичное тело - не JSON
+    bodies = [message for message in messages if message["type"] == "http.response.body"]
+    assert bodies and all(message.get("more_body") for message in bodies)
+    body = b"".join(message["body"] for message in bodies).decode()
+    if format == "json":
+        with pytest.raises(json.JSONDecodeError):
+            json.loads(body)
+    else:
+        assert len(body.splitlines()) == 2
+
+
+def test_error_before_first_batch_is_not_streamed(client, monkeypatch):
+    monkeypatch.setattr(db, "stream", failing_stream(0))
+    response = client.get("/api/do/1/tech-data", params={"year": 2022})
+    assert response.json() == {"do_name": "", "year": 2022, "details": []}
+    assert response.headers["cache-control"] == "no-store"
+    assert "etag" not in response.headers
+    assert in_use(db.stream_pool) == 0
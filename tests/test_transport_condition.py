@@ -0,0 +1,72 @@
+# condition-detailed: фильтр и возрастные группы в SQL совпадают с прежней фильтрацией в Python
+import sqlite3
+from collections import Counter
+
+import pytest
+
+from main import TRANSPORT_SYSTEM_FILTERS, query_transport_condition_detailed
+from schema import classify_system_types
+
+# Ключевые слова прежнего фильтра "как в Tkinter"
+SYSTEM_KEYWORDS = {
+    "АСУ ТП УКПГ (УППГ)": ["УКПГ", "УППГ"],
+    "АСУ ТП": ["АСУ ТП"],
+    "САУ ГПА": ["САУ ГПА", "ГПА"],
+    "АСПС": ["АСПС", "пожар"],
+    "СТМ": ["СТМ", "телемех"],
+}
+
+
+def age_group(age):
+    if age <= 12:
+        return "до 12 лет"
+    elif age <= 24:
+        return "12-24 года"
+    return "более 25 лет"
+
+
+def baseline(conn, system_filter, reference_year):
+    rows = conn.execute("""
+        SELECT d.name, sdd.system_type, sdd.install_year
+        FROM sa_data_details sdd
+        JOIN sa_data sd ON sdd.sa_data_id = sd.id
+        JOIN sa s ON sd.sa_id = s.id
+        JOIN do d ON s.do_id = d.id
+        WHERE s.do_id IN (SELECT do_id FROM do_sector WHERE sector = 'transport')
+        ORDER BY sdd.id
+    """).fetchall()
+    result = [{"do_name": do_name, "system_type": system_type, "age_group": age_group(reference_year - install_year)}
+              for do_name, system_type, install_year in rows if install_year]
+    if system_filter != "Все системы":
+        keywords = SYSTEM_KEYWORDS.get(system_filter, [])
+        result = [item for item in result
+                  if item["system_type"] and any(keyword in item["system_type"] for keyword in keywords)]
+    return result
+
+
+@pytest.fixture
+def classified(written):
+    classify_system_types(written)
+    written.row_factory = sqlite3.Row
+    return written
+
+
+@pytest.mark.parametrize("system_filter", ["Все системы", *TRANSPORT_SYSTEM_FILTERS, "Неизвестный"])
+@pytest.mark.parametrize("reference_year", [2024, 2040])
+def test_filter_and_buckets_match_python(classified, system_filter, reference_year):
+    expected = baseline(classified, system_filter, reference_year)
+    rows = query_transport_condition_detailed(classified.cursor(), system_filter, False, reference_year)
+    assert rows == expected
+    assert bool(rows) == (system_filter != "Неизвестный")
+
+    aggregated = query_transport_condition_detailed(classified.cursor(), system_filter, True, reference_year)
+    counts = Counter((item["do_name"], item["age_group"]) for item in expected)
+    assert aggregated == [{"do_name": do_name, "age_group": group, "count": count}
+                          for (do_name, group), count in sorted(counts.items())]
+
+
+def test_endpoint_aggregate(client):
+    detailed = client.get("/api/analytics/transport/condition-detailed", params={"system_filter": "СТМ"}).json()
+    aggregated = client.get("/api/analytics/transport/condition-detailed",
+                            params={"system_filter": "СТМ", "aggregate": "true"}).json()
+    assert sum(item["count"] for item in aggregated) == len(detailed)
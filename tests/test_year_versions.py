@@ -0,0 +1,60 @@
+# year_versions: версия года растет при записи в его данные и только в них; опорный год по умолчанию
+from schema import DEFAULT_REFERENCE_YEAR
+
+
+def versions(conn):
+    return dict(conn.execute("SELECT year, version FROM year_versions").fetchall())
+
+
+def detail_in(conn, year):
+    return conn.execute("SELECT sdd.id FROM sa_data_details sdd JOIN sa_data sd ON sdd.sa_data_id = sd.id "
+                        "WHERE sd.year = ? ORDER BY sdd.id LIMIT 1", (year,)).fetchone()[0]
+
+
+def test_detail_writes_bump_only_their_year(conn):
+    before = versions(conn)
+    assert set(before) == {2022, 2023}
+
+    conn.execute("UPDATE sa_data_details SET detail_json = json_set(detail_json, '$.\"Эксплуатационный износ\"', 99) "
+                 "WHERE id = ?", (detail_in(conn, 2022),))
+    conn.commit()
+    after = versions(conn)
+    assert after[2022] > before[2022]
+    assert after[2023] == before[2023]
+
+    # Изменение, не влияющее на агрегаты, версию не меняет
+    conn.execute("UPDATE sa_data_details SET test_stage = 'Завершено' WHERE id = ?", (detail_in(conn, 2023),))
+    conn.commit()
+    assert versions(conn) == after
+
+    conn.execute("DELETE FROM sa_data_details WHERE id = ?", (detail_in(conn, 2023),))
+    conn.commit()
+    assert versions(conn)[2023] > after[2023]
+
+
+def test_moving_a_report_bumps_both_years(conn):
+    before = versions(conn)
+    sa_data_id = conn.execute("SELECT id FROM sa_data WHERE year = 2022 LIMIT 1").fetchone()[0]
+    conn.execute("UPDATE sa_data SET year = 2024 WHERE id = ?", (sa_data_id,))
+    conn.commit()
+    after = versions(conn)
+    assert after[2022] > before[2022]
+    assert 2024 in after
+    assert after[2023] == before[2023]
+
+
+def test_summary_writes_bump_their_year(conn):
+    before = versions(conn)
+    conn.execute("UPDATE automation_summary SET value = '1' WHERE year = 2023 AND do_id = 1")
+    conn.commit()
+    after = versions(conn)
+    assert after[2023] > before[2023]
+    assert after[2022] == before[2022]
+
+
+def test_default_reference_year(client):
+    assert DEFAULT_REFERENCE_YEAR == 2024
+    default = client.get("/api/analytics/age-stats").json()
+    explicit = client.get("/api/analytics/age-stats", params={"reference_year": 2024}).json()
+    assert default == explicit
+    assert client.get("/api/analytics/age-stats", params={"reference_year": 1900}).status_code == 422